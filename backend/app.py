@@ -5,7 +5,9 @@ import logging
 import os
 from routes.llmkg.llm_api import llm_bp
 from routes.llmkg.kg_api import kg_bp
+from routes.llmkg.jobs_api import jobs_bp
 from services.llmkg.kg_service import neo4j_service
+from services.llmkg.vector_store import start_index_watcher, start_warmup
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +38,12 @@ def create_app():
     # 注册蓝图
     app.register_blueprint(llm_bp, url_prefix='/api/llm')
     app.register_blueprint(kg_bp, url_prefix='/api/kg')
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+
+    # 向量索引文件被其他进程重建或增量更新时自动热加载
+    start_index_watcher()
+    # 后台预加载嵌入模型和向量索引
+    start_warmup()
 
     # neo4j前端配置
     def _neo4j_frontend_config():
@@ -1,4 +1,5 @@
 from .kg_api import kg_bp
 from .llm_api import llm_bp
+from .jobs_api import jobs_bp
 
-__all__ = ["kg_bp", "llm_bp"]
+__all__ = ["kg_bp", "llm_bp", "jobs_bp"]
@@ -1,4 +1,5 @@
 from flask import Blueprint
 
 kg_bp = Blueprint('kg', __name__)
-llm_bp = Blueprint('llm', __name__)
\ No newline at end of file
+llm_bp = Blueprint('llm', __name__)
+jobs_bp = Blueprint('jobs', __name__)
\ No newline at end of file
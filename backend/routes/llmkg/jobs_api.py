@@ -0,0 +1,31 @@
+from flask import request, jsonify
+from services.llmkg.job_runner import get_job, list_jobs, cancel_job
+from .blueprint import jobs_bp
+
+
+@jobs_bp.route('', methods=['GET'])
+def jobs_list():
+    """Recent background jobs, newest first. ?kind=build_index&limit=50"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        return jsonify({'success': True, 'jobs': list_jobs(kind=request.args.get('kind') or None, limit=limit)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status, progress, throughput (units/s), ETA (s) and result of one job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    """Request cancellation of a queued or running job."""
+    res = cancel_job(job_id)
+    if not res.get('success'):
+        return jsonify(res), 404 if res.get('error') == 'job not found' else 409
+    return jsonify(res)
@@ -2,6 +2,7 @@ from flask import request, jsonify
 from services.llmkg.kg_service import neo4j_service
 from services.llmkg.audit import audit_cypher
 from services.llmkg.schema_store import load_schema, generate_schema_from_import
+from services.llmkg.job_runner import submit_job
 from .blueprint import kg_bp
 import os
 import json
@@ -41,27 +42,13 @@ def graph_data():
 def text_db():
     """Return a slice of the local text database for inspection."""
     try:
-        import os, json
-        base = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'text_data')
-        path = os.path.join(base, 'total.jsonl')
-        if not os.path.exists(path):
-            return jsonify({'success': False, 'error': 'text DB file not found'}), 404
-
-        # try parse as JSON array first, fall back to JSONL
-        with open(path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        try:
-            data = json.loads(text)
-        except Exception:
-            data = []
-            for line in text.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data.append(json.loads(line))
-                except Exception:
-                    continue
+        from services.llmkg import storage
+        from services.llmkg.text_db import get_text_db
+        if not storage.use_sqlite():
+            base = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'text_data')
+            if not os.path.exists(os.path.join(base, 'total.jsonl')):
+                return jsonify({'success': False, 'error': 'text DB file not found'}), 404
+        data = get_text_db().documents()
 
         # filtering support
         q = (request.args.get('q') or '').strip()
@@ -79,55 +66,134 @@ def text_db():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@kg_bp.route('/textdb/vector_search', methods=['GET'])
+@kg_bp.route('/textdb/vector_search', methods=['GET', 'POST'])
 def textdb_vector_search():
-    """Vector search over text DB."""
+    """Vector search over text DB.
+
+    GET ?q=...&k=5 for one query; repeat `q` or POST {"queries": [...], "k": 5}
+    to search several queries in one batch. mode=hybrid|lexical adds the
+    n-gram BM25 ranking (single query). Metadata filters: POST "filters"
+    ({"source": "memory", "defect": [...], "created_at": {"gte": ...}}) or
+    GET source=, defect= (repeatable), since=, until=.
+    """
     try:
-        q = (request.args.get('q') or '').strip()
-        if not q:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            queries = data.get('queries') or ([data['q']] if data.get('q') else [])
+            params = data
+            filters = data.get('filters') or None
+        else:
+            queries = request.args.getlist('q')
+            params = request.args
+            filters = {name: request.args.getlist(name) for name in ('source', 'defect') if request.args.get(name)}
+            created = {op: request.args[arg] for op, arg in (('gte', 'since'), ('lte', 'until')) if request.args.get(arg)}
+            if created:
+                filters['created_at'] = created
+            filters = filters or None
+        if filters is not None and not isinstance(filters, dict):
+            return jsonify({'success': False, 'error': 'filters must be an object'}), 400
+        queries = [str(q).strip() for q in queries if str(q or '').strip()]
+        if not queries:
             return jsonify({'success': False, 'error': 'q is required'}), 400
-        k = int(request.args.get('k', 5))
+        k = int(params.get('k', 5))
+        nprobe = int(params['nprobe']) if params.get('nprobe') else None
+        ef_search = int(params['ef_search']) if params.get('ef_search') else None
+        rerank = int(params['rerank']) if params.get('rerank') not in (None, '') else None
+        mode = params.get('mode') or 'vector'
         from services.llmkg import vector_store
-        res = vector_store.search(q, k=k)
+        if mode != 'vector':
+            if mode not in vector_store.HYBRID_MODES or len(queries) != 1:
+                return jsonify({'success': False, 'error': 'mode must be hybrid/lexical/vector; hybrid and lexical take one query'}), 400
+            res = vector_store.search_hybrid(queries[0], k=k, nprobe=nprobe, ef_search=ef_search, mode=mode, filters=filters)
+        elif len(queries) == 1 and request.method == 'GET':
+            res = vector_store.search(queries[0], k=k, nprobe=nprobe, ef_search=ef_search, rerank=rerank, filters=filters)
+        else:
+            res = vector_store.search_many(queries, k=k, nprobe=nprobe, ef_search=ef_search, rerank=rerank, filters=filters)
+            if res.get('success'):
+                res['queries'] = queries
         return jsonify(res)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _job_response(submitted, what: str):
+    """202 with the new job, or 409 pointing at the job already running."""
+    job = submitted['job']
+    body = {'job_id': job['id'], 'status': job['status'], 'status_url': f"/api/jobs/{job['id']}"}
+    if submitted['duplicate']:
+        return jsonify(dict(body, success=False, error=f'{what} already in progress')), 409
+    return jsonify(dict(body, success=True)), 202
+
+
+def _build_index_job(ctx, path, model_path, index_type, memory_budget_mb, compression, shard=None, workers=None):
+    from services.llmkg import vector_store
+    ctx.progress(0, stage='loading')
+    if path:
+        texts = vector_store._read_text_file(path)
+    else:
+        from services.llmkg.text_db import get_text_db
+        texts = get_text_db().documents()
+    if not texts:
+        raise ValueError('no texts to index')
+    if shard is not None:
+        ctx.progress(0, stage=f'shard {shard}')
+        res = vector_store.rebuild_shard(shard, texts, model_path, index_type=index_type,
+                                         memory_budget_mb=memory_budget_mb, compression=compression)
+        return {'shard': shard, 'count': res.get('count'), 'index_type': res.get('index_type'),
+                'compression': res.get('compression')}
+    ctx.progress(0, stage='embedding')
+    stats = vector_store.build_index_from_texts(texts, model_path=model_path, index_type=index_type,
+                                                memory_budget_mb=memory_budget_mb, compression=compression,
+                                                progress=lambda done, total: ctx.progress(done, total), workers=workers)
+    return dict(vector_store.index_info(), count=len(texts), **stats)
+
+
 @kg_bp.route('/textdb/build_index', methods=['POST'])
 def textdb_build_index():
-    """Build vector index from local text DB (admin operation)."""
+    """Build vector index from local text DB (admin operation).
+
+    Runs as a background job: returns 202 with a job id right away; poll
+    /api/jobs/<id> for progress. 409 while another build is in progress.
+    With VEC_SHARDS set, {"shard": n} rebuilds only that shard. {"workers": n}
+    encodes with n processes (default VEC_BUILD_WORKERS); the job result
+    reports docs_per_sec.
+    """
     try:
         data = request.get_json(silent=True) or {}
         model_path = data.get('model_path') or os.getenv('SENT_MODEL_PATH')
-        import os as _os
-        from services.llmkg import vector_store
-        base = _os.path.join(_os.path.dirname(_os.path.dirname(_os.path.dirname(__file__))), 'data', 'text_data')
-        path = _os.path.join(base, 'total.jsonl')
-        if not _os.path.exists(path):
-            return jsonify({'success': False, 'error': 'text DB file not found'}), 404
-        # load texts
-        with open(path, 'r', encoding='utf-8') as f:
-            txt = f.read()
-        try:
-            texts = json.loads(txt)
-        except Exception:
-            texts = []
-            for line in txt.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    texts.append(json.loads(line))
-                except Exception:
-                    continue
-
-        if not texts:
-            return jsonify({'success': False, 'error': 'no texts to index'}), 400
+        from services.llmkg import vector_store, storage
+        if storage.use_sqlite():
+            # 文本库在 SQLite 中，任务内直接读取
+            path = None
+        else:
+            base = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'text_data')
+            path = os.path.join(base, 'total.jsonl')
+            if not os.path.exists(path):
+                return jsonify({'success': False, 'error': 'text DB file not found'}), 404
         if not model_path:
             return jsonify({'success': False, 'error': 'model_path required'}), 400
-        vector_store.build_index_from_texts(texts, model_path=model_path)
-        return jsonify({'success': True, 'count': len(texts)})
+        index_type = data.get('index_type') or 'auto'
+        if index_type != 'auto' and index_type not in vector_store.INDEX_TYPES:
+            return jsonify({'success': False, 'error': f'unknown index_type: {index_type}'}), 400
+        compression = data.get('compression')
+        if compression and compression != 'auto' and compression not in vector_store.COMPRESSIONS:
+            return jsonify({'success': False, 'error': f'unknown compression: {compression}'}), 400
+        memory_budget_mb = data.get('memory_budget_mb')
+        shard = data.get('shard')
+        if shard is not None:
+            from services.llmkg import shard_pool
+            if shard_pool.SHARD_COUNT <= 0 or not 0 <= int(shard) < shard_pool.SHARD_COUNT:
+                return jsonify({'success': False, 'error': 'shard requires VEC_SHARDS and must be in range'}), 400
+            shard = int(shard)
+        workers = data.get('workers')
+        if workers is not None and (not isinstance(workers, int) or workers < 0):
+            return jsonify({'success': False, 'error': 'workers must be a non-negative integer'}), 400
+        submitted = submit_job('build_index', _build_index_job, {
+            'path': path, 'model_path': model_path, 'index_type': index_type,
+            'memory_budget_mb': int(memory_budget_mb) if memory_budget_mb else None, 'compression': compression,
+            'shard': shard, 'workers': workers,
+        })
+        return _job_response(submitted, 'index build')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -167,26 +233,27 @@ def get_schema():
 def refresh_schema():
     """强制刷新 schema 缓存（从文件加载）。"""
     try:
+        # load_schema 按文件版本戳缓存，文件变化后各进程自动重新读取
         schema = load_schema() or {}
-        # refresh in-memory cache
-        neo4j_service._schema_cache = schema
-        neo4j_service._schema_cache_ts = 0
         return jsonify({'success': True, 'schema': schema, 'cached': False})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _schema_rebuild_job(ctx, import_dir):
+    # 新文件原子替换后，所有 worker 进程的 load_schema 缓存都会因版本戳变化而失效
+    schema = generate_schema_from_import(import_dir=import_dir, progress=lambda done, total: ctx.progress(done, total))
+    return {'schema': schema}
+
+
 @kg_bp.route('/schema/rebuild', methods=['POST'])
 def rebuild_schema_from_import():
-    """读取 import 目录 CSV 生成 schema 文件并返回。"""
+    """读取 import 目录 CSV 生成 schema 文件（后台任务，返回 job_id，结果见 /api/jobs/<id>）。"""
     try:
         payload = request.get_json(silent=True) or {}
         import_dir = payload.get('import_dir') if isinstance(payload, dict) else None
-        schema = generate_schema_from_import(import_dir=import_dir)
-        # refresh cache
-        neo4j_service._schema_cache = schema
-        neo4j_service._schema_cache_ts = 0
-        return jsonify({'success': True, 'schema': schema, 'cached': False})
+        submitted = submit_job('schema_rebuild', _schema_rebuild_job, {'import_dir': import_dir})
+        return _job_response(submitted, 'schema rebuild')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
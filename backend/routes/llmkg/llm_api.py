@@ -44,6 +44,15 @@ def llm_answer_endpoint():
     question = (data.get('question') or '').strip()
     max_rows = int(data.get('max_rows', 200))
     messages = data.get('messages', [])  # 接收对话历史
+    # 长会话：较早的轮次用会话的滚动总结代替，只发送总结之后的原始消息
+    summary = None
+    if data.get('session_id') and isinstance(messages, list):
+        from services.llmkg.session_service import answer_context
+        try:
+            messages_start = max(0, int(data.get('messages_start', 0)))
+        except (TypeError, ValueError):
+            messages_start = 0
+        summary, messages = answer_context(data['session_id'], messages, messages_start)
 
     if not question:
         return jsonify({'success': False, 'error': '问题不能为空'}), 400
@@ -75,6 +84,8 @@ def llm_answer_endpoint():
         try:
             logger.info(f"[API] 开始生成流式响应，问题: {question[:50]}...")
             logger.info(f"[API] messages数量: {len(messages) if messages else 0}")
+            if summary:
+                logger.info(f"[API] 使用会话滚动总结，长度: {len(summary)}")
             
             if test_mode:
                 # Simulated end-to-end flow for testing without external LLM/Neo4j
@@ -95,7 +106,7 @@ def llm_answer_endpoint():
                 chunk_count = 0
                 total_length = 0
                 try:
-                    for chunk in llm_answer_stream_with_db(question, max_rows=max_rows, messages=messages):
+                    for chunk in llm_answer_stream_with_db(question, max_rows=max_rows, messages=messages, summary=summary):
                         chunk_count += 1
                         total_length += len(chunk) if chunk else 0
                         try:
@@ -131,11 +142,22 @@ def llm_answer_endpoint():
 
 @llm_bp.route('/sessions', methods=['GET'])
 def list_sessions_endpoint():
-    """获取所有会话列表"""
+    """获取会话列表：?offset=0&limit=50&sort=updatedAt&order=desc（不传 limit 时返回全部）
+    
+    sort 可选 updatedAt / createdAt / title / messageCount。
+    """
     try:
-        from services.llmkg.session_service import list_sessions
-        sessions = list_sessions()
-        return jsonify({'success': True, 'sessions': sessions})
+        from services.llmkg.session_service import list_sessions_page
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = request.args.get('limit')
+        limit = max(1, int(limit)) if limit else None
+        sort_by = request.args.get('sort', 'updatedAt')
+        descending = request.args.get('order', 'desc').lower() != 'asc'
+        page = list_sessions_page(offset=offset, limit=limit, sort_by=sort_by, descending=descending)
+        return jsonify({'success': True, 'sessions': page['items'], 'total': page['total'],
+                        'offset': page['offset'], 'limit': page['limit']})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -156,12 +178,28 @@ def create_session_endpoint():
 
 @llm_bp.route('/sessions/<session_id>', methods=['GET'])
 def get_session_endpoint(session_id):
-    """获取会话信息和消息"""
+    """获取会话信息和消息
+    
+    ?limit=50 只返回最新的 50 条消息，并附带 page（start / end / total / next_before）；
+    ?limit=50&before=<next_before> 继续向前翻页。不传 limit 时返回全部消息。
+    """
     try:
-        from services.llmkg.session_service import get_session_info, load_session_messages
+        from services.llmkg.session_service import get_session_info, load_session_messages, load_session_page
         info = get_session_info(session_id)
         if not info:
             return jsonify({'success': False, 'error': '会话不存在'}), 404
+        if request.args.get('limit'):
+            try:
+                limit = min(500, max(1, int(request.args['limit'])))
+                before = request.args.get('before')
+                before = max(0, int(before)) if before not in (None, '') else None
+            except ValueError:
+                return jsonify({'success': False, 'error': 'limit/before必须是整数'}), 400
+            page = load_session_page(session_id, limit, before)
+            if page is None:
+                return jsonify({'success': False, 'error': '会话不存在'}), 404
+            messages = page.pop('messages')
+            return jsonify({'success': True, 'session': info, 'messages': messages, 'page': page})
         messages = load_session_messages(session_id)
         return jsonify({
             'success': True,
@@ -174,7 +212,7 @@ def get_session_endpoint(session_id):
 
 @llm_bp.route('/sessions/<session_id>/messages', methods=['POST'])
 def save_session_messages_endpoint(session_id):
-    """保存会话消息"""
+    """保存会话消息（整体重写，用于编辑；新增消息请用 /messages/append）"""
     try:
         from services.llmkg.session_service import save_session_messages
         data = request.get_json() or {}
@@ -191,6 +229,34 @@ def save_session_messages_endpoint(session_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@llm_bp.route('/sessions/<session_id>/messages/append', methods=['POST'])
+def append_session_messages_endpoint(session_id):
+    """追加新消息：{"messages": [...新增消息], "expected_seq": 已保存的消息数}
+    
+    expected_seq 与服务端不一致时返回 409 和当前的 seq，客户端应重新加载会话。
+    """
+    try:
+        from services.llmkg.session_service import append_session_messages
+        data = request.get_json() or {}
+        messages = data.get('messages', [])
+        if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+            return jsonify({'success': False, 'error': 'messages必须是对象数组'}), 400
+        expected_seq = data.get('expected_seq')
+        if expected_seq is not None and (isinstance(expected_seq, bool) or not isinstance(expected_seq, int) or expected_seq < 0):
+            return jsonify({'success': False, 'error': 'expected_seq必须是非负整数'}), 400
+        
+        result = append_session_messages(session_id, messages, expected_seq=expected_seq)
+        if result.get('success'):
+            return jsonify(result)
+        if result.get('conflict'):
+            return jsonify(result), 409
+        if result.get('not_found'):
+            return jsonify(result), 404
+        return jsonify(result), 500
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @llm_bp.route('/sessions/<session_id>/title', methods=['PUT'])
 def update_session_title_endpoint(session_id):
     """更新会话标题"""
@@ -224,11 +290,25 @@ def delete_session_endpoint(session_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _summarize_job(ctx, messages):
+    from services.llmkg.memory_service import summarize_and_save
+    result = summarize_and_save(messages, on_delta=ctx.output)
+    if not result.get('success'):
+        raise RuntimeError(result.get('error', '总结失败'))
+    return result
+
+
 @llm_bp.route('/memory/summarize', methods=['POST'])
 def summarize_memory_endpoint():
-    """总结勾选的消息并保存到memory.jsonl"""
+    """总结勾选的消息并保存到memory.jsonl（后台任务）
+    
+    同一选段已总结过时直接返回 200 和已有记忆（cached=true）；否则返回 202 和 job_id，
+    通过 /api/jobs/<id> 轮询结果（result.memory），或从 stream_url 读取流式总结文本。
+    相同选段正在总结时返回同一个任务。
+    """
     try:
-        from services.llmkg.memory_service import summarize_messages, save_memory
+        from services.llmkg.memory_service import messages_hash, find_summarized
+        from services.llmkg.job_runner import submit_job
         
         data = request.get_json() or {}
         messages = data.get('messages', [])
@@ -236,29 +316,135 @@ def summarize_memory_endpoint():
         if not isinstance(messages, list) or len(messages) == 0:
             return jsonify({'success': False, 'error': '消息列表不能为空'}), 400
         
-        # 调用LLM进行总结
-        summary_result = summarize_messages(messages)
-        if not summary_result.get('success'):
-            return jsonify({'success': False, 'error': summary_result.get('error', '总结失败')}), 500
+        source_hash = messages_hash(messages)
+        cached = find_summarized(source_hash)
+        if cached:
+            return jsonify({'success': True, 'memory_id': cached['id'], 'memory': cached, 'cached': True})
         
-        summary = summary_result.get('summary', '')
-        if not summary:
-            return jsonify({'success': False, 'error': '总结内容为空'}), 500
+        submitted = submit_job('memory_summarize', _summarize_job, {'messages': messages},
+                               key=f'memory_summarize:{source_hash}', queue='llm')
+        job = submitted['job']
+        return jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/api/jobs/{job['id']}",
+            'stream_url': f"/api/llm/memory/summarize/{job['id']}/stream"
+        }), 202
         
-        # 保存到memory.jsonl
-        save_result = save_memory(summary, source_messages=messages)
-        if not save_result.get('success'):
-            return jsonify({'success': False, 'error': save_result.get('error', '保存失败')}), 500
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@llm_bp.route('/memory/summarize/<job_id>/stream', methods=['GET'])
+def summarize_stream_endpoint(job_id):
+    """以纯文本流的形式输出总结任务生成的内容，任务结束时关闭（失败时以 [ERROR] 结尾）"""
+    import time
+    from services.llmkg.job_runner import get_job, read_output, FINAL_STATES
+    
+    if get_job(job_id, with_output=False) is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    
+    def generate():
+        sent, offset = 0, 0
+        while True:
+            job = get_job(job_id, with_output=False)
+            if job is None:
+                return
+            # 只读取输出文件中新增的部分
+            text, offset = read_output(job_id, offset)
+            if text:
+                yield text
+                sent += len(text)
+            if job['status'] == 'succeeded':
+                # 直接复用已有记忆（cached）时没有流式输出，补发最终总结
+                summary = (job.get('result') or {}).get('memory', {}).get('summary') or ''
+                if len(summary) > sent:
+                    yield summary[sent:]
+            if job['status'] in FINAL_STATES:
+                if job['status'] != 'succeeded':
+                    yield f"[ERROR] {job.get('error') or job['status']}"
+                return
+            time.sleep(0.2)
+    
+    return Response(stream_with_context(generate()), mimetype='text/plain; charset=utf-8')
+
+
+@llm_bp.route('/memory', methods=['GET'])
+def list_memories_endpoint():
+    """分页列出记忆记录：?offset=0&limit=20&messages=1（messages=1 时附带原始消息）"""
+    try:
+        from services.llmkg.memory_service import list_memories
         
-        memory_id = save_result.get('memory_id')
-        memory = save_result.get('memory')
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(200, max(1, int(request.args.get('limit', 20))))
+        with_messages = request.args.get('messages', '').lower() in ('1', 'true', 'yes')
+        result = list_memories(offset=offset, limit=limit, with_messages=with_messages)
+        return jsonify(result), (200 if result.get('success') else 500)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset/limit必须是整数'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def _ingest_memories_job(ctx, memory_ids, k, concurrency):
+    from services.llmkg.memory_service import ingest_memories
+    result = ingest_memories(memory_ids, k=k, concurrency=concurrency, progress=lambda done, total: ctx.progress(done, total))
+    if not result.get('success'):
+        raise RuntimeError(result.get('error', '批量更新失败'))
+    return result
+
+
+@llm_bp.route('/memory/batch_update', methods=['POST'])
+def batch_update_memory_endpoint():
+    """批量更新记忆到知识库：{"memory_ids": [...], "k": 5, "concurrency": 4, "background": false}
+    
+    background=true 时作为后台任务执行，返回 202 和 job_id（进度见 /api/jobs/<id>）。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        memory_ids = data.get('memory_ids')
+        if not isinstance(memory_ids, list) or not memory_ids:
+            return jsonify({'success': False, 'error': 'memory_ids必须是非空列表'}), 400
+        k = int(data.get('k', 5))
+        concurrency = int(data['concurrency']) if data.get('concurrency') else None
+        if data.get('background'):
+            from services.llmkg.job_runner import submit_job
+            submitted = submit_job('memory_ingest', _ingest_memories_job,
+                                   {'memory_ids': [str(m) for m in memory_ids], 'k': k, 'concurrency': concurrency})
+            job = submitted['job']
+            body = {'job_id': job['id'], 'status': job['status'], 'status_url': f"/api/jobs/{job['id']}"}
+            if submitted['duplicate']:
+                return jsonify(dict(body, success=False, error='批量更新正在进行中')), 409
+            return jsonify(dict(body, success=True)), 202
         
-        return jsonify({
-            'success': True,
-            'memory_id': memory_id,
-            'memory': memory
-        })
+        from services.llmkg.memory_service import ingest_memories
+        result = ingest_memories(memory_ids, k=k, concurrency=concurrency)
+        return jsonify(result), (200 if result.get('success') else 500)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'k/concurrency必须是整数'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@llm_bp.route('/memory/judge_stats', methods=['GET'])
+def judge_stats_endpoint():
+    """关系判断统计（本地判定次数、LLM 调用次数及跳过比例）"""
+    from services.llmkg.memory_service import get_judge_stats
+    return jsonify({'success': True, 'stats': get_judge_stats()})
+
+
+@llm_bp.route('/memory/<memory_id>', methods=['GET'])
+def get_memory_endpoint(memory_id):
+    """获取单条记忆记录（默认附带原始消息，messages=0 时不读取）"""
+    try:
+        from services.llmkg.memory_service import get_memory_by_id
         
+        with_messages = request.args.get('messages', '1').lower() not in ('0', 'false', 'no')
+        memory = get_memory_by_id(memory_id, with_messages=with_messages)
+        if not memory:
+            return jsonify({'success': False, 'error': '记忆记录不存在'}), 404
+        return jsonify({'success': True, 'memory': memory})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -270,7 +456,7 @@ def update_memory_endpoint():
         from services.llmkg.memory_service import (
             get_memory_by_id,
             find_similar_memories,
-            judge_relationship,
+            classify_relationship,
             append_to_text_db
         )
         
@@ -280,8 +466,8 @@ def update_memory_endpoint():
         if not memory_id:
             return jsonify({'success': False, 'error': 'memory_id不能为空'}), 400
         
-        # 获取记忆记录
-        memory = get_memory_by_id(memory_id)
+        # 获取记忆记录（只需要总结，不读取原始消息）
+        memory = get_memory_by_id(memory_id, with_messages=False)
         if not memory:
             return jsonify({'success': False, 'error': '记忆记录不存在'}), 404
         
@@ -296,8 +482,8 @@ def update_memory_endpoint():
         
         similar_memories = similar_result.get('similar_memories', [])
         
-        # 使用LLM判断关系类型
-        relationship_result = judge_relationship(summary, similar_memories)
+        # 判断关系类型：明确的重复/无关由本地判定，其余交给LLM
+        relationship_result = classify_relationship(summary, similar_memories)
         if not relationship_result.get('success'):
             return jsonify({'success': False, 'error': relationship_result.get('error', '判断关系失败')}), 500
         
@@ -309,6 +495,7 @@ def update_memory_endpoint():
             return jsonify({
                 'success': True,
                 'relationship': relationship,
+                'judged_by': relationship_result.get('judged_by'),
                 'message': '记忆与已有内容高度相似，未添加到知识库',
                 'memory': memory,
                 'similar_memories': similar_memories
@@ -328,9 +515,11 @@ def update_memory_endpoint():
             return jsonify({
                 'success': True,
                 'relationship': relationship,
+                'judged_by': relationship_result.get('judged_by'),
                 'message': f'记忆已添加到知识库（关系类型：{relationship_text}）',
                 'memory': memory,
                 'new_id': append_result.get('new_id'),
+                'indexed': append_result.get('indexed', False),
                 'similar_memories': similar_memories
             })
         else:
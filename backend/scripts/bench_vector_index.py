@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Benchmark the vector index with the real embedding model.
+
+Reports, on a copy of the text DB:
+  - recall@k / latency of every index family against the flat baseline
+    (vector_store.benchmark_index_types);
+  - memory vs. recall of every compression mode, with and without re-ranking
+    (vector_store.benchmark_compression);
+  - end-to-end latency of search / search_many / search_hybrid on an index
+    built into a temporary directory, for cold and cached queries, and of
+    upsert/delete through the delta log.
+
+Usage:
+    python scripts/bench_vector_index.py --model-path models/Jerry0/text2vec-base-chinese
+    python scripts/bench_vector_index.py --limit 5000 --queries 200 --json bench.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# 与 memory_service 的命令行一样直接导入模块，不加载 Neo4j 等服务
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'llmkg'))
+
+import vector_store  # noqa: E402
+
+
+def _latency(fn, items):
+    """Mean / p95 / p99 milliseconds of fn(item) over items."""
+    times = []
+    for item in items:
+        t0 = time.perf_counter()
+        res = fn(item)
+        times.append(time.perf_counter() - t0)
+        if isinstance(res, dict) and not res.get('success', True):
+            raise RuntimeError(res.get('error'))
+    ms = 1000 * np.array(times)
+    return {'n': len(items), 'mean_ms': float(ms.mean()), 'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99))}
+
+
+def _sample_queries(texts, n, seed):
+    """Leading part of random documents, as a stand-in for user questions."""
+    rng = random.Random(seed)
+    picked = rng.sample(texts, min(n, len(texts)))
+    return [t.get('text', '')[:rng.randint(8, 32)] for t in picked if t.get('text')]
+
+
+def bench_serving(texts, queries, model_path, k, index_type, compression):
+    """Latency of the serving path on a freshly built index (temporary directory)."""
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='vec-bench-') as tmp:
+        paths = {'index_path': os.path.join(tmp, 'index.faiss'), 'meta_path': os.path.join(tmp, 'metadata')}
+        stats = vector_store.build_index_from_texts(texts, model_path, index_type=index_type,
+                                                    compression=compression, **paths)
+        report['build'] = stats
+        report['index'] = vector_store.index_info()
+
+        # 首次查询需要编码；再次查询命中查询向量缓存，只剩 FAISS 检索和结果整理
+        report['search_cold'] = _latency(lambda q: vector_store.search(q, k=k), queries)
+        report['search_cached'] = _latency(lambda q: vector_store.search(q, k=k), queries)
+        batch = max(1, min(32, len(queries)))
+        batches = [queries[i:i + batch] for i in range(0, len(queries), batch)]
+        many = _latency(lambda qs: vector_store.search_many(qs, k=k), batches)
+        total_ms = many['mean_ms'] * many['n']
+        many['queries_per_sec'] = 1000.0 * len(queries) / total_ms if total_ms else 0.0
+        report['search_many_cached'] = many
+        report['search_hybrid'] = _latency(lambda q: vector_store.search_hybrid(q, k=k), queries)
+        report['search_lexical'] = _latency(lambda q: vector_store.search_hybrid(q, k=k, mode='lexical'), queries)
+
+        docs = [{'id': f'bench-{i}', 'text': q + ' 补充说明'} for i, q in enumerate(queries[:50])]
+        report['upsert'] = _latency(lambda d: vector_store.upsert_documents([d], model_path, **paths), docs)
+        report['delete'] = _latency(lambda d: vector_store.delete_documents([d['id']], **paths), docs)
+        t0 = time.perf_counter()
+        vector_store.compact_index(**paths)
+        report['compact_seconds'] = time.perf_counter() - t0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall / latency benchmark of the vector index')
+    parser.add_argument('--model-path', default=os.getenv('SENT_MODEL_PATH') or 'models/Jerry0/text2vec-base-chinese')
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(vector_store.__file__), '..', '..', 'data',
+                                                       'text_data', 'total.jsonl'))
+    parser.add_argument('--limit', type=int, default=None, help='Use only the first N documents.')
+    parser.add_argument('--queries', type=int, default=200, help='Number of sampled queries.')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--index-type', default='auto', choices=('auto',) + vector_store.INDEX_TYPES,
+                        help='Index family for the serving benchmark and --compression table (flat if auto).')
+    parser.add_argument('--compression', default='none', choices=vector_store.COMPRESSIONS,
+                        help='Compression of the index used for the serving benchmark.')
+    parser.add_argument('--skip', nargs='*', default=[], choices=('index-types', 'compression', 'serving'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='Also write the full report to this file.')
+    args = parser.parse_args()
+
+    texts = [t for t in vector_store._read_text_file(args.data) if isinstance(t, dict) and t.get('text')]
+    if args.limit:
+        texts = texts[:args.limit]
+    if not texts:
+        parser.error(f'no documents in {args.data}')
+    queries = _sample_queries(texts, args.queries, args.seed)
+    report = {'data': os.path.abspath(args.data), 'docs': len(texts), 'queries': len(queries), 'k': args.k,
+              'model_path': args.model_path}
+    print(f"{len(texts)} docs from {args.data}, {len(queries)} queries, k={args.k}")
+
+    if 'index-types' not in args.skip:
+        rows = vector_store.benchmark_index_types(texts, model_path=args.model_path, queries=queries, k=args.k)
+        report['index_types'] = rows
+        print('\n== index types (recall vs. flat) ==')
+        for row in rows:
+            if 'error' in row:
+                print(f"{row['index_type']:>9}: error {row['error']}")
+                continue
+            print(f"{row['index_type']:>9}: recall@{args.k}={row['recall_at_k']:.3f} "
+                  f"mean={row['latency_ms_mean']:.3f}ms p95={row['latency_ms_p95']:.3f}ms "
+                  f"size={row['index_bytes'] / 1024:.1f}KiB build={row['build_seconds']:.2f}s")
+
+    if 'compression' not in args.skip:
+        index_type = 'flat' if args.index_type == 'auto' else args.index_type
+        rows = vector_store.benchmark_compression(texts, model_path=args.model_path, queries=queries, k=args.k,
+                                                  index_type=index_type)
+        report['compression'] = rows
+        print(f'\n== compression ({index_type}) ==')
+        for row in rows:
+            if 'error' in row:
+                print(f"{row['compression']:>5}: error {row['error']}")
+                continue
+            line = (f"{row['compression']:>5}: {row['bytes_per_vector']:.0f}B/vec "
+                    f"recall@{args.k}={row['recall_at_k']:.3f} mean={row['latency_ms_mean']:.3f}ms")
+            if 'recall_at_k_rerank' in row:
+                line += f" | rerank recall@{args.k}={row['recall_at_k_rerank']:.3f} mean={row['latency_ms_mean_rerank']:.3f}ms"
+            print(line)
+
+    if 'serving' not in args.skip:
+        serving = bench_serving(texts, queries, args.model_path, args.k, args.index_type, args.compression)
+        report['serving'] = serving
+        build = serving['build']
+        print(f"\n== serving ({serving['index'].get('index_type')}, compression={args.compression}) ==")
+        print(f"build: {build['docs']} docs / {build['chunks']} chunks in {build['seconds']:.1f}s "
+              f"({build['docs_per_sec']:.1f} docs/s)")
+        for name in ('search_cold', 'search_cached', 'search_many_cached', 'search_hybrid', 'search_lexical',
+                     'upsert', 'delete'):
+            row = serving[name]
+            line = f"{name:>18}: mean={row['mean_ms']:.2f}ms p95={row['p95_ms']:.2f}ms p99={row['p99_ms']:.2f}ms"
+            if 'queries_per_sec' in row:
+                line += f" ({row['queries_per_sec']:.0f} queries/s)"
+            print(line)
+        print(f"{'compact':>18}: {serving['compact_seconds']:.2f}s")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        print(f'\nreport written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import logging
+import argparse
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+from . import embedding_backend
+
+logger = logging.getLogger(__name__)
+
+
+def _serve(conn: Connection, backend: embedding_backend.EmbeddingBackend):
+    while True:
+        try:
+            cmd, texts, batch_size = conn.recv()
+        except (EOFError, OSError):
+            break
+        if cmd == 'stop':
+            break
+        try:
+            vecs = backend.encode(texts, batch_size=batch_size)
+            vecs = np.asarray(vecs, dtype='float32').reshape(len(texts), -1)
+            conn.send((True, np.ascontiguousarray(embedding_backend._normalized(vecs), dtype='float32')))
+        except Exception as e:
+            logger.exception('编码失败')
+            conn.send((False, f'{type(e).__name__}: {e}'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embedding worker for parallel index builds')
+    parser.add_argument('--model-path', required=True)
+    parser.add_argument('--backend', default=embedding_backend.EMBED_BACKEND)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--cores', default=None, help='Comma-separated CPU ids to pin this process to.')
+    parser.add_argument('--fd', type=int, required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[embed %(process)d] %(levelname)s %(name)s: %(message)s')
+    if args.cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {int(c) for c in args.cores.split(',')})
+    embedding_backend.EMBED_THREADS = args.threads
+    conn = Connection(args.fd)
+    try:
+        backend = embedding_backend.create_backend(args.backend, args.model_path)
+    except Exception as e:
+        # 模型加载失败时对第一个任务回复错误，由主进程终止构建
+        logger.exception('编码进程加载模型失败')
+        try:
+            conn.recv()
+            conn.send((False, f'{type(e).__name__}: {e}'))
+        except (EOFError, OSError):
+            pass
+        return
+    _serve(conn, backend)
+
+
+if __name__ == '__main__':
+    main()
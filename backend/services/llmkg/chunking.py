@@ -0,0 +1,74 @@
+import os
+import re
+from typing import List
+
+# 单个分块的最大字符数，需小于嵌入模型的最大序列长度（256 token）
+CHUNK_CHARS = int(os.getenv('VEC_CHUNK_CHARS', '240'))
+# 相邻分块之间重叠的字符数（按整句回退）
+CHUNK_OVERLAP = int(os.getenv('VEC_CHUNK_OVERLAP', '40'))
+
+# 句子连同结尾标点及其后的空白（空格、换行）一起切出，拼接后与原文一致
+_SENTENCE = re.compile(r'.*?(?:[。！？!?；;…\n]+\s*|$)', re.S)
+_CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split after Chinese/ASCII sentence punctuation and newlines.
+
+    Each sentence keeps its punctuation and the whitespace that follows it,
+    so ''.join(split_sentences(text)) == text.
+    """
+    return [m.group() for m in _SENTENCE.finditer(text or '') if m.group()]
+
+
+def _pieces(sentence: str, max_chars: int) -> List[str]:
+    """Break an over-long sentence at clause punctuation, then hard-cut what is still too long."""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    out = []
+    for clause in (c for c in _CLAUSE_END.split(sentence) if c):
+        while len(clause) > max_chars:
+            out.append(clause[:max_chars])
+            clause = clause[max_chars:]
+        if clause:
+            out.append(clause)
+    return out
+
+
+def _emit(chunks: List[str], units: List[str]):
+    # 分块内部保留原文的空白，只去掉首尾
+    chunk = ''.join(units).strip()
+    if chunk:
+        chunks.append(chunk)
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Sentence-aware chunks of at most `max_chars`, each starting with the tail
+    sentences (up to `overlap` chars) of the previous chunk.
+
+    Texts that fit in one chunk are returned unchanged as a single chunk.
+    """
+    text = text or ''
+    if len(text) <= max_chars:
+        return [text]
+    units = [p for s in split_sentences(text) for p in _pieces(s, max_chars)]
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for unit in units:
+        if current and size + len(unit) > max_chars:
+            _emit(chunks, current)
+            # 回退若干整句作为重叠部分
+            carry: List[str] = []
+            carry_size = 0
+            for prev in reversed(current):
+                if carry_size + len(prev) > overlap or carry_size + len(prev) + len(unit) > max_chars:
+                    break
+                carry.insert(0, prev)
+                carry_size += len(prev)
+            current, size = carry, carry_size
+        current.append(unit)
+        size += len(unit)
+    if current:
+        _emit(chunks, current)
+    return chunks
@@ -0,0 +1,276 @@
+import os
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from text2vec import SentenceModel
+except Exception:
+    SentenceModel = None
+
+try:
+    import torch
+except Exception:
+    torch = None
+
+try:
+    import onnxruntime
+except Exception:
+    onnxruntime = None
+
+try:
+    from transformers import AutoTokenizer, AutoModel
+except Exception:
+    AutoTokenizer = AutoModel = None
+
+logger = logging.getLogger(__name__)
+
+# text2vec: 原始 SentenceModel（基准）；int8: torch 动态量化；onnx / onnx-int8: onnxruntime 推理
+BACKENDS = ('text2vec', 'int8', 'onnx', 'onnx-int8')
+EMBED_BACKEND = os.getenv('VEC_EMBED_BACKEND', 'text2vec')
+# 推理的 intra-op 线程数，0 表示使用库的默认值
+EMBED_THREADS = int(os.getenv('VEC_EMBED_THREADS', '0'))
+MAX_SEQ_LENGTH = int(os.getenv('VEC_MAX_SEQ_LENGTH', '256'))
+# 开启后，非基准后端加载时与 SentenceModel 对比，最小余弦相似度低于阈值时退回基准模型。
+# 对比需要再加载一份完整的基准模型，默认关闭；离线对比见本模块的命令行（python embedding_backend.py）
+VERIFY_ENABLED = os.getenv('VEC_EMBED_VERIFY', '0').lower() in ('1', 'true', 'yes')
+VERIFY_MIN_COSINE = float(os.getenv('VEC_EMBED_VERIFY_MIN_COSINE', '0.99'))
+# 导出的 ONNX 模型位置，默认放在模型目录下的 onnx/
+ONNX_PATH = os.getenv('VEC_ONNX_PATH')
+
+PROBE_TEXTS = [
+    '焊点虚焊导致电路接触不良',
+    'PCB 板短路缺陷的典型原因有铜残留、刻蚀不充分或焊锡膏过多等。',
+    '表面划痕检测',
+    'How to reduce solder bridging on fine-pitch components?',
+]
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _resolve_model_path(model_path: Optional[str]) -> str:
+    # fallback to environment variable if not provided
+    if model_path is None:
+        model_path = os.getenv('SENT_MODEL_PATH')
+    if model_path is None:
+        raise RuntimeError("model_path is required for text2vec SentenceModel (or set SENT_MODEL_PATH env var)")
+    return model_path
+
+
+def _set_torch_threads():
+    if torch is not None and EMBED_THREADS > 0:
+        torch.set_num_threads(EMBED_THREADS)
+
+
+class EmbeddingBackend(ABC):
+    """Sentence encoder interface: `encode(texts, batch_size)` -> (n, dim) float32, not normalized."""
+
+    name = 'base'
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        real_path = os.path.realpath(model_path) if os.path.exists(model_path) else model_path
+        # 不同后端的向量略有差异，缓存命名空间需要区分
+        self.model_id = real_path if self.name == 'text2vec' else f'{real_path}#{self.name}'
+
+    @abstractmethod
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Embeddings of `texts`, encoded `batch_size` at a time."""
+
+
+class Text2VecBackend(EmbeddingBackend):
+    """Reference backend: text2vec SentenceModel as shipped."""
+
+    name = 'text2vec'
+
+    def __init__(self, model_path: str, device: Optional[str] = None):
+        super().__init__(model_path)
+        if SentenceModel is None:
+            raise RuntimeError("text2vec (SentenceModel) is not installed")
+        _set_torch_threads()
+        self.model = SentenceModel(model_path, max_seq_length=MAX_SEQ_LENGTH, device=device)
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype='float32')
+
+
+class Int8Backend(Text2VecBackend):
+    """SentenceModel on CPU with its Linear layers dynamically quantized to int8."""
+
+    name = 'int8'
+
+    def __init__(self, model_path: str):
+        if torch is None:
+            raise RuntimeError("torch is not installed")
+        super().__init__(model_path, device='cpu')
+        self.model.bert = torch.quantization.quantize_dynamic(self.model.bert, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend(EmbeddingBackend):
+    """onnxruntime CPU session over the exported BERT encoder, mean-pooled like SentenceModel."""
+
+    name = 'onnx'
+
+    def __init__(self, model_path: str, quantize: bool = False):
+        if quantize:
+            self.name = 'onnx-int8'
+        super().__init__(model_path)
+        if onnxruntime is None:
+            raise RuntimeError("onnxruntime is not installed")
+        if AutoTokenizer is None:
+            raise RuntimeError("transformers is not installed")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        onnx_path = self._ensure_exported(quantize)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if EMBED_THREADS > 0:
+            options.intra_op_num_threads = EMBED_THREADS
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def _ensure_exported(self, quantize: bool) -> str:
+        """Export the encoder (and its int8 variant) once; later loads reuse the files."""
+        fp32_path = ONNX_PATH or os.path.join(self.model_path, 'onnx', 'model.onnx')
+        if not os.path.exists(fp32_path):
+            if torch is None or AutoModel is None:
+                raise RuntimeError("exporting to ONNX requires torch and transformers")
+            os.makedirs(os.path.dirname(fp32_path), exist_ok=True)
+            model = AutoModel.from_pretrained(self.model_path)
+            model.eval()
+            dummy = self.tokenizer(['导出'], return_tensors='pt')
+            names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in dummy]
+            axes = {n: {0: 'batch', 1: 'seq'} for n in names}
+            axes['last_hidden_state'] = {0: 'batch', 1: 'seq'}
+            tmp = fp32_path + '.tmp'
+            torch.onnx.export(model, tuple(dummy[n] for n in names), tmp, input_names=names,
+                              output_names=['last_hidden_state'], dynamic_axes=axes, opset_version=14)
+            os.replace(tmp, fp32_path)
+            logger.info('已导出 ONNX 模型: %s', fp32_path)
+        if not quantize:
+            return fp32_path
+        int8_path = os.path.splitext(fp32_path)[0] + '.int8.onnx'
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        return int8_path
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype='float32')
+        # 按长度排序分批，减少 padding
+        order = np.argsort([-len(t) for t in texts])
+        out = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            batch_idx = order[start:start + batch_size]
+            features = self.tokenizer([texts[i] for i in batch_idx], max_length=MAX_SEQ_LENGTH,
+                                      padding=True, truncation=True, return_tensors='np')
+            feeds = {n: features[n].astype('int64') for n in self.input_names if n in features}
+            hidden = self.session.run(None, feeds)[0]
+            mask = features['attention_mask'][..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            for i, vec in zip(batch_idx, pooled):
+                out[i] = vec
+        return np.asarray(out, dtype='float32')
+
+
+def create_backend(name: str, model_path: str) -> EmbeddingBackend:
+    if name == 'text2vec':
+        return Text2VecBackend(model_path)
+    if name == 'int8':
+        return Int8Backend(model_path)
+    if name == 'onnx':
+        return OnnxBackend(model_path)
+    if name == 'onnx-int8':
+        return OnnxBackend(model_path, quantize=True)
+    raise ValueError(f'unknown embedding backend: {name}')
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def compare_backends(candidate: EmbeddingBackend, reference: EmbeddingBackend, texts: Optional[List[str]] = None) -> float:
+    """Minimum cosine similarity between the two backends' embeddings of `texts`."""
+    texts = texts or PROBE_TEXTS
+    a = _normalized(candidate.encode(texts, batch_size=len(texts)))
+    b = _normalized(reference.encode(texts, batch_size=len(texts)))
+    return float(np.min(np.sum(a * b, axis=1)))
+
+
+def get_backend(model_path: Optional[str] = None, name: Optional[str] = None) -> EmbeddingBackend:
+    """Process-wide encoder; concurrent first callers wait for a single load.
+
+    With VEC_EMBED_VERIFY=1 a non-reference backend is checked against the
+    text2vec model once at load (see VERIFY_MIN_COSINE).
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is not None:
+            return _backend
+        model_path = _resolve_model_path(model_path)
+        name = name or EMBED_BACKEND
+        t0 = time.perf_counter()
+        backend = create_backend(name, model_path)
+        if name != 'text2vec' and VERIFY_ENABLED:
+            reference = Text2VecBackend(model_path)
+            min_cos = compare_backends(backend, reference)
+            if min_cos < VERIFY_MIN_COSINE:
+                logger.warning('嵌入后端 %s 与基准模型的最小余弦相似度 %.4f 低于 %.4f，改用 text2vec', name, min_cos, VERIFY_MIN_COSINE)
+                backend = reference
+            else:
+                logger.info('嵌入后端 %s 校验通过，最小余弦相似度 %.4f', name, min_cos)
+        logger.info('嵌入模型已加载: %s (%s, %.1fs)', model_path, backend.name, time.perf_counter() - t0)
+        _backend = backend
+    return _backend
+
+
+def benchmark_backends(model_path: str, texts: List[str], backends=BACKENDS, batch_size: int = 64) -> List[Dict[str, Any]]:
+    """Encode throughput of each backend plus its agreement with the reference model."""
+    reference = Text2VecBackend(model_path)
+    report = []
+    for name in backends:
+        row = {'backend': name}
+        try:
+            backend = reference if name == 'text2vec' else create_backend(name, model_path)
+            backend.encode(texts[:batch_size], batch_size=batch_size)  # 预热
+            t0 = time.perf_counter()
+            backend.encode(texts, batch_size=batch_size)
+            elapsed = time.perf_counter() - t0
+            row['texts_per_sec'] = len(texts) / elapsed if elapsed > 0 else 0.0
+            t0 = time.perf_counter()
+            for text in texts[:50]:
+                backend.encode([text], batch_size=1)
+            row['query_ms'] = 1000 * (time.perf_counter() - t0) / max(1, min(50, len(texts)))
+            row['min_cosine'] = 1.0 if backend is reference else compare_backends(backend, reference, texts[:256])
+        except Exception as e:
+            row['error'] = str(e)
+        report.append(row)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Compare embedding backends (throughput and agreement with text2vec)')
+    parser.add_argument('--model-path', default=os.getenv('SENT_MODEL_PATH') or 'models/Jerry0/text2vec-base-chinese')
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'text_data', 'total.jsonl'))
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+    with open(args.data, 'r', encoding='utf-8') as f:
+        corpus = [json.loads(line).get('text', '') for line in f if line.strip()]
+    for row in benchmark_backends(args.model_path, corpus, batch_size=args.batch_size):
+        if 'error' in row:
+            print(f"{row['backend']:>9}: error {row['error']}")
+            continue
+        print(f"{row['backend']:>9}: {row['texts_per_sec']:.1f} texts/s, query {row['query_ms']:.1f}ms, "
+              f"min cosine vs text2vec {row['min_cosine']:.4f}")
@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+KEY_BYTES = 20  # sha1 digest
+
+
+def normalize_text(text: str) -> str:
+    """NFKC + collapsed whitespace, so cosmetic edits don't invalidate cached embeddings."""
+    return ' '.join(unicodedata.normalize('NFKC', text or '').split())
+
+
+def content_key(model_id: str, text: str) -> bytes:
+    """Cache key: sha1 over model id + normalized text."""
+    payload = (model_id or '') + '\x00' + normalize_text(text)
+    return hashlib.sha1(payload.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """Append-only on-disk embedding cache.
+
+    Layout inside `cache_dir`:
+        header.json  {"dim": int, "dtype": "float16"}
+        keys.bin     fixed-width 20-byte keys, row i <-> vector i
+        vectors.bin  row-major matrix read back through np.memmap
+        .lock        flock taken by writers
+
+    Several processes (index shard workers, the build pool) may share one
+    cache dir: appends hold an exclusive flock on `.lock` and take their
+    row numbers from the file sizes under it, and rows appended by other
+    processes are picked up before each lookup.
+    """
+
+    def __init__(self, cache_dir: str, dtype: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.header_path = os.path.join(cache_dir, 'header.json')
+        self.keys_path = os.path.join(cache_dir, 'keys.bin')
+        self.vectors_path = os.path.join(cache_dir, 'vectors.bin')
+        self.lock_path = os.path.join(cache_dir, '.lock')
+        self.dtype = np.dtype(dtype or os.getenv('VEC_CACHE_DTYPE', 'float16'))
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        # keys.bin 中已读入的行数（重复的 key 也占一行，可能大于 len(self._rows)）
+        self._count = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive cross-process lock for writers (in-process lock held by the caller)."""
+        with open(self.lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _load(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock, self._file_lock():
+            self._sync(repair=True)
+
+    def _sync(self, repair: bool = False):
+        """Read keys appended since the last sync (in-process lock held).
+
+        With repair=True (file lock held, so no append is in flight) a tail
+        left by a crashed writer is truncated so both files hold the same rows.
+        """
+        if self.dim is None:
+            if not os.path.exists(self.header_path):
+                return
+            with open(self.header_path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+            self.dim = int(header['dim'])
+            self.dtype = np.dtype(header.get('dtype', self.dtype.name))
+        row_bytes = self.dim * self.dtype.itemsize
+        key_size = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        vec_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        # 向量先于 key 写入，key 只会指向已落盘的向量
+        n = min(key_size // KEY_BYTES, vec_size // row_bytes)
+        if repair:
+            # 崩溃可能留下不完整的尾部，截断到两边一致的行数
+            if key_size != n * KEY_BYTES:
+                with open(self.keys_path, 'r+b') as f:
+                    f.truncate(n * KEY_BYTES)
+            if vec_size != n * row_bytes:
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(n * row_bytes)
+        if n <= self._count:
+            return
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._count * KEY_BYTES)
+            keys = f.read((n - self._count) * KEY_BYTES)
+        for i in range(len(keys) // KEY_BYTES):
+            self._rows.setdefault(keys[i * KEY_BYTES:(i + 1) * KEY_BYTES], self._count + i)
+        self._count += len(keys) // KEY_BYTES
+
+    def _matrix(self):
+        n = self._count
+        if self._vectors is None or self._vectors.shape[0] != n:
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(n, self.dim)) if n else None
+        return self._vectors
+
+    def get_many(self, keys: List[bytes]) -> Dict[int, np.ndarray]:
+        """Return {position in `keys`: float32 vector} for cache hits."""
+        with self._lock:
+            # 其他进程追加的行
+            self._sync()
+            if not self._rows:
+                return {}
+            matrix = self._matrix()
+            hits = {}
+            for pos, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is not None:
+                    hits[pos] = np.asarray(matrix[row], dtype='float32')
+            return hits
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        """Append vectors for keys not cached yet."""
+        vectors = np.asarray(vectors)
+        if len(keys) == 0:
+            return
+        with self._lock, self._file_lock():
+            # 持锁后按文件大小确定起始行号，并跳过其他进程已写入的 key
+            self._sync(repair=True)
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self.header_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim, 'dtype': self.dtype.name}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f'embedding dim {vectors.shape[1]} does not match cache dim {self.dim}')
+            new_keys, new_rows, seen = [], [], set()
+            for key, vec in zip(keys, vectors):
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(vec)
+            if not new_keys:
+                return
+            # 先写向量再写 key：key 只会指向已落盘的向量
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.asarray(new_rows, dtype=self.dtype).tobytes())
+                f.flush()
+            with open(self.keys_path, 'ab') as f:
+                f.write(b''.join(new_keys))
+                f.flush()
+            for i, key in enumerate(new_keys):
+                self._rows[key] = self._count + i
+            self._count += len(new_keys)
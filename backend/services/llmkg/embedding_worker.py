@@ -0,0 +1,94 @@
+import os
+import time
+import queue
+import threading
+from typing import Callable, List, Optional
+
+import numpy as np
+
+BATCH_WINDOW_MS = float(os.getenv('VEC_BATCH_WINDOW_MS', '5'))
+BATCH_MAX = int(os.getenv('VEC_BATCH_MAX', '32'))
+
+
+class _EncodeRequest:
+    __slots__ = ('texts', 'result', 'error', 'done')
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent encode calls into a single model forward pass.
+
+    Callers block in `encode`; a daemon worker waits up to `window_ms` after the
+    first pending request for more to arrive (or until `max_batch` texts are
+    queued), encodes them together and hands each caller its slice.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX):
+        self._encode_fn = encode_fn
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue[_EncodeRequest]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {'requests': 0, 'batches': 0, 'texts': 0}
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._thread.start()
+
+    def encode(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype='float32')
+        self._ensure_started()
+        req = _EncodeRequest(list(texts))
+        self._queue.put(req)
+        if not req.done.wait(timeout):
+            raise TimeoutError('embedding request timed out')
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _collect(self) -> List[_EncodeRequest]:
+        batch = [self._queue.get()]
+        count = len(batch[0].texts)
+        deadline = time.monotonic() + self.window
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(req)
+            count += len(req.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [t for req in batch for t in req.texts]
+            try:
+                vectors = self._encode_fn(texts)
+                pos = 0
+                for req in batch:
+                    req.result = vectors[pos:pos + len(req.texts)]
+                    pos += len(req.texts)
+                self.stats['requests'] += len(batch)
+                self.stats['batches'] += 1
+                self.stats['texts'] += len(texts)
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+            finally:
+                for req in batch:
+                    req.done.set()
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except Exception:
+    faiss = None
+
+# 保留最近几个版本的快照，其余在发布新版本时清理
+KEEP_SNAPSHOTS = int(os.getenv('VEC_KEEP_SNAPSHOTS', '2'))
+
+
+def manifest_path(index_path: str) -> str:
+    base, _ = os.path.splitext(index_path)
+    return base + '.manifest.json'
+
+
+def read_manifest(index_path: str) -> Optional[Dict[str, Any]]:
+    path = manifest_path(index_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def resolve(index_path: str, store_path: str) -> Dict[str, Any]:
+    """Return the files of the current snapshot.
+
+    With a manifest next to `index_path` the versioned files it names are used;
+    without one (indexes built before snapshots existed) the plain paths are.
+    """
+    manifest = read_manifest(index_path)
+    if not manifest:
+        return {'version': None, 'index_file': index_path, 'store_path': store_path}
+    base_dir = os.path.dirname(index_path)
+    return {
+        'version': manifest['version'],
+        'index_file': os.path.join(base_dir, manifest['index']),
+        'store_path': os.path.join(base_dir, manifest['meta']),
+    }
+
+
+def new_version() -> str:
+    return str(int(time.time() * 1000))
+
+
+def snapshot_paths(index_path: str, store_path: str, version: str) -> Tuple[str, str]:
+    """(index file, metadata store prefix) for a snapshot version."""
+    base, ext = os.path.splitext(index_path)
+    return f'{base}.{version}{ext}', f'{store_path}.{version}'
+
+
+def _fsync_file(path: str):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def write_index_atomic(index, path: str):
+    """Write a FAISS index to a temp file, fsync it and rename it into place."""
+    tmp = path + '.tmp'
+    faiss.write_index(index, tmp)
+    _fsync_file(tmp)
+    os.replace(tmp, path)
+
+
+def publish(index_path: str, store_base: str, version: str):
+    """Atomically point the manifest at snapshot `version`, then drop old ones."""
+    index_file, store_path = snapshot_paths(index_path, store_base, version)
+    previous = read_manifest(index_path) or {}
+    history = [previous['version']] + previous.get('history', []) if previous.get('version') else []
+    manifest = {
+        'version': version,
+        'index': os.path.basename(index_file),
+        'meta': os.path.basename(store_path),
+        'created_at': time.time(),
+        'history': history[:max(0, KEEP_SNAPSHOTS - 1)],
+    }
+    path = manifest_path(index_path)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    for old in history[max(0, KEEP_SNAPSHOTS - 1):]:
+        _remove_snapshot(index_path, store_base, old)
+
+
+def _remove_snapshot(index_path: str, store_base: str, version: str):
+    # 其他进程可能仍映射着旧文件；POSIX 下删除目录项不影响已打开的句柄
+    index_file, store_path = snapshot_paths(index_path, store_base, version)
+    for path in (index_file, store_path + '.idx', store_path + '.dat', vectors_path(index_file),
+                 lexical_path(index_file)) + delta_paths(index_file):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """(inode, mtime) identifying one written version of a file."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+def lexical_path(index_file: str) -> str:
+    """BM25 n-gram index saved alongside an index file (see lexical_index)."""
+    base, _ = os.path.splitext(index_file)
+    return base + '.lexical.npz'
+
+
+# ---- incremental delta next to an index file ----
+
+def delta_paths(index_file: str) -> Tuple[str, str]:
+    """(log, vectors) file paths holding incremental updates for an index file."""
+    base, _ = os.path.splitext(index_file)
+    return base + '.delta.jsonl', base + '.delta.vec'
+
+
+def clear_delta(index_file: str):
+    for path in delta_paths(index_file):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def delta_log_size(index_file: str) -> int:
+    log_path, _ = delta_paths(index_file)
+    try:
+        return os.path.getsize(log_path)
+    except FileNotFoundError:
+        return 0
+
+
+def delta_op_count(index_file: str) -> int:
+    log_path, _ = delta_paths(index_file)
+    if not os.path.exists(log_path):
+        return 0
+    with open(log_path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def append_delta(ops: List[Dict[str, Any]], vectors: Optional[np.ndarray], index_file: str) -> int:
+    """Persist incremental ops; rows in `ops` are relative to `vectors` and rebased here.
+
+    Returns the log size after the write.
+    """
+    log_path, vec_path = delta_paths(index_file)
+    base_row = 0
+    if vectors is not None and len(vectors) > 0:
+        row_bytes = vectors.shape[1] * 4
+        base_row = os.path.getsize(vec_path) // row_bytes if os.path.exists(vec_path) else 0
+        with open(vec_path, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    with open(log_path, 'a', encoding='utf-8') as f:
+        for op in ops:
+            if op.get('row') is not None:
+                op = dict(op, row=op['row'] + base_row)
+            f.write(json.dumps(op, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return os.path.getsize(log_path)
+
+
+def _read_rows(vec_path: str, dim: int, first: int, stop: int) -> Optional[np.ndarray]:
+    """Rows [first, stop) of a raw float32 matrix file, read without loading the rows before them."""
+    try:
+        with open(vec_path, 'rb') as f:
+            f.seek(first * dim * 4)
+            vecs = np.fromfile(f, dtype='float32', count=(stop - first) * dim)
+    except FileNotFoundError:
+        return None
+    # 末尾不完整的行（写入中）不返回
+    return vecs[:len(vecs) - len(vecs) % dim].reshape(-1, dim)
+
+
+def read_delta(index_file: str, dim: int, start: int = 0) -> Tuple[List[Tuple[Dict[str, Any], Optional[np.ndarray]]], int]:
+    """Read ops appended after byte offset `start`.
+
+    Only the vector rows those ops refer to are read from the .delta.vec file.
+    Returns ([(op, vector or None), ...], end offset). A trailing line without
+    a newline (a write in progress or cut by a crash) is left for the next read.
+    """
+    log_path, vec_path = delta_paths(index_file)
+    if not os.path.exists(log_path):
+        return [], 0
+    parsed = []
+    offset = start
+    with open(log_path, 'rb') as f:
+        f.seek(start)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            offset += len(raw)
+            try:
+                parsed.append(json.loads(raw.decode('utf-8')))
+            except Exception:
+                continue
+    rows = [op['row'] for op in parsed if op.get('row') is not None]
+    first = min(rows) if rows else 0
+    vecs = _read_rows(vec_path, dim, first, max(rows) + 1) if rows else None
+    ops = []
+    for op in parsed:
+        vec = None
+        row = op.get('row')
+        if row is not None:
+            if vecs is None or row - first >= len(vecs):
+                continue
+            vec = vecs[row - first:row - first + 1]
+        ops.append((op, vec))
+    return ops, offset
+
+
+# ---- full-precision vectors kept on disk for re-ranking compressed indexes ----
+
+def vectors_path(index_file: str) -> str:
+    """Raw float32 matrix next to an index file; row i holds the vector of label i."""
+    base, _ = os.path.splitext(index_file)
+    return base + '.vectors.f32'
+
+
+def write_vectors(index_file: str, vectors: np.ndarray):
+    path = vectors_path(index_file)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def create_vectors(index_file: str, rows: int, dim: int) -> np.memmap:
+    """Writable memmap of a new vector file, filled row by row during a streaming build; see commit_vectors."""
+    return np.memmap(vectors_path(index_file) + '.tmp', dtype='float32', mode='w+', shape=(rows, dim))
+
+
+def commit_vectors(index_file: str, vectors: np.memmap):
+    """Flush a memmap from create_vectors to disk and move it into place."""
+    path = vectors_path(index_file)
+    vectors.flush()
+    _fsync_file(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def discard_vectors(index_file: str):
+    """Remove the unfinished file of an aborted streaming build."""
+    try:
+        os.remove(vectors_path(index_file) + '.tmp')
+    except FileNotFoundError:
+        pass
+
+
+def write_vector_rows(index_file: str, labels: List[int], vectors: np.ndarray) -> bool:
+    """Overwrite (or extend the file with) the rows of `labels`; no-op when the snapshot has no vector file."""
+    path = vectors_path(index_file)
+    if not os.path.exists(path) or not labels:
+        return False
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    row_bytes = vectors.shape[1] * 4
+    with open(path, 'r+b') as f:
+        for label, vec in zip(labels, vectors):
+            f.seek(int(label) * row_bytes)
+            f.write(vec.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def open_vectors(index_file: str, dim: int) -> Optional[np.ndarray]:
+    """Read-only memmap of the snapshot's full-precision vectors, or None."""
+    path = vectors_path(index_file)
+    try:
+        rows = os.path.getsize(path) // (dim * 4)
+    except FileNotFoundError:
+        return None
+    if rows == 0:
+        return None
+    return np.memmap(path, dtype='float32', mode='r', shape=(rows, dim))
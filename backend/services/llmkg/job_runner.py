@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR = os.getenv('KG_JOB_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'jobs'))
+JOB_TABLE = os.path.join(JOB_DIR, 'jobs.json')
+# 多个 API 进程共用任务表，读改写都在该文件的 flock 下进行
+JOB_LOCK = os.path.join(JOB_DIR, 'jobs.lock')
+# 流式输出（如 LLM 生成的文本）按任务追加写入单独的文件，任务表只保存状态和进度
+JOB_OUTPUT_DIR = os.path.join(JOB_DIR, 'output')
+# 同时运行的后台任务数；构建索引是 CPU 密集型，默认不宜过多
+JOB_WORKERS = int(os.getenv('KG_JOB_WORKERS', '2'))
+# 调用 LLM 的任务（如对话总结）使用独立队列，不占用索引构建的并发名额
+LLM_JOB_WORKERS = int(os.getenv('KG_LLM_JOB_WORKERS', '3'))
+JOB_QUEUES = {'default': JOB_WORKERS, 'llm': LLM_JOB_WORKERS}
+# 任务表中保留的已结束任务数量
+JOB_HISTORY = int(os.getenv('KG_JOB_HISTORY', '200'))
+# 进度更新写盘的最小间隔（秒），状态变化总是立即写盘
+JOB_SAVE_INTERVAL = float(os.getenv('KG_JOB_SAVE_INTERVAL', '1'))
+
+ACTIVE_STATES = ('queued', 'running')
+FINAL_STATES = ('succeeded', 'failed', 'cancelled')
+
+# 本进程提交并执行的任务；其余进程的任务只在共享任务表中
+_jobs: Dict[str, Dict[str, Any]] = {}
+_cancel_flags: Dict[str, threading.Event] = {}
+# 本进程任务已写入输出文件的文本
+_outputs: Dict[str, str] = {}
+_lock = threading.RLock()
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_last_save = 0.0
+_owner_token = None
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+
+class JobContext:
+    """Handed to job functions to report progress and observe cancellation."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._cancel = _cancel_flags[job_id]
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self):
+        if not self._cancel.is_set():
+            # 其他进程的取消请求只记录在任务表中，按写盘间隔读取
+            with _lock:
+                _flush(force=False)
+        if self._cancel.is_set():
+            raise JobCancelled(self.job_id)
+
+    def progress(self, done: int, total: Optional[int] = None, stage: Optional[str] = None):
+        """Record `done` of `total` units (texts, files...); raises JobCancelled when cancelled."""
+        with _lock:
+            job = _jobs[self.job_id]
+            job['progress']['done'] = int(done)
+            if total is not None:
+                job['progress']['total'] = int(total)
+            if stage is not None:
+                job['progress']['stage'] = stage
+            job['updated_at'] = time.time()
+        self.check()
+
+    def output(self, text: str):
+        """Publish the partial output produced so far (e.g. streamed LLM text); raises JobCancelled when cancelled."""
+        with _lock:
+            _write_output(self.job_id, text)
+            _jobs[self.job_id]['updated_at'] = time.time()
+        self.check()
+
+
+def _output_path(job_id: str) -> str:
+    return os.path.join(JOB_OUTPUT_DIR, f'{job_id}.txt')
+
+
+def _write_output(job_id: str, text: str):
+    """Append what `text` adds to the output written so far; rewrite the file if it isn't an extension (lock held)."""
+    written = _outputs.get(job_id, '')
+    if text == written:
+        return
+    os.makedirs(JOB_OUTPUT_DIR, exist_ok=True)
+    if text.startswith(written):
+        with open(_output_path(job_id), 'a', encoding='utf-8') as f:
+            f.write(text[len(written):])
+    else:
+        tmp = _output_path(job_id) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, _output_path(job_id))
+    _outputs[job_id] = text
+
+
+def read_output(job_id: str, offset: int = 0) -> Tuple[str, int]:
+    """Output a job published via ctx.output, from byte `offset` on; returns (text, next offset).
+
+    A UTF-8 character still being written is left for the next call.
+    """
+    try:
+        with open(_output_path(job_id), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return '', offset
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        data = data[:e.start]
+        text = data.decode('utf-8', errors='replace')
+    return text, offset + len(data)
+
+
+def _owner() -> str:
+    """Token of this process; regenerated after fork so workers forked from one parent differ."""
+    global _owner_token
+    if _owner_token is None or _owner_token[0] != os.getpid():
+        _owner_token = (os.getpid(), uuid.uuid4().hex[:12])
+    return '%d:%s' % _owner_token
+
+
+def _alive(owner: Optional[str]) -> bool:
+    """True if the process that submitted a job is still running."""
+    if owner == _owner():
+        return True
+    pid = str(owner or '').split(':')[0]
+    pid = int(pid) if pid.isdigit() else 0
+    if fcntl is None or not pid or pid == os.getpid():
+        # 没有文件锁时只支持单进程部署；与本进程同 pid 的是重启前的进程
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _read_table() -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(JOB_TABLE):
+        return {}
+    try:
+        with open(JOB_TABLE, 'r', encoding='utf-8') as f:
+            return {job['id']: job for job in json.load(f)}
+    except Exception:
+        logger.warning('任务表损坏，忽略: %s', JOB_TABLE)
+        return {}
+
+
+def _write_table(table: Dict[str, Dict[str, Any]]):
+    """Write the job table atomically (file lock held)."""
+    finished = sorted((j for j in table.values() if j['status'] in FINAL_STATES),
+                      key=lambda j: j.get('finished_at') or 0, reverse=True)
+    for job in finished[JOB_HISTORY:]:
+        table.pop(job['id'], None)
+        try:
+            os.remove(_output_path(job['id']))
+        except OSError:
+            pass
+    try:
+        tmp = JOB_TABLE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(list(table.values()), f, ensure_ascii=False, default=str)
+        os.replace(tmp, JOB_TABLE)
+    except OSError:
+        logger.exception('写入任务表失败: %s', JOB_TABLE)
+
+
+@contextmanager
+def _table(write: bool = True):
+    """Shared job table with this process's jobs merged in (in-process lock held by the caller).
+
+    All processes serving the API share JOB_TABLE: the file lock makes the
+    read-modify-write of submit/cancel atomic across them. Jobs of this
+    process overwrite their rows (they hold the latest progress), except
+    for cancellation requested by another process, which is copied in.
+    Active jobs whose process has exited are marked failed. With
+    write=True the merged table is written back on exit.
+    """
+    os.makedirs(JOB_DIR, exist_ok=True)
+    with open(JOB_LOCK, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        table = _read_table()
+        changed = False
+        for job_id, job in _jobs.items():
+            if job['owner'] != _owner():
+                # fork 前父进程的任务，不由本进程执行
+                continue
+            row = table.get(job_id)
+            if row is not None and row.get('cancel_requested') and not job.get('cancel_requested'):
+                _request_cancel(job)
+            table[job_id] = job
+        for job in table.values():
+            if job['status'] in ACTIVE_STATES and not _alive(job.get('owner')):
+                job.update(status='failed', error='interrupted by restart', finished_at=time.time())
+                changed = True
+        yield table
+        if write or changed:
+            _write_table(table)
+
+
+def _flush(force: bool = True):
+    """Write this process's jobs to the shared table; throttled to JOB_SAVE_INTERVAL unless forced (lock held)."""
+    global _last_save
+    now = time.time()
+    if not force and now - _last_save < JOB_SAVE_INTERVAL:
+        return
+    _last_save = now
+    with _table():
+        pass
+
+
+def _request_cancel(job: Dict[str, Any]):
+    """Flag `job` as cancelled; a queued job ends at once (lock held)."""
+    job['cancel_requested'] = True
+    flag = _cancel_flags.get(job['id'])
+    if flag is not None:
+        flag.set()
+    if job['status'] == 'queued':
+        job.update(status='cancelled', finished_at=time.time())
+
+
+def _get_executor(queue: str = 'default') -> ThreadPoolExecutor:
+    """Executor of a named queue (lock held); each queue has its own worker limit."""
+    executor = _executors.get(queue)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=max(1, JOB_QUEUES.get(queue, JOB_WORKERS)),
+                                      thread_name_prefix=f'kg-job-{queue}')
+        _executors[queue] = executor
+    return executor
+
+
+def _view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public copy of a job with elapsed time, throughput (units/s) and ETA (s) derived from progress."""
+    out = json.loads(json.dumps(job, default=str))
+    started = job.get('started_at')
+    if started:
+        elapsed = (job.get('finished_at') or time.time()) - started
+        done = job['progress'].get('done') or 0
+        total = job['progress'].get('total')
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        out['elapsed'] = elapsed
+        out['throughput'] = throughput
+        out['eta'] = (total - done) / throughput if job['status'] == 'running' and total and throughput > 0 else None
+        out['progress']['percent'] = 100.0 * done / total if total else None
+    return out
+
+
+def _run(job_id: str, fn: Callable[..., Any], params: Dict[str, Any]):
+    with _lock:
+        job = _jobs[job_id]
+        _flush()
+        if _cancel_flags[job_id].is_set():
+            _jobs.pop(job_id, None)
+            _cancel_flags.pop(job_id, None)
+            return
+        job.update(status='running', started_at=time.time())
+        _flush()
+    ctx = JobContext(job_id)
+    try:
+        result = fn(ctx, **params)
+        with _lock:
+            job.update(status='succeeded', result=result)
+    except JobCancelled:
+        with _lock:
+            job.update(status='cancelled')
+    except Exception as e:
+        logger.exception('后台任务失败: %s (%s)', job_id, job['kind'])
+        with _lock:
+            job.update(status='failed', error=str(e))
+    finally:
+        with _lock:
+            job['finished_at'] = time.time()
+            _flush()
+            # 结束后以任务表为准
+            _jobs.pop(job_id, None)
+            _outputs.pop(job_id, None)
+            _cancel_flags.pop(job_id, None)
+
+
+def submit_job(kind: str, fn: Callable[..., Any], params: Optional[Dict[str, Any]] = None,
+               key: Optional[str] = None, queue: str = 'default') -> Dict[str, Any]:
+    """Queue `fn(ctx, **params)` on the background pool of `queue` (see JOB_QUEUES).
+
+    Only one queued/running job per `key` (default: `kind`) is allowed, across
+    all processes sharing JOB_TABLE; a second submission returns the active
+    one with 'duplicate': True instead of starting another. The job runs in
+    this process, but any process can report or cancel it.
+
+    Returns:
+        {'success': True, 'job': {...}, 'duplicate': bool}
+    """
+    key = key or kind
+    params = params or {}
+    with _lock:
+        with _table() as table:
+            for job in table.values():
+                if job.get('key') == key and job['status'] in ACTIVE_STATES:
+                    return {'success': True, 'job': _view(job), 'duplicate': True}
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                'id': job_id, 'kind': kind, 'key': key, 'queue': queue, 'status': 'queued', 'owner': _owner(),
+                'params': {k: v for k, v in params.items() if isinstance(v, (str, int, float, bool, type(None)))},
+                'progress': {'done': 0, 'total': None, 'stage': None},
+                'created_at': time.time(), 'started_at': None, 'finished_at': None, 'updated_at': time.time(),
+                'result': None, 'error': None,
+            }
+            table[job_id] = _jobs[job_id] = job
+            _cancel_flags[job_id] = threading.Event()
+        executor = _get_executor(queue)
+        view = _view(job)
+    executor.submit(_run, job_id, fn, params)
+    return {'success': True, 'job': view, 'duplicate': False}
+
+
+def get_job(job_id: str, with_output: bool = True) -> Optional[Dict[str, Any]]:
+    """One job; with_output adds the full text published via ctx.output as 'output' (None if nothing yet)."""
+    with _lock:
+        with _table(write=False) as table:
+            job = table.get(job_id)
+            view = _view(job) if job is not None else None
+    if view is not None and with_output:
+        view['output'] = read_output(job_id)[0] or view.get('output')
+    return view
+
+
+def list_jobs(kind: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Most recent jobs first, without their output (see get_job)."""
+    with _lock:
+        with _table(write=False) as table:
+            jobs = [j for j in table.values() if kind is None or j['kind'] == kind]
+            jobs.sort(key=lambda j: j['created_at'], reverse=True)
+            return [_view(j) for j in jobs[:limit]]
+
+
+def cancel_job(job_id: str) -> Dict[str, Any]:
+    """Request cancellation; queued jobs stop at once, running ones at their next progress report.
+
+    Works from any process: the request is recorded in the shared table and
+    picked up by the process running the job within JOB_SAVE_INTERVAL.
+    """
+    with _lock:
+        with _table() as table:
+            job = table.get(job_id)
+            if job is None:
+                return {'success': False, 'error': 'job not found'}
+            if job['status'] in FINAL_STATES:
+                return {'success': False, 'error': f"job already {job['status']}", 'job': _view(job)}
+            _request_cancel(job)
+            return {'success': True, 'job': _view(job)}
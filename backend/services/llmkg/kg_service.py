@@ -39,10 +39,6 @@ class Neo4jService:
             self.connect()
         else:
             logging.info('跳过 Neo4j 自动连接（KG_SKIP_CONNECT 设置）')
-        # Schema file cache (read-only)
-        self._schema_cache = None
-        self._schema_cache_ts = 0
-        self.schema_ttl = int(os.getenv('KG_SCHEMA_TTL', '300'))
 
     def connect(self):
         for attempt in range(1, self.max_retries + 1):
@@ -0,0 +1,224 @@
+import os
+import re
+import math
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .embedding_cache import normalize_text
+except ImportError:
+    from embedding_cache import normalize_text
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+NGRAM_SIZES = (2, 3)
+MAX_WORD_LEN = 32
+
+# 中日韩汉字连续片段切成字符 n-gram；字母数字按整词
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Character bigrams/trigrams for CJK runs, whole lowercase words for Latin/digits."""
+    terms = []
+    for run in _TOKEN_RE.findall(normalize_text(text).lower()):
+        if run[0].isascii():
+            terms.append(run[:MAX_WORD_LEN])
+        elif len(run) < min(NGRAM_SIZES):
+            terms.append(run)
+        else:
+            for n in NGRAM_SIZES:
+                terms.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return terms
+
+
+class LexicalIndex:
+    """BM25 inverted index over character n-grams, addressed by FAISS label.
+
+    The bulk of the postings lives in immutable CSR arrays (terms -> labels/tf)
+    saved next to each index snapshot; documents added or removed afterwards go
+    into a small in-memory overlay and mask their stale base postings, exactly
+    like the FAISS delta. `merged()` folds the overlay back into fresh arrays.
+    Writers must be serialized by the caller.
+    """
+
+    def __init__(self, terms: Optional[List[str]] = None, offsets: Optional[np.ndarray] = None,
+                 labels: Optional[np.ndarray] = None, tfs: Optional[np.ndarray] = None,
+                 doc_len: Optional[np.ndarray] = None):
+        terms = list(terms or [])
+        self._term_ids = {t: i for i, t in enumerate(terms)}
+        self._offsets = offsets if offsets is not None else np.zeros(1, dtype='int64')
+        self._labels = labels if labels is not None else np.empty(0, dtype='int32')
+        self._tfs = tfs if tfs is not None else np.empty(0, dtype='float32')
+        base_len = doc_len if doc_len is not None else np.empty(0, dtype='float32')
+        # 所有文档（基础 + 增量）的长度；0 表示不存在
+        self._doc_len = np.array(base_len, dtype='float32')
+        # 基础倒排中已失效（被更新或删除）的文档
+        self._stale = np.zeros(len(base_len), dtype=bool)
+        self._extra: Dict[str, Dict[int, int]] = {}
+        self._extra_terms: Dict[int, List[str]] = {}
+        self.n_docs = int(np.count_nonzero(self._doc_len))
+        self.total_len = float(self._doc_len.sum())
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    # ---- construction / persistence ----
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[int, str]]) -> 'LexicalIndex':
+        """Build from (label, text) pairs."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths: Dict[int, int] = {}
+        for label, text in docs:
+            counts = Counter(tokenize(text))
+            if not counts:
+                continue
+            lengths[label] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((label, tf))
+        return cls._from_postings(postings, lengths)
+
+    @classmethod
+    def _from_postings(cls, postings: Dict[str, List[Tuple[int, int]]], lengths: Dict[int, int]) -> 'LexicalIndex':
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype='int64')
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        labels = np.empty(offsets[-1], dtype='int32')
+        tfs = np.empty(offsets[-1], dtype='float32')
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            labels[offsets[i]:offsets[i + 1]] = [label for label, _ in entries]
+            tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in entries]
+        size = max(lengths) + 1 if lengths else 0
+        doc_len = np.zeros(size, dtype='float32')
+        for label, length in lengths.items():
+            doc_len[label] = length
+        return cls(terms, offsets, labels, tfs, doc_len)
+
+    def _live_postings(self) -> Tuple[Dict[str, List[Tuple[int, int]]], Dict[int, int]]:
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for term, tid in self._term_ids.items():
+            start, end = self._offsets[tid], self._offsets[tid + 1]
+            labels = self._labels[start:end]
+            keep = ~self._stale[labels]
+            if keep.any():
+                postings[term] = list(zip(labels[keep].tolist(), self._tfs[start:end][keep].astype(int).tolist()))
+        for term, extra in self._extra.items():
+            postings.setdefault(term, []).extend(extra.items())
+        lengths = {int(label): int(length) for label, length in enumerate(self._doc_len.tolist()) if length > 0}
+        return postings, lengths
+
+    def merged(self) -> 'LexicalIndex':
+        """A new index with the overlay folded into the base arrays."""
+        postings, lengths = self._live_postings()
+        return self._from_postings(postings, lengths)
+
+    def save(self, path: str):
+        """Write the base arrays (call on a merged index) atomically."""
+        terms = sorted(self._term_ids, key=self._term_ids.get)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, terms=np.array(terms, dtype=str), offsets=self._offsets,
+                     labels=self._labels, tfs=self._tfs, doc_len=self._doc_len[:len(self._stale)])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LexicalIndex':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['terms'].tolist(), data['offsets'], data['labels'], data['tfs'], data['doc_len'])
+
+    # ---- incremental updates ----
+
+    def _grow(self, size: int):
+        if size > len(self._doc_len):
+            grown = np.zeros(max(size, 2 * len(self._doc_len)), dtype='float32')
+            grown[:len(self._doc_len)] = self._doc_len
+            self._doc_len = grown
+
+    def remove(self, label: int):
+        if label < 0 or label >= len(self._doc_len) or self._doc_len[label] == 0:
+            return
+        self.n_docs -= 1
+        self.total_len -= float(self._doc_len[label])
+        self._doc_len[label] = 0
+        if label < len(self._stale):
+            self._stale[label] = True
+        for term in self._extra_terms.pop(label, []):
+            extra = self._extra.get(term)
+            if extra is not None:
+                extra.pop(label, None)
+                if not extra:
+                    del self._extra[term]
+
+    def add(self, label: int, text: str):
+        """Index (or re-index) the document stored under `label`."""
+        self.remove(label)
+        counts = Counter(tokenize(text))
+        if not counts:
+            return
+        self._grow(label + 1)
+        length = sum(counts.values())
+        self._doc_len[label] = length
+        self.n_docs += 1
+        self.total_len += length
+        if label < len(self._stale):
+            self._stale[label] = True
+        for term, tf in counts.items():
+            self._extra.setdefault(term, {})[label] = tf
+        self._extra_terms[label] = list(counts)
+
+    # ---- query ----
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        parts_l, parts_f = [], []
+        tid = self._term_ids.get(term)
+        if tid is not None:
+            start, end = self._offsets[tid], self._offsets[tid + 1]
+            labels = self._labels[start:end]
+            keep = ~self._stale[labels]
+            parts_l.append(labels[keep])
+            parts_f.append(self._tfs[start:end][keep])
+        extra = self._extra.get(term)
+        if extra:
+            parts_l.append(np.fromiter(extra.keys(), dtype='int32', count=len(extra)))
+            parts_f.append(np.fromiter(extra.values(), dtype='float32', count=len(extra)))
+        if not parts_l:
+            return np.empty(0, dtype='int32'), np.empty(0, dtype='float32')
+        return np.concatenate(parts_l), np.concatenate(parts_f)
+
+    def search(self, query: str, k: int = 10, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float, float]]:
+        """Top-k (label, bm25 score, fraction of distinct query terms matched).
+
+        `allowed` (sorted labels) restricts the candidates, e.g. to a metadata filter.
+        """
+        terms = list(OrderedDict.fromkeys(tokenize(query)))
+        if not terms or self.n_docs == 0 or k <= 0:
+            return []
+        avgdl = self.total_len / self.n_docs
+        scores = np.zeros(len(self._doc_len), dtype='float32')
+        matched = np.zeros(len(self._doc_len), dtype='int32')
+        for term in terms:
+            labels, tfs = self._postings(term)
+            if not len(labels):
+                continue
+            df = len(labels)
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._doc_len[labels] / avgdl)
+            scores[labels] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+            matched[labels] += 1
+        hits = np.flatnonzero(scores > 0)
+        if allowed is not None:
+            hits = hits[np.isin(hits, allowed, assume_unique=True)]
+        if not len(hits):
+            return []
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind='stable')]
+        return [(int(label), float(scores[label]), matched[label] / float(len(terms))) for label in hits]
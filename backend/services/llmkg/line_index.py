@@ -0,0 +1,130 @@
+import os
+import struct
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# 每隔多少行记录一次行首偏移；读取任意一页最多多扫描 STRIDE 行
+STRIDE = int(os.getenv('KG_SESSION_INDEX_STRIDE', '64'))
+
+_ENTRY = struct.Struct('<q')
+
+
+class LineIndex:
+    """Sparse line-offset index of an append-only JSONL file.
+
+    `<file>.lidx` holds a header (the stride) followed by the byte offset
+    of every STRIDE-th line as little-endian int64, so the offset of line
+    `n` is one 8-byte read at a computable position plus a scan of at most
+    STRIDE lines, whatever the file's length. The index is derived data:
+    it is extended by the writer after each append and rebuilt from a scan
+    whenever its entry count, stride or offsets don't match the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + '.lidx'
+        self.stride = max(1, STRIDE)
+
+    def _entries(self) -> int:
+        """Number of offsets in the index, or -1 when it is missing or built with another stride."""
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(_ENTRY.size)
+                size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return -1
+        if len(header) != _ENTRY.size or _ENTRY.unpack(header)[0] != self.stride:
+            return -1
+        return (size - _ENTRY.size) // _ENTRY.size
+
+    def _expected(self, lines: int) -> int:
+        return (lines + self.stride - 1) // self.stride
+
+    def rebuild(self) -> int:
+        """Rewrite the index from a full scan of the file; returns the number of lines."""
+        offsets, offset, lines = [], 0, 0
+        try:
+            with open(self.path, 'rb') as f:
+                for raw in f:
+                    if not raw.endswith(b'\n'):
+                        break
+                    if lines % self.stride == 0:
+                        offsets.append(offset)
+                    offset += len(raw)
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_ENTRY.pack(self.stride) + b''.join(_ENTRY.pack(o) for o in offsets))
+        os.replace(tmp, self.index_path)
+        return lines
+
+    def extend(self, first_line: int, base_offset: int, data: bytes):
+        """Record the lines of `data`, appended at `base_offset` as line number `first_line` onwards."""
+        if self._entries() != self._expected(first_line):
+            self.rebuild()
+            return
+        packed = []
+        line, pos = first_line, 0
+        while pos < len(data):
+            if line % self.stride == 0:
+                packed.append(_ENTRY.pack(base_offset + pos))
+            nl = data.find(b'\n', pos)
+            if nl < 0:
+                break
+            pos, line = nl + 1, line + 1
+        if packed:
+            with open(self.index_path, 'ab') as f:
+                f.write(b''.join(packed))
+
+    def _anchor(self, line: int) -> int:
+        """Offset of line `line` // stride * stride, or -1 if it doesn't sit on a line start."""
+        slot = line // self.stride
+        with open(self.index_path, 'rb') as f:
+            f.seek(_ENTRY.size * (slot + 1))
+            raw = f.read(_ENTRY.size)
+        if len(raw) != _ENTRY.size:
+            return -1
+        offset = _ENTRY.unpack(raw)[0]
+        if offset == 0:
+            return 0 if slot == 0 else -1
+        # 偏移量之前必须是换行符，否则索引已过期（例如文件被整体重写）
+        with open(self.path, 'rb') as f:
+            f.seek(offset - 1)
+            return offset if f.read(1) == b'\n' else -1
+
+    def read_lines(self, start: int, end: int, total: int) -> List[bytes]:
+        """Raw lines [start, end) of a file known to hold `total` complete lines."""
+        end = min(end, total)
+        if start >= end:
+            return []
+        if self._entries() < self._expected(total):
+            self.rebuild()
+        offset = self._anchor(start)
+        if offset < 0:
+            logger.info('行索引与文件不一致，重建: %s', self.index_path)
+            self.rebuild()
+            offset = self._anchor(start)
+        line = start // self.stride * self.stride
+        if offset < 0:
+            # 文件比 total 短（并发截断），从头扫描
+            offset = line = 0
+        lines = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for raw in f:
+                if line >= end or not raw.endswith(b'\n'):
+                    break
+                if line >= start:
+                    lines.append(raw)
+                line += 1
+        return lines
+
+    def remove(self):
+        try:
+            os.remove(self.index_path)
+        except FileNotFoundError:
+            pass
@@ -304,12 +304,25 @@ def llm_generate_viz_cypher(question: str, base_cypher: str, max_retries: int =
             continue
     return {'success': False, 'error': last_err or '生成可视化语句失败'}
 
-def llm_answer_stream_with_db(question: str, max_rows: int = 200, precomputed: dict = None, pre_exec_res: dict = None, messages: list = None):
+def _build_llm_messages(system: str, history: list, user_content: str, summary: str = None) -> list:
+    """System prompt (plus the rolling summary of earlier turns), history without system messages, then the user turn."""
+    if summary:
+        system = f"{system}\n\nSummary of the earlier conversation (those turns are not repeated below):\n{summary}"
+    llm_messages = [{"role": "system", "content": system}]
+    # 添加历史消息（跳过已有的system消息）
+    llm_messages.extend(m for m in (history or []) if m.get("role") != "system")
+    llm_messages.append({"role": "user", "content": user_content})
+    return llm_messages
+
+
+def llm_answer_stream_with_db(question: str, max_rows: int = 200, precomputed: dict = None, pre_exec_res: dict = None, messages: list = None,
+                              summary: str = None):
     """Streamed version: execute DB (or reuse given result), then stream LLM answer.
 
     precomputed: optional generation result {'success','cypher','normalized'}
     pre_exec_res: optional execute_readonly_query result to avoid re-query
     messages: optional conversation history in OpenAI format [{"role": "user", "content": "..."}, ...]
+    summary: optional rolling summary of the turns before `messages` (see session_service.answer_context)
     """
     api_key = os.environ.get('DEEPSEEK_API_KEY')
     if not api_key:
@@ -335,21 +348,8 @@ def llm_answer_stream_with_db(question: str, max_rows: int = 200, precomputed: d
         try:
             client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
             system = "You are a helpful assistant specialized in industrial defect detection QA. Note: Cypher generation was rejected: %s" % msg
-            # 构建messages：如果有历史，保留历史；否则创建新的
-            if messages and len(messages) > 0:
-                # 确保system message在最前面
-                llm_messages = [{"role": "system", "content": system}]
-                # 添加历史消息（跳过已有的system消息）
-                for msg_item in messages:
-                    if msg_item.get("role") != "system":
-                        llm_messages.append(msg_item)
-                # 添加当前问题
-                llm_messages.append({"role": "user", "content": question})
-            else:
-                llm_messages = [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": question},
-                ]
+            # 系统提示 + 早期对话总结 + 最近的历史消息 + 当前问题
+            llm_messages = _build_llm_messages(system, messages, question, summary)
             stream_iter = client.chat.completions.create(model="deepseek-chat", messages=llm_messages, stream=True)
             for event in stream_iter:
                 text = ''
@@ -412,21 +412,8 @@ def llm_answer_stream_with_db(question: str, max_rows: int = 200, precomputed: d
         try:
             client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
             system = "You are a helpful assistant specialized in industrial defect detection QA. Database query execution failed: %s" % exec_res.get('error')
-            # 构建messages：如果有历史，保留历史；否则创建新的
-            if messages and len(messages) > 0:
-                # 确保system message在最前面
-                llm_messages = [{"role": "system", "content": system}]
-                # 添加历史消息（跳过已有的system消息）
-                for msg_item in messages:
-                    if msg_item.get("role") != "system":
-                        llm_messages.append(msg_item)
-                # 添加当前问题
-                llm_messages.append({"role": "user", "content": question})
-            else:
-                llm_messages = [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": question},
-                ]
+            # 系统提示 + 早期对话总结 + 最近的历史消息 + 当前问题
+            llm_messages = _build_llm_messages(system, messages, question, summary)
             stream_iter = client.chat.completions.create(model="deepseek-chat", messages=llm_messages, stream=True)
             for event in stream_iter:
                 text = ''
@@ -514,21 +501,8 @@ def llm_answer_stream_with_db(question: str, max_rows: int = 200, precomputed: d
 
         user_prompt = f"User question:\n{question}\n\nCypher executed:\n{normalized}\n\nSample results (first {len(sample)} rows):\n{rows_text}{docs_text}"
         
-        # 构建messages：如果有历史，保留历史；否则创建新的
-        if messages and len(messages) > 0:
-            # 确保system message在最前面
-            llm_messages = [{"role": "system", "content": system}]
-            # 添加历史消息（跳过已有的system消息）
-            for msg_item in messages:
-                if msg_item.get("role") != "system":
-                    llm_messages.append(msg_item)
-            # 添加当前问题和检索结果
-            llm_messages.append({"role": "user", "content": user_prompt})
-        else:
-            llm_messages = [
-                {"role": "system", "content": system},
-                {"role": "user", "content": user_prompt},
-            ]
+        # 系统提示 + 早期对话总结 + 最近的历史消息 + 当前问题
+        llm_messages = _build_llm_messages(system, messages, user_prompt, summary)
 
         try:
             stream_iter = client.chat.completions.create(model="deepseek-chat", messages=llm_messages, stream=True)
@@ -1,12 +1,26 @@
 import os
 import json
+import hashlib
 import logging
 import threading
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Any, Optional
 from datetime import datetime
 from openai import OpenAI
 from dotenv import load_dotenv
 
+try:
+    from .text_db import get_text_db
+    from .memory_store import get_memory_store
+    from . import near_dup
+    from .job_runner import JobCancelled
+except ImportError:
+    # 作为脚本直接运行（python memory_service.py）时没有包上下文
+    from text_db import get_text_db
+    from memory_store import get_memory_store
+    import near_dup
+    from job_runner import JobCancelled
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -15,8 +29,28 @@ MEMORY_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'memory
 MEMORY_FILE = os.path.join(MEMORY_DIR, 'memory.jsonl')
 TEXT_DB_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'text_data', 'total.jsonl')
 
-# 文件操作锁
-_file_lock = threading.Lock()
+# 本地预判：明显重复或明显无关时不调用 LLM 判断关系
+LOCAL_JUDGE_ENABLED = os.getenv('KG_LOCAL_JUDGE', '1').lower() in ('1', 'true', 'yes')
+# 余弦相似度不低于该值直接判为高度相似
+DUP_COSINE = float(os.getenv('KG_DUP_COSINE', '0.97'))
+# 余弦相似度不低于该值且字面也接近（MinHash / SimHash）时判为高度相似
+NEAR_DUP_COSINE = float(os.getenv('KG_NEAR_DUP_COSINE', '0.9'))
+NEAR_DUP_JACCARD = float(os.getenv('KG_NEAR_DUP_JACCARD', '0.8'))
+NEAR_DUP_HAMMING = int(os.getenv('KG_NEAR_DUP_HAMMING', '3'))
+# 所有候选的余弦相似度和字面相似度都低于以下值时判为存在差异
+UNRELATED_COSINE = float(os.getenv('KG_UNRELATED_COSINE', '0.5'))
+UNRELATED_JACCARD = float(os.getenv('KG_UNRELATED_JACCARD', '0.1'))
+
+# 批量入库时并发的关系判断（LLM）请求数上限
+JUDGE_CONCURRENCY = int(os.getenv('KG_JUDGE_CONCURRENCY', '4'))
+
+# 对话选段指纹 -> 记忆ID，首次使用时建立
+_summary_hashes: Optional[Dict[str, str]] = None
+_summary_lock = threading.Lock()
+
+# 关系判断统计：本地判定与 LLM 判定的次数
+_judge_stats = {'total': 0, 'local': 0, 'llm': 0, 'local_high_similarity': 0, 'local_difference': 0}
+_judge_stats_lock = threading.Lock()
 
 
 def ensure_memory_dir():
@@ -24,11 +58,15 @@ def ensure_memory_dir():
     os.makedirs(MEMORY_DIR, exist_ok=True)
 
 
-def summarize_messages(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+def summarize_messages(messages: List[Dict[str, str]], on_delta: Optional[Callable[[str], None]] = None,
+                       previous_summary: Optional[str] = None) -> Dict[str, Any]:
     """调用LLM对勾选的消息进行总结
     
     Args:
         messages: 消息列表，格式 [{"role": "user", "content": "..."}, ...]
+        on_delta: 可选回调；提供时以流式方式调用LLM，每收到一段内容以目前为止的完整文本调用一次；
+            回调抛出的 JobCancelled 原样向上抛出
+        previous_summary: 可选，此前对话的总结；提供时生成覆盖此前总结和新消息的完整总结（会话滚动总结）
     
     Returns:
         {
@@ -61,44 +99,69 @@ def summarize_messages(messages: List[Dict[str, str]]) -> Dict[str, Any]:
             elif role == 'assistant':
                 messages_text += f"助手: {content}\n\n"
         
-        user_prompt = f"请对以下对话进行总结：\n\n{messages_text}"
+        if previous_summary:
+            user_prompt = (f"以下是此前对话的总结：\n\n{previous_summary}\n\n"
+                           f"请结合该总结，对此前总结和以下新的对话一起进行总结，输出一份完整的新总结：\n\n{messages_text}")
+        else:
+            user_prompt = f"请对以下对话进行总结：\n\n{messages_text}"
         
         llm_messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
         
-        completion = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=llm_messages,
-            stream=False
-        )
-        
-        # 提取回复
         summary = ""
-        if hasattr(completion, 'choices') and completion.choices:
-            msg = completion.choices[0].message
-            if isinstance(msg, dict):
-                summary = msg.get('content', '')
-            else:
-                summary = getattr(msg, 'content', '')
+        if on_delta is not None:
+            stream = client.chat.completions.create(
+                model="deepseek-chat",
+                messages=llm_messages,
+                stream=True
+            )
+            try:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        summary += delta
+                        on_delta(summary)
+            finally:
+                # 取消时尽早断开连接，不再继续生成
+                stream.close()
+        else:
+            completion = client.chat.completions.create(
+                model="deepseek-chat",
+                messages=llm_messages,
+                stream=False
+            )
+            
+            # 提取回复
+            if hasattr(completion, 'choices') and completion.choices:
+                msg = completion.choices[0].message
+                if isinstance(msg, dict):
+                    summary = msg.get('content', '')
+                else:
+                    summary = getattr(msg, 'content', '')
         
         if not summary:
             return {'success': False, 'error': 'LLM未返回总结内容'}
         
         return {'success': True, 'summary': summary.strip()}
         
+    except JobCancelled:
+        # 后台任务被取消（on_delta 抛出），交给 job_runner 记为 cancelled
+        raise
     except Exception as e:
         logger.error(f"总结消息失败: {e}")
         return {'success': False, 'error': str(e)}
 
 
-def save_memory(summary: str, source_messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+def save_memory(summary: str, source_messages: Optional[List[Dict[str, str]]] = None,
+                source_hash: Optional[str] = None) -> Dict[str, Any]:
     """保存记忆总结到memory.jsonl
     
     Args:
         summary: 总结内容
         source_messages: 原始消息（可选）
+        source_hash: 原始消息的指纹（见 messages_hash），用于重复总结时直接返回已有记忆
     
     Returns:
         {
@@ -117,11 +180,15 @@ def save_memory(summary: str, source_messages: Optional[List[Dict[str, str]]] =
             'createdAt': datetime.now().isoformat(),
             'source_messages': source_messages if source_messages else []
         }
+        if source_hash:
+            memory_record['source_hash'] = source_hash
         
-        with _file_lock:
-            with open(MEMORY_FILE, 'a', encoding='utf-8') as f:
-                json_line = json.dumps(memory_record, ensure_ascii=False)
-                f.write(json_line + '\n')
+        # 原始消息单独存放，主文件只保存精简记录和偏移索引
+        get_memory_store(MEMORY_FILE).append(memory_record)
+        if source_hash:
+            with _summary_lock:
+                if _summary_hashes is not None:
+                    _summary_hashes[source_hash] = memory_id
         
         logger.info(f"保存记忆成功: {memory_id}")
         return {'success': True, 'memory_id': memory_id, 'memory': memory_record}
@@ -131,12 +198,74 @@ def save_memory(summary: str, source_messages: Optional[List[Dict[str, str]]] =
         return {'success': False, 'error': str(e)}
 
 
-def find_similar_memories(summary: str, k: int = 5) -> Dict[str, Any]:
+def messages_hash(messages: List[Dict[str, str]]) -> str:
+    """对话选段的指纹：只看角色和去除首尾空白的内容"""
+    canonical = [[str(m.get('role', '')), str(m.get('content', '')).strip()] for m in messages]
+    return hashlib.sha256(json.dumps(canonical, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def find_summarized(source_hash: str) -> Optional[Dict[str, Any]]:
+    """返回同一对话选段已生成的记忆（不含原始消息），没有则返回None"""
+    global _summary_hashes
+    with _summary_lock:
+        if _summary_hashes is None:
+            # 首次使用时从记忆记录中建立指纹索引（只读精简记录）
+            store = get_memory_store(MEMORY_FILE)
+            page = store.list(offset=0, limit=len(store), newest_first=False)
+            _summary_hashes = {m['source_hash']: m['id'] for m in page['items'] if m.get('source_hash')}
+        memory_id = _summary_hashes.get(source_hash)
+    return get_memory_by_id(memory_id, with_messages=False) if memory_id else None
+
+
+def summarize_and_save(messages: List[Dict[str, str]], on_delta: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """总结对话选段并保存为记忆；同一选段已总结过时直接返回已有记忆，不再调用LLM
+    
+    Returns:
+        {
+            'success': bool,
+            'memory_id': str,
+            'memory': Dict,
+            'cached': bool,   # 是否直接复用了已有记忆
+            'error': str
+        }
+    """
+    source_hash = messages_hash(messages)
+    cached = find_summarized(source_hash)
+    if cached:
+        return {'success': True, 'memory_id': cached['id'], 'memory': cached, 'cached': True}
+    
+    summary_result = summarize_messages(messages, on_delta=on_delta)
+    if not summary_result.get('success'):
+        return {'success': False, 'error': summary_result.get('error', '总结失败')}
+    summary = summary_result.get('summary', '')
+    if not summary:
+        return {'success': False, 'error': '总结内容为空'}
+    
+    save_result = save_memory(summary, source_messages=messages, source_hash=source_hash)
+    if not save_result.get('success'):
+        return {'success': False, 'error': save_result.get('error', '保存失败')}
+    return {'success': True, 'memory_id': save_result['memory_id'], 'memory': save_result['memory'], 'cached': False}
+
+
+def _resolve_model_path() -> Optional[str]:
+    """返回向量模型路径：优先SENT_MODEL_PATH，其次项目默认模型目录"""
+    model_path = os.getenv('SENT_MODEL_PATH')
+    if not model_path:
+        default_model_path = os.path.join(
+            os.path.dirname(__file__), '..', '..', '..', 
+            'models', 'Jerry0', 'text2vec-base-chinese'
+        )
+        model_path = default_model_path if os.path.exists(default_model_path) else None
+    return model_path
+
+
+def find_similar_memories(summary: str, k: int = 5, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """在向量数据库中查找相似记忆
     
     Args:
         summary: 要查找的总结内容
         k: 返回top-k结果
+        filters: 元数据过滤条件，如 {'source': 'memory'} 只比较记忆条目（见 vector_store.search）
     
     Returns:
         {
@@ -146,25 +275,22 @@ def find_similar_memories(summary: str, k: int = 5) -> Dict[str, Any]:
         }
     """
     try:
-        from .vector_store import search_enhanced, index_exists
+        try:
+            from .vector_store import search_enhanced, index_exists
+        except ImportError:
+            from vector_store import search_enhanced, index_exists
         
         if not index_exists():
             return {'success': False, 'error': '向量索引不存在'}
         
         # 获取模型路径
-        model_path = os.getenv('SENT_MODEL_PATH')
-        if not model_path:
-            default_model_path = os.path.join(
-                os.path.dirname(__file__), '..', '..', '..', 
-                'models', 'Jerry0', 'text2vec-base-chinese'
-            )
-            model_path = default_model_path if os.path.exists(default_model_path) else None
+        model_path = _resolve_model_path()
         
         if not model_path:
             return {'success': False, 'error': '未配置SENT_MODEL_PATH且找不到默认模型'}
         
-        # 搜索相似记忆
-        search_result = search_enhanced(summary, k=k, model_path=model_path)
+        # 搜索相似记忆；下游按余弦相似度判断重复，这里只用向量检索
+        search_result = search_enhanced(summary, k=k, model_path=model_path, hybrid=False, filters=filters)
         
         if not search_result.get('success'):
             return {'success': False, 'error': search_result.get('error', '搜索失败')}
@@ -175,7 +301,8 @@ def find_similar_memories(summary: str, k: int = 5) -> Dict[str, Any]:
             similar_memories.append({
                 'id': item.get('id'),
                 'text': item.get('text', ''),
-                'score': result.get('score', 0.0)
+                'score': result.get('score', 0.0),
+                'similarity': result.get('similarity', result.get('score', 0.0))
             })
         
         return {
@@ -188,6 +315,46 @@ def find_similar_memories(summary: str, k: int = 5) -> Dict[str, Any]:
         return {'success': False, 'error': str(e)}
 
 
+def find_similar_memories_many(summaries: List[str], k: int = 5) -> Dict[str, Any]:
+    """批量查找相似记忆：所有总结一次编码、一次多查询 FAISS 检索
+    
+    Returns:
+        {
+            'success': bool,
+            'similar_memories': List[List[Dict]],  # 与 summaries 一一对应
+            'error': str
+        }
+    """
+    try:
+        try:
+            from .vector_store import search_many, index_exists
+        except ImportError:
+            from vector_store import search_many, index_exists
+        
+        if not index_exists():
+            return {'success': False, 'error': '向量索引不存在'}
+        model_path = _resolve_model_path()
+        if not model_path:
+            return {'success': False, 'error': '未配置SENT_MODEL_PATH且找不到默认模型'}
+        
+        search_result = search_many(summaries, k=k, model_path=model_path, threshold=0.1)
+        if not search_result.get('success'):
+            return {'success': False, 'error': search_result.get('error', '搜索失败')}
+        
+        # search_many 的得分即余弦相似度
+        similar = [[{
+            'id': r.get('item', {}).get('id'),
+            'text': r.get('item', {}).get('text', ''),
+            'score': r.get('score', 0.0),
+            'similarity': r.get('score', 0.0)
+        } for r in results] for results in search_result.get('results', [])]
+        return {'success': True, 'similar_memories': similar}
+        
+    except Exception as e:
+        logger.error(f"批量查找相似记忆失败: {e}")
+        return {'success': False, 'error': str(e)}
+
+
 def judge_relationship(new_memory: str, similar_memories: List[Dict[str, Any]]) -> Dict[str, Any]:
     """使用LLM判断新记忆与相似记忆的关系类型
     
@@ -283,6 +450,73 @@ def judge_relationship(new_memory: str, similar_memories: List[Dict[str, Any]])
         return {'success': False, 'error': str(e)}
 
 
+def preclassify_relationship(new_memory: str, similar_memories: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """本地判断明确的关系类型，不确定时返回None（交给LLM）
+    
+    - high_similarity：最高余弦相似度 >= KG_DUP_COSINE，或 >= KG_NEAR_DUP_COSINE 且
+      字符 shingle 的 MinHash 相似度 >= KG_NEAR_DUP_JACCARD 或 SimHash 汉明距离 <= KG_NEAR_DUP_HAMMING
+    - difference：没有相似记忆，或所有候选的余弦相似度 < KG_UNRELATED_COSINE 且
+      MinHash 相似度 < KG_UNRELATED_JACCARD
+    
+    Returns:
+        与 judge_relationship 相同的结构（附加 'judged_by': 'local'），或 None
+    """
+    def decided(relationship: str, reasoning: str) -> Dict[str, Any]:
+        return {
+            'success': True,
+            'relationship': relationship,
+            'reasoning': reasoning,
+            'max_similarity_score': max([m.get('score', 0) for m in similar_memories], default=0),
+            'judged_by': 'local'
+        }
+
+    if not similar_memories:
+        return decided('difference', 'no similar memories')
+    sig = near_dup.minhash(new_memory)
+    fingerprint = near_dup.simhash(new_memory)
+    max_cosine = 0.0
+    max_jaccard = 0.0
+    for mem in similar_memories:
+        cosine = float(mem.get('similarity', mem.get('score', 0)) or 0)
+        jaccard = near_dup.minhash_similarity(sig, near_dup.minhash(mem.get('text', '')))
+        distance = near_dup.hamming(fingerprint, near_dup.simhash(mem.get('text', '')))
+        if cosine >= DUP_COSINE:
+            return decided('high_similarity', f"cosine {cosine:.3f} with {mem.get('id')}")
+        if cosine >= NEAR_DUP_COSINE and (jaccard >= NEAR_DUP_JACCARD or distance <= NEAR_DUP_HAMMING):
+            return decided('high_similarity', f"cosine {cosine:.3f}, minhash {jaccard:.2f}, simhash distance {distance} with {mem.get('id')}")
+        max_cosine = max(max_cosine, cosine)
+        max_jaccard = max(max_jaccard, jaccard)
+    if max_cosine < UNRELATED_COSINE and max_jaccard < UNRELATED_JACCARD:
+        return decided('difference', f'max cosine {max_cosine:.3f}, max minhash {max_jaccard:.2f}')
+    return None
+
+
+def classify_relationship(new_memory: str, similar_memories: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """先本地预判，只有不确定的情况才调用 judge_relationship（LLM），并记录跳过的 LLM 调用比例"""
+    result = preclassify_relationship(new_memory, similar_memories) if LOCAL_JUDGE_ENABLED else None
+    if result is None:
+        result = judge_relationship(new_memory, similar_memories)
+        if result.get('success'):
+            result['judged_by'] = 'llm'
+    if result.get('success'):
+        with _judge_stats_lock:
+            _judge_stats['total'] += 1
+            _judge_stats[result['judged_by']] += 1
+            if result['judged_by'] == 'local':
+                _judge_stats[f"local_{result['relationship']}"] += 1
+            skipped = _judge_stats['local'] / _judge_stats['total']
+        logger.info(f"关系判断: {result['relationship']}（{result['judged_by']}），LLM 调用跳过比例 {skipped:.1%}")
+    return result
+
+
+def get_judge_stats() -> Dict[str, Any]:
+    """关系判断统计，skipped_ratio 为未调用 LLM 的比例"""
+    with _judge_stats_lock:
+        stats = dict(_judge_stats)
+    stats['skipped_ratio'] = stats['local'] / stats['total'] if stats['total'] else 0.0
+    return stats
+
+
 def append_to_text_db(memory_data: Dict[str, Any]) -> Dict[str, Any]:
     """将记忆数据追加到total.jsonl（按JSONL格式，每行一个JSON对象）
     
@@ -297,96 +531,188 @@ def append_to_text_db(memory_data: Dict[str, Any]) -> Dict[str, Any]:
         }
     """
     try:
-        # 读取现有数据（支持JSON数组和JSONL两种格式）
-        existing_data = []
-        if os.path.exists(TEXT_DB_FILE):
-            with _file_lock:
-                with open(TEXT_DB_FILE, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:
-                        try:
-                            # 尝试解析为JSON数组
-                            existing_data = json.loads(content)
-                            if not isinstance(existing_data, list):
-                                existing_data = []
-                        except json.JSONDecodeError:
-                            # 如果不是JSON数组，按行解析JSONL
-                            existing_data = []
-                            for line in content.split('\n'):
-                                line = line.strip()
-                                if line:
-                                    try:
-                                        existing_data.append(json.loads(line))
-                                    except json.JSONDecodeError:
-                                        continue
-        
-        # 如果没有提供ID，自动生成
-        if not memory_data.get('id'):
-            # 找到最大ID
-            max_id = 0
-            for item in existing_data:
-                if isinstance(item, dict):
-                    item_id = item.get('id', '')
-                    # 尝试解析为数字
-                    try:
-                        if str(item_id).isdigit():
-                            max_id = max(max_id, int(item_id))
-                    except (ValueError, AttributeError):
-                        pass
-            memory_data['id'] = str(max_id + 1)
-        
-        # 检查是否已存在相同ID
-        existing_ids = {str(item.get('id')) for item in existing_data if isinstance(item, dict)}
-        if str(memory_data.get('id')) in existing_ids:
-            # ID已存在，生成新ID
-            max_id = 0
-            for item in existing_data:
-                if isinstance(item, dict):
-                    item_id = item.get('id', '')
-                    try:
-                        if str(item_id).isdigit():
-                            max_id = max(max_id, int(item_id))
-                    except (ValueError, AttributeError):
-                        pass
-            memory_data['id'] = str(max_id + 1)
-        
-        # 追加新数据到列表
-        existing_data.append(memory_data)
-        
-        # 按JSONL格式写回文件（每行一个JSON对象）
-        with _file_lock:
-            with open(TEXT_DB_FILE, 'w', encoding='utf-8') as f:
-                for item in existing_data:
-                    json_line = json.dumps(item, ensure_ascii=False)
-                    f.write(json_line + '\n')
+        # 追加一行并 fsync；id 为空或已存在时由分配器生成新的数字 id
+        get_text_db(TEXT_DB_FILE).append(memory_data)
         
         logger.info(f"追加数据到text_db成功: {memory_data.get('id')}")
-        return {'success': True, 'new_id': memory_data.get('id')}
+        indexed = _index_text_db_entries([memory_data])
+        return {'success': True, 'new_id': memory_data.get('id'), 'indexed': indexed}
         
     except Exception as e:
         logger.error(f"追加数据到text_db失败: {e}")
         return {'success': False, 'error': str(e)}
 
 
-def get_memory_by_id(memory_id: str) -> Optional[Dict[str, Any]]:
-    """根据ID获取记忆记录"""
-    if not os.path.exists(MEMORY_FILE):
-        return None
+def ingest_memories(memory_ids: List[str], k: int = 5, concurrency: Optional[int] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """批量将记忆更新到知识库
     
-    try:
-        with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
+    流程：读取记忆总结 -> 批内去重 -> 一次批量检索相似记忆 -> 并发判断关系
+    （本地预判 + 最多 concurrency 个并发 LLM 请求）-> 所有通过的条目一次写入
+    text_db（单次追加并 fsync）并一次增量更新向量索引。
+    已在 text_db 中的记忆不会重复添加。
+    
+    Args:
+        memory_ids: 记忆ID列表
+        k: 每条记忆比较的相似条目数
+        concurrency: 并发判断数（默认 KG_JUDGE_CONCURRENCY）
+        progress: 可选回调 progress(已判断数, 总数)
+    
+    Returns:
+        {
+            'success': bool,
+            'added': int,        # 写入知识库的条目数
+            'indexed': bool,     # 向量索引是否更新成功
+            'results': List[Dict],  # 每个记忆的处理结果，与输入顺序一致
+            'judge_stats': Dict,
+            'error': str
+        }
+    """
+    db = get_text_db(TEXT_DB_FILE)
+    results: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+    signatures = []
+    seen = set()
+    for memory_id in memory_ids:
+        memory_id = str(memory_id)
+        entry = {'memory_id': memory_id, 'added': False}
+        results.append(entry)
+        if memory_id in seen:
+            entry['error'] = '重复的记忆ID'
+            continue
+        seen.add(memory_id)
+        memory = get_memory_by_id(memory_id, with_messages=False)
+        summary = (memory or {}).get('summary', '')
+        if not memory:
+            entry['error'] = '记忆记录不存在'
+        elif not summary:
+            entry['error'] = '记忆总结为空'
+        elif memory_id in db:
+            entry['error'] = '记忆已在知识库中'
+        else:
+            # 批内去重：与本批中更早的记忆字面高度相似时不再检索和判断
+            sig = near_dup.minhash(summary)
+            twin = next((p for p, other in zip(pending, signatures)
+                         if near_dup.minhash_similarity(sig, other) >= NEAR_DUP_JACCARD), None)
+            if twin is not None:
+                entry.update(relationship='high_similarity', judged_by='batch',
+                             reasoning=f"near duplicate of {twin['entry']['memory_id']} in this batch")
+                continue
+            signatures.append(sig)
+            pending.append({'entry': entry, 'summary': summary})
+
+    if pending:
+        similar = find_similar_memories_many([p['summary'] for p in pending], k=k)
+        if not similar.get('success'):
+            return {'success': False, 'error': similar.get('error', '查找相似记忆失败')}
+        workers = max(1, min(concurrency or JUDGE_CONCURRENCY, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='memory-judge') as pool:
+            futures = {pool.submit(classify_relationship, p['summary'], sims): p
+                       for p, sims in zip(pending, similar['similar_memories'])}
+            for done, future in enumerate(as_completed(futures), 1):
+                p = futures[future]
                 try:
-                    memory = json.loads(line)
-                    if memory.get('id') == memory_id:
-                        return memory
-                except json.JSONDecodeError:
-                    continue
+                    judged = future.result()
+                except Exception as e:
+                    judged = {'success': False, 'error': str(e)}
+                if judged.get('success'):
+                    p['entry'].update(relationship=judged['relationship'], judged_by=judged.get('judged_by'),
+                                      reasoning=judged.get('reasoning'))
+                else:
+                    p['entry']['error'] = judged.get('error', '判断关系失败')
+                if progress is not None:
+                    progress(done, len(pending))
+
+    accepted = [p for p in pending if p['entry'].get('relationship') in ('extension', 'difference')]
+    docs = [{'id': p['entry']['memory_id'], 'text': p['summary']} for p in accepted]
+    indexed = False
+    if docs:
+        try:
+            # 一次追加所有条目（单次写入 + fsync），id 冲突时由分配器生成新 id
+            db.append_many(docs)
+        except Exception as e:
+            logger.error(f"批量写入text_db失败: {e}")
+            return {'success': False, 'error': str(e), 'results': results}
+        for p, doc in zip(accepted, docs):
+            p['entry'].update(added=True, new_id=doc['id'])
+        indexed = _index_text_db_entries(docs)
+        logger.info(f"批量更新记忆到知识库: {len(docs)}/{len(memory_ids)} 条写入，索引更新 {'成功' if indexed else '失败'}")
+    return {
+        'success': True,
+        'added': len(docs),
+        'indexed': indexed,
+        'results': results,
+        'judge_stats': get_judge_stats()
+    }
+
+
+def _index_text_db_entries(entries: List[Dict[str, Any]]) -> bool:
+    """把新写入text_db的条目增量更新到向量索引，失败不影响写入结果"""
+    try:
+        try:
+            from .vector_store import upsert_documents, index_exists
+        except ImportError:
+            from vector_store import upsert_documents, index_exists
+
+        if not index_exists():
+            return False
+        result = upsert_documents(entries, model_path=_resolve_model_path())
+        if not result.get('success'):
+            logger.warning(f"增量更新向量索引失败: {result.get('error')}")
+            return False
+        return True
+    except Exception as e:
+        logger.warning(f"增量更新向量索引失败: {e}")
+        return False
+
+
+def get_memory_by_id(memory_id: str, with_messages: bool = True) -> Optional[Dict[str, Any]]:
+    """根据ID获取记忆记录（通过偏移索引直接定位，with_messages=False 时不读取原始消息）"""
+    try:
+        return get_memory_store(MEMORY_FILE).get(memory_id, with_messages=with_messages)
     except Exception as e:
         logger.error(f"读取记忆失败: {e}")
+        return None
+
+
+def list_memories(offset: int = 0, limit: int = 20, with_messages: bool = False) -> Dict[str, Any]:
+    """分页列出记忆记录（最新的在前）
     
-    return None
+    Returns:
+        {
+            'success': bool,
+            'total': int,
+            'items': List[Dict],
+            'error': str
+        }
+    """
+    try:
+        page = get_memory_store(MEMORY_FILE).list(offset=offset, limit=limit, with_messages=with_messages)
+        return dict(page, success=True)
+    except Exception as e:
+        logger.error(f"列出记忆失败: {e}")
+        return {'success': False, 'error': str(e)}
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Batch-update memories into the knowledge base (text DB + vector index)')
+    parser.add_argument('memory_ids', nargs='*', help='Memory ids to ingest.')
+    parser.add_argument('--file', help='File with one memory id per line.')
+    parser.add_argument('--k', type=int, default=5, help='Similar entries compared per memory.')
+    parser.add_argument('--concurrency', type=int, default=None, help='Concurrent relationship judgements (default KG_JUDGE_CONCURRENCY).')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    memory_ids = list(args.memory_ids)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            memory_ids += [line.strip() for line in f if line.strip()]
+    if not memory_ids:
+        parser.error('no memory ids given')
+    result = ingest_memories(memory_ids, k=args.k, concurrency=args.concurrency,
+                             progress=lambda done, total: print(f'judged {done}/{total}', flush=True))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
 
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,239 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from . import storage
+except ImportError:
+    import storage
+
+logger = logging.getLogger(__name__)
+
+MEMORY_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'memory')
+MEMORY_FILE = os.path.join(MEMORY_DIR, 'memory.jsonl')
+
+_stores: Dict[str, 'MemoryStore'] = {}
+_stores_lock = threading.Lock()
+
+
+class MemoryStore:
+    """memory.jsonl with an id -> byte offset index.
+
+    Records are appended as lean lines ({'id', 'summary', 'createdAt', ...});
+    their source_messages go to a separate `<name>_messages.jsonl` and are
+    only read when asked for, so lookups and listings never parse the
+    conversations. Older records that still carry source_messages inline are
+    served as they are.
+
+    The index lives in memory and in an append-only sidecar `<file>.idx`
+    (one "id<TAB>offset<TAB>length" line per record). On load
+    the sidecar is verified against the file and only the unindexed tail is
+    scanned; a damaged sidecar is rebuilt from a full scan.
+    """
+
+    def __init__(self, path: str = MEMORY_FILE):
+        self.path = path
+        self.index_path = path + '.idx'
+        base, ext = os.path.splitext(path)
+        self.messages_path = f'{base}_messages{ext}'
+        self._entries: Dict[str, Tuple[int, int]] = {}
+        self._order: List[str] = []
+        self._size = None
+        self._lock = threading.RLock()
+
+    # ---- index ----
+
+    def _add_entry(self, memory_id: str, offset: int, length: int):
+        if memory_id not in self._entries:
+            self._order.append(memory_id)
+        self._entries[memory_id] = (offset, length)
+
+    def _read_sidecar(self, size: int) -> Tuple[int, bool]:
+        """Load sidecar entries that point inside the file.
+
+        Returns (first byte not covered, whether every sidecar line was used).
+        """
+        covered, clean = 0, True
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) != 3 or not line.endswith('\n'):
+                        clean = False
+                        break
+                    offset, length = int(parts[1]), int(parts[2])
+                    if offset < covered or offset + length > size:
+                        clean = False
+                        break
+                    self._add_entry(parts[0], offset, length)
+                    covered = offset + length
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            clean = False
+        return covered, clean
+
+    def _scan(self, start: int) -> Tuple[List[Tuple[str, int, int]], int]:
+        """Index complete lines of the data file from byte `start` (a line boundary).
+
+        Returns (entries, end of the last complete line).
+        """
+        found = []
+        offset = start
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(raw.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    record = None
+                if isinstance(record, dict) and record.get('id'):
+                    found.append((str(record['id']), offset, len(raw)))
+                offset += len(raw)
+        return found, offset
+
+    def _write_sidecar(self, entries, mode: str):
+        with open(self.index_path, mode, encoding='utf-8') as f:
+            for memory_id, offset, length in entries:
+                f.write(f'{memory_id}\t{offset}\t{length}\n')
+
+    def _load(self):
+        """(Re)build the index from the sidecar plus a scan of the unindexed tail (lock held)."""
+        self._entries, self._order = {}, []
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        covered, clean = self._read_sidecar(size)
+        tail, end = self._scan(covered) if size > covered else ([], covered)
+        if end < size:
+            # 崩溃留下的不完整尾行，截断后再追加
+            logger.warning('memory 文件尾部存在不完整的记录，已截断: %s', self.path)
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+            size = end
+        for entry in tail:
+            self._add_entry(*entry)
+        if not clean:
+            self._write_sidecar([(mid,) + self._entries[mid] for mid in self._order], 'w')
+        elif tail:
+            self._write_sidecar(tail, 'a')
+        self._size = size
+
+    def _ensure_loaded(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self._size is None or size < self._size:
+            self._load()
+        elif size > self._size:
+            # 其他进程追加的记录
+            tail, end = self._scan(self._size)
+            for entry in tail:
+                self._add_entry(*entry)
+            self._write_sidecar(tail, 'a')
+            self._size = end
+
+    # ---- io ----
+
+    @staticmethod
+    def _append_line(path: str, record: Dict[str, Any]) -> Tuple[int, int]:
+        data = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset, len(data)
+
+    @staticmethod
+    def _read_line(path: str, offset: int, length: int) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return json.loads(f.read(length).decode('utf-8'))
+        except (OSError, ValueError, UnicodeDecodeError):
+            return None
+
+    def _messages_of(self, record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        ref = record.get('_messages')
+        if not ref:
+            return record.get('source_messages') or []
+        row = self._read_line(self.messages_path, ref[0], ref[1]) or {}
+        return row.get('source_messages') or []
+
+    def _public(self, record: Dict[str, Any], with_messages: bool) -> Dict[str, Any]:
+        out = {k: v for k, v in record.items() if k not in ('_messages', 'source_messages')}
+        if with_messages:
+            out['source_messages'] = self._messages_of(record)
+        return out
+
+    # ---- api ----
+
+    def append(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Append a memory record (with optional 'source_messages'); returns the record as stored."""
+        memory_id = str(record['id'])
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._ensure_loaded()
+            lean = {k: v for k, v in record.items() if k != 'source_messages'}
+            messages = record.get('source_messages') or []
+            if messages:
+                # 先写原始消息，主记录只保存其位置
+                lean['_messages'] = list(self._append_line(self.messages_path, {'id': memory_id, 'source_messages': messages}))
+            offset, length = self._append_line(self.path, lean)
+            self._add_entry(memory_id, offset, length)
+            self._write_sidecar([(memory_id, offset, length)], 'a')
+            self._size = offset + length
+        return record
+
+    def get(self, memory_id: str, with_messages: bool = True) -> Optional[Dict[str, Any]]:
+        """Record by id in O(1); with_messages=False skips the source conversation."""
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(str(memory_id))
+        if entry is None:
+            return None
+        record = self._read_line(self.path, entry[0], entry[1])
+        if record is None:
+            return None
+        return self._public(record, with_messages)
+
+    def list(self, offset: int = 0, limit: int = 20, newest_first: bool = True,
+             with_messages: bool = False) -> Dict[str, Any]:
+        """One page of records in append order (newest first by default) plus the total count."""
+        with self._lock:
+            self._ensure_loaded()
+            ids = self._order[::-1] if newest_first else list(self._order)
+            page = [self._entries[mid] for mid in ids[max(0, offset):max(0, offset) + max(0, limit)]]
+        items = []
+        if page:
+            with open(self.path, 'rb') as f:
+                for off, length in page:
+                    f.seek(off)
+                    try:
+                        record = json.loads(f.read(length).decode('utf-8'))
+                    except (ValueError, UnicodeDecodeError):
+                        continue
+                    items.append(self._public(record, with_messages))
+        return {'total': len(ids), 'offset': offset, 'limit': limit, 'items': items}
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._entries)
+
+
+def get_memory_store(path: Optional[str] = None) -> MemoryStore:
+    """Process-wide MemoryStore for `path` (default MEMORY_FILE).
+
+    With KG_STORAGE=sqlite the records live in the shared SQLite database
+    and `path` is ignored.
+    """
+    if storage.use_sqlite():
+        return storage.get_memory_store()
+    path = os.path.abspath(path or MEMORY_FILE)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = MemoryStore(path)
+        return store
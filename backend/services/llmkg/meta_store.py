@@ -0,0 +1,415 @@
+import os
+import re
+import json
+import mmap
+import struct
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+# 每条记录定长 16 字节：数据偏移(u64) + 长度(u32) + 标志(u32)
+RECORD = struct.Struct('<QII')
+FLAG_DELETED = 1
+
+# PCB 缺陷名称，文本中出现即作为 defect 字段的取值
+DEFECT_TERMS = (
+    '划痕', '开路', '短路', '鼠咬', '针孔', '钻孔错位', '铜不足', '过刻蚀', '欠刻蚀',
+    '焊桥', '焊锡不足', '焊锡过多', '通孔空洞', '分层', '表面污染', '纤维暴露',
+    '焊盘翘起', '起泡', '毛刺', '裂纹',
+)
+# 按范围过滤的数值字段
+NUMERIC_FIELDS = ('created_at',)
+RANGE_OPS = ('gt', 'gte', 'lt', 'lte')
+# 额外建立倒排的文档字段（逗号分隔），取值为标量或标量列表
+EXTRA_FILTER_FIELDS = [f.strip() for f in os.getenv('VEC_FILTER_FIELDS', '').split(',') if f.strip()]
+
+FILTER_FIELDS = ('source', 'defect') + NUMERIC_FIELDS + tuple(EXTRA_FILTER_FIELDS)
+
+_MEMORY_ID_RE = re.compile(r'^memory_(\d{10,})$')
+
+
+def store_exists(path: str) -> bool:
+    return os.path.exists(path + '.idx') and os.path.exists(path + '.dat')
+
+
+class MetaStore:
+    """Document metadata addressed by row id (== FAISS label).
+
+    `<path>.idx` holds one fixed-width record per row pointing into
+    `<path>.dat`, an append-only file of JSON blobs. Both are memory-mapped, so
+    opening a store costs O(1) regardless of corpus size and rows are decoded
+    only when read. Updates append a new blob and rewrite the row's record in
+    place; deletes only flag the record.
+
+    Writers are serialized across processes by an flock on the `.idx` file,
+    and the row count is re-read from the file size under it, so a store
+    opened by several processes never hands out the same row twice. Readers
+    see rows appended by other processes on their next length check.
+
+    Rows replayed from an index's delta log are layered over the files in
+    memory (`apply`) instead of being written: the process that logged them
+    writes them itself, and `persist` folds whatever a crash left only in
+    the log into the files when the delta is compacted.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.idx_path = path + '.idx'
+        self.dat_path = path + '.dat'
+        for p in (self.idx_path, self.dat_path):
+            if not os.path.exists(p):
+                open(p, 'ab').close()
+        self._idx_f = open(self.idx_path, 'r+b')
+        self._dat_f = open(self.dat_path, 'r+b')
+        self._idx_map = None
+        self._dat_map = None
+        self._lock = threading.RLock()
+        self._count = 0
+        self._refresh_count()
+        # 回放增量日志得到、与文件内容不同的行：label -> JSON（None 表示已删除），只在内存中
+        self._overlay: Dict[int, Optional[bytes]] = {}
+        self._overlay_end = 0
+
+    @classmethod
+    def create(cls, path: str, docs: List[Optional[Dict[str, Any]]]) -> 'MetaStore':
+        """Write a fresh store for `docs` (row i == docs[i]) and swap it in atomically."""
+        tmp = path + '.tmp'
+        offset = 0
+        with open(tmp + '.dat', 'wb') as dat, open(tmp + '.idx', 'wb') as idx:
+            for doc in docs:
+                if doc is None:
+                    idx.write(RECORD.pack(0, 0, FLAG_DELETED))
+                    continue
+                blob = json.dumps(doc, ensure_ascii=False).encode('utf-8')
+                dat.write(blob)
+                idx.write(RECORD.pack(offset, len(blob), 0))
+                offset += len(blob)
+            dat.flush()
+            os.fsync(dat.fileno())
+            idx.flush()
+            os.fsync(idx.fileno())
+        # 先替换数据文件再替换索引文件：旧索引只会指向旧数据的前缀
+        os.replace(tmp + '.dat', path + '.dat')
+        os.replace(tmp + '.idx', path + '.idx')
+        return cls(path)
+
+    @classmethod
+    def from_json(cls, json_path: str, path: str) -> 'MetaStore':
+        """One-shot migration from the legacy metadata.json list."""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        return cls.create(path, docs)
+
+    def close(self):
+        with self._lock:
+            for m in (self._idx_map, self._dat_map):
+                if m is not None:
+                    m.close()
+            self._idx_map = self._dat_map = None
+            self._idx_f.close()
+            self._dat_f.close()
+
+    def _refresh_count(self) -> int:
+        """Row count from the current `.idx` size; other processes may have appended."""
+        # 崩溃可能留下半条记录，忽略尾部
+        self._count = os.fstat(self._idx_f.fileno()).st_size // RECORD.size
+        return self._count
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive lock for writing (threads of this process + other processes)."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._idx_f.fileno(), fcntl.LOCK_EX)
+            try:
+                self._refresh_count()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._idx_f.fileno(), fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        return max(self._refresh_count(), self._overlay_end)
+
+    def _map(self, current, f):
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        if current is None or len(current) < size:
+            if current is not None:
+                current.close()
+            current = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return current
+
+    def _record(self, label: int):
+        self._idx_map = self._map(self._idx_map, self._idx_f)
+        return RECORD.unpack_from(self._idx_map, label * RECORD.size)
+
+    def get(self, label: int) -> Optional[Dict[str, Any]]:
+        if label in self._overlay:
+            blob = self._overlay[label]
+            return json.loads(blob.decode('utf-8')) if blob is not None else None
+        return self._read(label)
+
+    def _read(self, label: int) -> Optional[Dict[str, Any]]:
+        """Row `label` as stored in the files, ignoring the overlay."""
+        if label < 0 or (label >= self._count and label >= self._refresh_count()):
+            return None
+        with self._lock:
+            offset, length, flags = self._record(label)
+            if flags & FLAG_DELETED:
+                return None
+            self._dat_map = self._map(self._dat_map, self._dat_f)
+            blob = self._dat_map[offset:offset + length]
+        return json.loads(blob.decode('utf-8'))
+
+    def __getitem__(self, label: int) -> Optional[Dict[str, Any]]:
+        return self.get(label)
+
+    def __iter__(self) -> Iterator[Optional[Dict[str, Any]]]:
+        for label in range(len(self)):
+            yield self.get(label)
+
+    def _write_blob(self, doc: Dict[str, Any]):
+        """Append a JSON blob to `.dat` (write lock held); returns (offset, length)."""
+        blob = json.dumps(doc, ensure_ascii=False).encode('utf-8')
+        self._dat_f.seek(0, os.SEEK_END)
+        offset = self._dat_f.tell()
+        self._dat_f.write(blob)
+        self._dat_f.flush()
+        return offset, len(blob)
+
+    def _write_record(self, label: int, offset: int, length: int, flags: int):
+        self._idx_f.seek(label * RECORD.size)
+        self._idx_f.write(RECORD.pack(offset, length, flags))
+        self._idx_f.flush()
+
+    def append(self, doc: Optional[Dict[str, Any]]) -> int:
+        """Append a row and return its id."""
+        with self._write_lock():
+            return self._append_locked(doc)
+
+    def _append_locked(self, doc: Optional[Dict[str, Any]]) -> int:
+        label = self._count
+        if doc is None:
+            self._write_record(label, 0, 0, FLAG_DELETED)
+        else:
+            offset, length = self._write_blob(doc)
+            self._write_record(label, offset, length, 0)
+        self._count += 1
+        return label
+
+    def set(self, label: int, doc: Optional[Dict[str, Any]]):
+        """Replace (or, with None, delete) an existing row; appends when label == len(self)."""
+        with self._write_lock():
+            self._set_locked(label, doc)
+
+    def _set_locked(self, label: int, doc: Optional[Dict[str, Any]]):
+        if label < 0 or label > max(self._count, self._overlay_end):
+            raise IndexError(label)
+        self._overlay.pop(label, None)
+        # 中间只存在于 overlay 的行先占位，其内容仍由 overlay 提供
+        while self._count < label:
+            self._append_locked(None)
+        if label == self._count:
+            self._append_locked(doc)
+        elif doc is None:
+            offset, length, _ = self._record(label)
+            self._write_record(label, offset, length, FLAG_DELETED)
+        else:
+            offset, length = self._write_blob(doc)
+            self._write_record(label, offset, length, 0)
+
+    def apply(self, label: int, doc: Optional[Dict[str, Any]]):
+        """Layer a row replayed from the delta log over the store, in memory only."""
+        with self._lock:
+            if self._read(label) == doc:
+                self._overlay.pop(label, None)
+                return
+            self._overlay[label] = json.dumps(doc, ensure_ascii=False).encode('utf-8') if doc is not None else None
+            self._overlay_end = max(self._overlay_end, label + 1)
+
+    def persist(self):
+        """Write the overlaid rows into the files (writer only, before the delta log is dropped)."""
+        with self._write_lock():
+            for label in sorted(self._overlay):
+                blob = self._overlay[label]
+                self._set_locked(label, json.loads(blob.decode('utf-8')) if blob is not None else None)
+            self._overlay_end = 0
+
+    def __setitem__(self, label: int, doc: Optional[Dict[str, Any]]):
+        self.set(label, doc)
+
+    def sync(self):
+        """fsync both files."""
+        with self._lock:
+            os.fsync(self._dat_f.fileno())
+            os.fsync(self._idx_f.fileno())
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    """Epoch seconds from a number (seconds or milliseconds) or an ISO-8601 string."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) / 1000.0 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _values(value: Any) -> List[Any]:
+    items = value if isinstance(value, (list, tuple, set)) else [value]
+    return [v for v in items if isinstance(v, (str, int, float, bool))]
+
+
+def document_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Filterable attributes of a document.
+
+    source: the doc's 'source', else 'memory' for ids minted by save_memory and
+        'text_db' otherwise.
+    defect: the doc's 'defect' value(s), else the DEFECT_TERMS found in its text.
+    created_at: epoch seconds from 'created_at'/'timestamp', else from a
+        memory_<ms> id; absent when unknown.
+    Plus any fields named in VEC_FILTER_FIELDS.
+    """
+    doc_id = str(doc.get('id', ''))
+    fields: Dict[str, Any] = {}
+    fields['source'] = _values(doc.get('source') or ('memory' if doc_id.startswith('memory_') else 'text_db'))
+    defects = doc.get('defect')
+    if defects is None:
+        text = doc.get('text', '')
+        defects = [term for term in DEFECT_TERMS if term in text]
+    fields['defect'] = _values(defects)
+    created = _timestamp(doc.get('created_at', doc.get('timestamp')))
+    if created is None:
+        m = _MEMORY_ID_RE.match(doc_id)
+        created = int(m.group(1)) / 1000.0 if m else None
+    if created is not None:
+        fields['created_at'] = created
+    for name in EXTRA_FILTER_FIELDS:
+        if name in doc and name not in fields:
+            fields[name] = _values(doc[name])
+    return fields
+
+
+class FieldIndex:
+    """Per-field inverted lists over row ids, used to pre-filter searches.
+
+    Categorical fields map each value to the set of rows holding it; numeric
+    fields (NUMERIC_FIELDS) keep row -> value and answer ranges from a sorted
+    array rebuilt lazily after writes. `select` compiles a filter spec into the
+    sorted array of matching row ids. Writers must be serialized by the caller.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Any, set]] = {}
+        self._numeric: Dict[str, Dict[int, float]] = {}
+        self._sorted: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._row_fields: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._row_fields)
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[int, Dict[str, Any]]]) -> 'FieldIndex':
+        """Build from (row id, fields) pairs as produced by `document_fields`."""
+        index = cls()
+        for label, fields in rows:
+            index.add(label, fields)
+        return index
+
+    def add(self, label: int, fields: Dict[str, Any]):
+        """Index (or re-index) row `label`."""
+        self.remove(label)
+        for name, value in fields.items():
+            if name in NUMERIC_FIELDS:
+                self._numeric.setdefault(name, {})[label] = float(value)
+                self._sorted.pop(name, None)
+            else:
+                posting = self._postings.setdefault(name, {})
+                for v in value:
+                    posting.setdefault(v, set()).add(label)
+        self._row_fields[label] = fields
+
+    def remove(self, label: int):
+        fields = self._row_fields.pop(label, None)
+        if fields is None:
+            return
+        for name, value in fields.items():
+            if name in NUMERIC_FIELDS:
+                self._numeric.get(name, {}).pop(label, None)
+                self._sorted.pop(name, None)
+                continue
+            posting = self._postings.get(name, {})
+            for v in value:
+                rows = posting.get(v)
+                if rows is not None:
+                    rows.discard(label)
+                    if not rows:
+                        del posting[v]
+
+    def _sorted_numeric(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        cached = self._sorted.get(name)
+        if cached is None:
+            values = self._numeric.get(name, {})
+            labels = np.fromiter(values.keys(), dtype='int64', count=len(values))
+            keys = np.fromiter(values.values(), dtype='float64', count=len(values))
+            order = np.argsort(keys, kind='stable')
+            cached = self._sorted[name] = (keys[order], labels[order])
+        return cached
+
+    def _range(self, name: str, cond: Dict[str, Any]) -> np.ndarray:
+        unknown = set(cond) - set(RANGE_OPS)
+        if unknown:
+            raise ValueError(f'unknown range operator for {name}: {sorted(unknown)}')
+        keys, labels = self._sorted_numeric(name)
+        lo, hi = 0, len(keys)
+        for op, value in cond.items():
+            bound = _timestamp(value)
+            if bound is None:
+                raise ValueError(f'invalid bound for {name}.{op}: {value!r}')
+            if op in ('gt', 'gte'):
+                lo = max(lo, int(np.searchsorted(keys, bound, side='right' if op == 'gt' else 'left')))
+            else:
+                hi = min(hi, int(np.searchsorted(keys, bound, side='left' if op == 'lt' else 'right')))
+        return np.sort(labels[lo:hi]) if lo < hi else np.empty(0, dtype='int64')
+
+    def select(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Sorted row ids matching every field of `filters`.
+
+        Each field takes a value, a list of values (any of them), or for numeric
+        fields a range {'gte': .., 'lt': ..} (numbers or ISO dates).
+        """
+        matches = []
+        for name, cond in filters.items():
+            if name not in FILTER_FIELDS:
+                raise ValueError(f'field is not indexed: {name}')
+            if name in NUMERIC_FIELDS:
+                if not isinstance(cond, dict):
+                    cond = {'gte': cond, 'lte': cond}
+                matches.append(self._range(name, cond))
+                continue
+            posting = self._postings.get(name, {})
+            rows = set().union(*(posting.get(v, ()) for v in _values(cond)))
+            matches.append(np.sort(np.fromiter(rows, dtype='int64', count=len(rows))))
+        if not matches:
+            return np.empty(0, dtype='int64')
+        # 从最小的集合开始求交集
+        matches.sort(key=len)
+        result = matches[0]
+        for other in matches[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
@@ -0,0 +1,63 @@
+import re
+import hashlib
+from typing import Set
+
+import numpy as np
+
+# 字符 shingle 长度；中文文本按字切分，3 个字足以区分大部分短语
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_BITS = np.arange(64, dtype=np.uint64)
+_NOISE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """Lowercase and drop whitespace/punctuation so formatting differences don't count."""
+    return _NOISE.sub('', (text or '').lower())
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    text = normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _hashes(items: Set[str]) -> np.ndarray:
+    """Stable 64-bit hashes of the shingles (Python's hash() is salted per process)."""
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for s in items], dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray:
+    """NUM_PERM-value MinHash signature of the text's character shingles."""
+    items = shingles(text)
+    if not items:
+        return np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    # 取低 31 位，保证 a*x+b 不溢出 uint64
+    x = _hashes(items) & np.uint64((1 << 31) - 1)
+    return ((_PERM_A[:, None] * x[None, :] + _PERM_B[:, None]) % _MERSENNE).min(axis=1)
+
+
+def minhash_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the two shingle sets."""
+    return float(np.mean(a == b))
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over character shingles."""
+    items = shingles(text)
+    if not items:
+        return 0
+    bits = (_hashes(items)[:, None] >> _BITS) & np.uint64(1)
+    votes = bits.sum(axis=0).astype(np.int64) * 2 - len(items)
+    return int(sum(1 << i for i in range(64) if votes[i] > 0))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
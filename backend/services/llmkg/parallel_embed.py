@@ -0,0 +1,123 @@
+import os
+import logging
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from . import embedding_backend
+    from .shard_pool import spawn_worker
+except ImportError:
+    # 作为脚本直接运行 vector_store.py 时没有包上下文
+    import embedding_backend
+    from shard_pool import spawn_worker
+
+logger = logging.getLogger(__name__)
+
+# 全量重建时的编码进程数，0/1 表示在当前进程内编码
+BUILD_WORKERS = int(os.getenv('VEC_BUILD_WORKERS', '0'))
+# 每个编码任务的文本数；任务内按长度排序，padding 最少
+BUCKET_SIZE = int(os.getenv('VEC_BUILD_BUCKET', '512'))
+# 每个进程最多排队的任务数，限制在途向量占用的内存
+INFLIGHT_PER_WORKER = int(os.getenv('VEC_BUILD_INFLIGHT', '2'))
+# 是否把每个编码进程绑定到一组独占的 CPU 核
+PIN_CORES = os.getenv('VEC_BUILD_PIN_CORES', '1').lower() in ('1', 'true', 'yes')
+
+
+def length_buckets(lengths: Sequence[int], bucket_size: Optional[int] = None) -> List[np.ndarray]:
+    """Positions grouped into buckets of similar text length, longest first.
+
+    Long buckets go first so the slowest tasks start early and the tail of
+    the build is made of cheap short ones.
+    """
+    bucket_size = max(1, bucket_size or BUCKET_SIZE)
+    order = np.argsort(-np.asarray(lengths, dtype='int64'), kind='stable')
+    return [order[i:i + bucket_size] for i in range(0, len(order), bucket_size)]
+
+
+def _core_groups(workers: int) -> List[Optional[List[int]]]:
+    """Split the CPUs this process may use into `workers` contiguous groups (None: no pinning)."""
+    if not PIN_CORES or not hasattr(os, 'sched_getaffinity'):
+        return [None] * workers
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < workers:
+        return [None] * workers
+    per = len(cores) // workers
+    return [cores[i * per:(i + 1) * per] for i in range(workers)]
+
+
+class EmbedPool:
+    """Encoder processes, each with its own model instance and a fixed thread budget.
+
+    Texts are sent in length buckets; `encode` yields (positions, vectors)
+    as buckets finish, never holding more than INFLIGHT_PER_WORKER buckets
+    per worker, so the caller can stream them into the index.
+    """
+
+    def __init__(self, model_path: str, workers: int, backend: Optional[str] = None):
+        self.workers = max(1, workers)
+        self.backend = backend or embedding_backend.EMBED_BACKEND
+        groups = _core_groups(self.workers)
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+        self._procs = []
+        self._conns: List[Connection] = []
+        for group in groups:
+            threads = len(group) if group else max(1, cpus // self.workers)
+            args = ['--model-path', model_path, '--backend', self.backend, '--threads', str(threads)]
+            if group:
+                args += ['--cores', ','.join(str(c) for c in group)]
+            # 线程数需在 torch / onnxruntime 导入前通过环境变量确定
+            proc, conn = spawn_worker('services.llmkg.build_worker', args, env={
+                'OMP_NUM_THREADS': str(threads), 'MKL_NUM_THREADS': str(threads),
+                'VEC_EMBED_THREADS': str(threads), 'TOKENIZERS_PARALLELISM': 'false', 'VEC_SHARDS': '0'})
+            self._procs.append(proc)
+            self._conns.append(conn)
+        logger.info('并行编码: %d 个进程 (%s)', self.workers, self.backend)
+
+    def encode(self, corpus: Sequence[str], buckets: List[np.ndarray],
+               batch_size: int = 64) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield (positions, normalized float32 vectors) per bucket, in completion order."""
+        todo = deque(buckets)
+        inflight: Dict[Connection, deque] = {conn: deque() for conn in self._conns}
+
+        def feed(conn: Connection):
+            while todo and len(inflight[conn]) < INFLIGHT_PER_WORKER:
+                positions = todo.popleft()
+                conn.send(('encode', [corpus[i] for i in positions], batch_size))
+                inflight[conn].append(positions)
+
+        for conn in self._conns:
+            feed(conn)
+        while any(inflight.values()):
+            for conn in wait([c for c, q in inflight.items() if q]):
+                try:
+                    ok, payload = conn.recv()
+                except (EOFError, OSError):
+                    raise RuntimeError('embedding worker exited')
+                if not ok:
+                    raise RuntimeError(f'embedding worker failed: {payload}')
+                positions = inflight[conn].popleft()
+                feed(conn)
+                yield positions, payload
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(('stop', None, None))
+            except OSError:
+                pass
+            conn.close()
+        for proc in self._procs:
+            try:
+                proc.wait(timeout=5)
+            except Exception:
+                proc.kill()
+        self._conns, self._procs = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -3,6 +3,7 @@ import logging
 from typing import Dict, Any, List, Optional, Tuple
 from .kg_service import neo4j_service
 from .vector_store import search_enhanced, index_exists
+from .meta_store import DEFECT_TERMS
 from .llm_service import llm_generate_cypher
 from .schema_store import load_schema
 
@@ -37,13 +38,7 @@ class RAGService:
         }
 
         # 提取关键词
-        defect_keywords = [
-            '划痕', '开路', '短路', '鼠咬', '针孔', '钻孔错位', '铜不足', '过刻蚀', '欠刻蚀',
-            '焊桥', '焊锡不足', '焊锡过多', '通孔空洞', '分层', '表面污染', '纤维暴露',
-            '焊盘翘起', '起泡', '毛刺', '裂纹'
-        ]
-
-        found_keywords = [kw for kw in defect_keywords if kw in question]
+        found_keywords = [kw for kw in DEFECT_TERMS if kw in question]
 
         return {
             'query_type': query_type,
@@ -110,7 +105,15 @@ class RAGService:
                 # 默认模型路径
                 model_path = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'models', 'Jerry0', 'text2vec-base-chinese')
 
-            search_result = search_enhanced(question, k=k, model_path=model_path)
+            search_result = None
+            if query_analysis.get('has_specific_defect'):
+                # 先在提到该缺陷的文档中检索，没有命中再放开限制
+                search_result = search_enhanced(question, k=k, model_path=model_path,
+                                                filters={'defect': query_analysis.get('keywords', [])})
+                if search_result.get('success') and not search_result.get('results'):
+                    search_result = None
+            if search_result is None:
+                search_result = search_enhanced(question, k=k, model_path=model_path)
 
             if not search_result.get('success'):
                 logger.warning(f"Vector search failed: {search_result.get('error')}")
@@ -120,7 +123,10 @@ class RAGService:
             formatted_results = []
             for result in search_result.get('results', []):
                 item = result.get('item', {})
-                score = result.get('score', 0.0)
+                # 与图谱结果的固定基础分 0.8 比较，需要余弦相似度而不是混合检索的融合名次分
+                score = result.get('similarity')
+                if score is None:
+                    score = result.get('score', 0.0)
 
                 formatted_results.append({
                     'type': 'text_document',
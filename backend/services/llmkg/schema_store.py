@@ -1,7 +1,7 @@
 import json
 import os
 import csv
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional, Tuple
 
 SCHEMA_FILE = os.getenv(
     "KG_SCHEMA_FILE",
@@ -33,20 +33,37 @@ def _normalize_label(raw: str) -> str:
     return raw.strip()
 
 
+# (文件版本戳, schema)；版本戳为 (mtime_ns, size, inode)，任一进程重建 schema 后其他进程下次读取即失效
+_cache: Optional[Tuple[Tuple[int, int, int], Dict[str, Any]]] = None
+
+
 def load_schema() -> Dict[str, Any]:
-    if not os.path.exists(SCHEMA_FILE):
+    """Schema saved by generate_schema_from_import; parsed again only when the file changes."""
+    global _cache
+    try:
+        st = os.stat(SCHEMA_FILE)
+    except OSError:
         return {}
+    stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cache = _cache
+    if cache is not None and cache[0] == stamp:
+        return cache[1]
     try:
         with open(SCHEMA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            schema = json.load(f)
     except Exception:
         return {}
+    _cache = (stamp, schema)
+    return schema
 
 
 def save_schema(schema: Dict[str, Any]) -> None:
     os.makedirs(os.path.dirname(SCHEMA_FILE), exist_ok=True)
-    with open(SCHEMA_FILE, "w", encoding="utf-8") as f:
+    # 先写临时文件再替换，其他进程不会读到写了一半的 schema
+    tmp = f"{SCHEMA_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(schema, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, SCHEMA_FILE)
 
 
 def _parse_node_csv(path: str):
@@ -99,17 +116,24 @@ def _parse_rel_csv(path: str):
     return {rtype: sorted(list(props)) for rtype, props in rels.items()}
 
 
-def generate_schema_from_import(import_dir: str = None) -> Dict[str, Any]:
+def generate_schema_from_import(import_dir: str = None,
+                                progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """Collect labels / relationship types and their properties from the import CSVs and save them.
+
+    progress(done, total) is called after each CSV file.
+    """
     base = import_dir or DEFAULT_IMPORT_DIR
     if not os.path.isdir(base):
         raise FileNotFoundError(f"Import 目录不存在: {base}")
 
     labels = {}
     rels = {}
-    for fname in os.listdir(base):
+    files = [f for f in sorted(os.listdir(base))
+             if f.lower().endswith(".csv") and os.path.isfile(os.path.join(base, f))]
+    for done, fname in enumerate(files):
+        if progress is not None:
+            progress(done, len(files))
         path = os.path.join(base, fname)
-        if not os.path.isfile(path) or not fname.lower().endswith(".csv"):
-            continue
         try:
             if fname.startswith("node_"):
                 node_props = _parse_node_csv(path)
@@ -122,6 +146,8 @@ def generate_schema_from_import(import_dir: str = None) -> Dict[str, Any]:
         except Exception:
             # skip problematic files but continue
             continue
+    if progress is not None:
+        progress(len(files), len(files))
 
     schema = {
         "labels": [
@@ -0,0 +1,273 @@
+import os
+import json
+import logging
+import time
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 目录日志中的过期行超过有效条目数的该倍数时压缩
+COMPACT_FACTOR = float(os.getenv('KG_SESSION_CATALOG_COMPACT', '2'))
+SORT_KEYS = ('updatedAt', 'createdAt', 'title', 'messageCount')
+# 追加写入后等待该时长再 fsync，合并同一窗口内其他请求的刷盘（毫秒，0 表示立即刷盘）
+FSYNC_WINDOW_MS = float(os.getenv('KG_SESSION_FSYNC_MS', '2'))
+
+_catalogs: Dict[str, 'SessionCatalog'] = {}
+_catalogs_lock = threading.Lock()
+_syncs: Dict[str, 'GroupSync'] = {}
+_syncs_lock = threading.Lock()
+
+
+def count_lines(path: str) -> int:
+    """Number of lines of a JSONL file, counted on raw bytes without parsing JSON."""
+    count, last = 0, b'\n'
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                count += chunk.count(b'\n')
+                last = chunk[-1:]
+    except FileNotFoundError:
+        return 0
+    # 最后一行没有换行符
+    return count + (last != b'\n')
+
+
+class GroupSync:
+    """Group commit for one append-only file: concurrent appenders share one fsync.
+
+    A writer calls `wrote()` after its (flushed, not yet synced) write and
+    `wait(gen)` before acknowledging it. The first waiter sleeps
+    FSYNC_WINDOW_MS, then one fsync covers every write made so far; waiters
+    whose write is already covered return immediately.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._written = 0
+        self._synced = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def wrote(self) -> int:
+        with self._lock:
+            self._written += 1
+            return self._written
+
+    def wait(self, gen: int):
+        with self._sync_lock:
+            if self._synced >= gen:
+                return
+            if FSYNC_WINDOW_MS > 0:
+                time.sleep(FSYNC_WINDOW_MS / 1000)
+            with self._lock:
+                target = self._written
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = target
+
+
+def group_sync(path: str) -> GroupSync:
+    """Process-wide GroupSync for `path`."""
+    path = os.path.abspath(path)
+    with _syncs_lock:
+        sync = _syncs.get(path)
+        if sync is None:
+            sync = _syncs[path] = GroupSync(path)
+        return sync
+
+
+class SessionCatalog:
+    """Index of session metadata (id, title, timestamps, messageCount) in one append-only file.
+
+    Every create/save/rename appends the session's new entry as one line and
+    a delete appends a tombstone, so writes cost O(1) regardless of how many
+    sessions or messages exist. The latest entry per id is kept in memory;
+    the log is compacted once stale lines outnumber live entries by
+    COMPACT_FACTOR. Lines appended or compactions done by other processes are
+    picked up by checking the file's size and inode before each operation.
+
+    When the catalog file doesn't exist yet it is built once from the
+    `<id>.meta.json` files, counting message lines without parsing them.
+    """
+
+    def __init__(self, sessions_dir: str):
+        self.sessions_dir = sessions_dir
+        self.path = os.path.join(sessions_dir, 'catalog.jsonl')
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        self._signature = None
+        self._lock = threading.RLock()
+
+    # ---- loading ----
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size
+
+    def _apply(self, raw: bytes) -> bool:
+        try:
+            entry = json.loads(raw.decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            return False
+        if not isinstance(entry, dict) or not entry.get('id'):
+            return False
+        self._lines += 1
+        if entry.get('deleted'):
+            self._entries.pop(entry['id'], None)
+        else:
+            self._entries[entry['id']] = entry
+        return True
+
+    def _replay(self, start: int) -> int:
+        """Apply complete lines from byte `start`; returns the end of the last complete line."""
+        end = start
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                self._apply(raw)
+                end += len(raw)
+        return end
+
+    def _load(self):
+        """(Re)build the in-memory catalog (lock held)."""
+        self._entries, self._lines = {}, 0
+        if not os.path.exists(self.path):
+            self._rebuild_from_meta()
+            return
+        size = os.path.getsize(self.path)
+        end = self._replay(0)
+        if end < size:
+            logger.warning('会话目录尾部存在不完整的记录，已截断: %s', self.path)
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        self._signature = self._stat()
+
+    def _ensure_loaded(self):
+        current = self._stat()
+        if self._signature is None or current is None or current[0] != self._signature[0] \
+                or current[1] < self._signature[1]:
+            self._load()
+        elif current[1] > self._signature[1]:
+            # 其他进程追加的条目
+            end = self._replay(self._signature[1])
+            self._signature = (current[0], end)
+
+    def _rebuild_from_meta(self):
+        """Create the catalog from the per-session meta files (lock held)."""
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        for filename in os.listdir(self.sessions_dir):
+            if not filename.endswith('.meta.json'):
+                continue
+            session_id = filename[:-len('.meta.json')]
+            try:
+                with open(os.path.join(self.sessions_dir, filename), 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取会话元数据失败 {session_id}: {e}")
+                continue
+            info['id'] = session_id
+            info['messageCount'] = count_lines(os.path.join(self.sessions_dir, f'{session_id}.jsonl'))
+            self._entries[session_id] = info
+        self._write_all()
+        logger.info('会话目录已从元数据文件重建: %d 个会话', len(self._entries))
+
+    # ---- writes ----
+
+    def _write_all(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._lines = len(self._entries)
+        self._signature = self._stat()
+
+    def _append(self, entry: Dict[str, Any], sync: bool = True):
+        data = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        # 从上次读到的位置重放，同时带上其他进程并发追加的条目
+        inode, start = self._signature
+        self._signature = (inode, self._replay(start))
+        if self._lines > (COMPACT_FACTOR + 1) * max(len(self._entries), 1):
+            self._write_all()
+
+    def put(self, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Record the full metadata of a session."""
+        with self._lock:
+            self._ensure_loaded()
+            self._append(dict(info))
+            return dict(info)
+
+    def update(self, session_id: str, sync: bool = True, **fields) -> Optional[Dict[str, Any]]:
+        """Merge fields into an existing entry; None if the session isn't cataloged.
+
+        sync=False skips the fsync, for fields the caller can recompute after a crash.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            entry = dict(entry, **fields)
+            self._append(entry, sync)
+            return dict(entry)
+
+    def remove(self, session_id: str):
+        with self._lock:
+            self._ensure_loaded()
+            if session_id in self._entries:
+                self._append({'id': session_id, 'deleted': True})
+
+    # ---- reads ----
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(session_id)
+            return dict(entry) if entry is not None else None
+
+    def page(self, offset: int = 0, limit: Optional[int] = None, sort_by: str = 'updatedAt',
+             descending: bool = True) -> Dict[str, Any]:
+        """One page of entries sorted by `sort_by` (one of SORT_KEYS) plus the total count; items omit 'summary'."""
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f'sort_by must be one of {", ".join(SORT_KEYS)}')
+        default = 0 if sort_by == 'messageCount' else ''
+        with self._lock:
+            self._ensure_loaded()
+            entries = sorted(self._entries.values(), key=lambda e: (e.get(sort_by) or default, e['id']),
+                             reverse=descending)
+        offset = max(0, offset)
+        items = entries[offset:] if limit is None else entries[offset:offset + max(0, limit)]
+        # 滚动摘要只通过 get() 读取，列表中不返回
+        return {'total': len(entries), 'offset': offset, 'limit': limit,
+                'items': [{k: v for k, v in e.items() if k != 'summary'} for e in items]}
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._entries)
+
+
+def get_catalog(sessions_dir: str) -> SessionCatalog:
+    """Process-wide SessionCatalog for `sessions_dir`."""
+    sessions_dir = os.path.abspath(sessions_dir)
+    with _catalogs_lock:
+        catalog = _catalogs.get(sessions_dir)
+        if catalog is None:
+            catalog = _catalogs[sessions_dir] = SessionCatalog(sessions_dir)
+        return catalog
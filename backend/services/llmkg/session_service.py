@@ -1,31 +1,169 @@
 import os
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:
+    # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+try:
+    from . import storage
+    from .session_catalog import get_catalog, group_sync, count_lines
+    from .line_index import LineIndex
+except ImportError:
+    import storage
+    from session_catalog import get_catalog, group_sync, count_lines
+    from line_index import LineIndex
+
 logger = logging.getLogger(__name__)
 
 SESSIONS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'sessions')
 
+# 滚动总结：较早的轮次由后台任务压缩成一段总结，回答时只发送总结和最近几轮原始消息
+ROLLING_SUMMARY = os.getenv('KG_ROLLING_SUMMARY', '1').lower() in ('1', 'true', 'yes')
+# 始终以原始消息发送的最近轮数（一问一答为一轮）
+SUMMARY_RECENT_TURNS = int(os.getenv('KG_SUMMARY_RECENT_TURNS', '3'))
+# 未被总结的较早轮数达到该值时才更新总结，避免每条消息都调用一次LLM
+SUMMARY_EVERY_TURNS = int(os.getenv('KG_SUMMARY_EVERY_TURNS', '4'))
+
+_session_locks: Dict[str, threading.Lock] = {}
+_session_locks_guard = threading.Lock()
+
 
 def ensure_sessions_dir():
     """确保sessions目录存在"""
     os.makedirs(SESSIONS_DIR, exist_ok=True)
 
 
+def _catalog():
+    return get_catalog(SESSIONS_DIR)
+
+
+def _sql():
+    """KG_STORAGE=sqlite 时返回 SQLite 会话存储，否则返回 None（使用 JSONL 文件）"""
+    return storage.get_sessions() if storage.use_sqlite() else None
+
+
 def get_session_file_path(session_id: str) -> str:
     """获取会话文件路径"""
     return os.path.join(SESSIONS_DIR, f"{session_id}.jsonl")
 
 
+@contextmanager
+def _locked_session_file(session_id: str):
+    """以追加模式打开会话文件并加锁（进程内线程锁 + 跨进程 flock）"""
+    with _session_locks_guard:
+        lock = _session_locks.setdefault(session_id, threading.Lock())
+    with lock:
+        with open(get_session_file_path(session_id), 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield f
+
+
+def _repair_tail(session_file: str) -> int:
+    """截断崩溃留下的不完整尾行，返回文件大小"""
+    size = os.path.getsize(session_file)
+    if size == 0:
+        return 0
+    with open(session_file, 'rb') as f:
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+    if tail.endswith(b'\n'):
+        return size
+    cut = tail.rfind(b'\n')
+    if cut < 0 and size > len(tail):
+        # 尾行超过 64KB，从头扫描最后一个换行符
+        with open(session_file, 'rb') as f:
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+    else:
+        end = size - len(tail) + cut + 1
+    logger.warning(f"会话文件尾部存在不完整的消息，已截断: {session_file}")
+    os.truncate(session_file, end)
+    return end
+
+
+def _drop_invalid_lines(session_file: str) -> int:
+    """移除空行和无法解析的行（需持有会话锁），使行号与消息序号一致；返回文件大小
+
+    被移除的行保存到 <id>.jsonl.corrupt。只在追加时重新计数的路径上执行，正常写入不会产生这样的行。
+    """
+    kept, dropped = [], []
+    with open(session_file, 'rb') as f:
+        for raw in f:
+            try:
+                valid = isinstance(json.loads(raw.decode('utf-8')), dict)
+            except (ValueError, UnicodeDecodeError):
+                valid = False
+            (kept if valid else dropped).append(raw)
+    if not dropped:
+        return os.path.getsize(session_file)
+    garbage = [raw for raw in dropped if raw.strip()]
+    if garbage:
+        with open(session_file + '.corrupt', 'ab') as f:
+            f.write(b''.join(garbage))
+    logger.warning(f"会话文件中有 {len(dropped)} 行空行或损坏的消息，已移除: {session_file}")
+    data = b''.join(kept)
+    # 原地重写：其他进程正在等待的是同一文件上的 flock
+    with open(session_file, 'r+b') as f:
+        f.write(data)
+        f.truncate(len(data))
+        f.flush()
+        os.fsync(f.fileno())
+    LineIndex(session_file).rebuild()
+    return len(data)
+
+
+def _stored_count(session_id: str, session_file: str, info: Dict[str, Any]) -> int:
+    """已保存的消息数（需持有会话锁，只在追加路径上调用）；目录记录的文件大小与实际不符时（崩溃或旧数据）重新计数
+
+    重新计数前会截断不完整的尾行并移除无效行，保证序号与分页读取到的消息一一对应。
+    """
+    size = os.path.getsize(session_file)
+    if info.get('bytes') == size and 'messageCount' in info:
+        return info['messageCount']
+    _repair_tail(session_file)
+    size = _drop_invalid_lines(session_file)
+    count = count_lines(session_file)
+    info.update(messageCount=count, bytes=size)
+    _catalog().update(session_id, sync=False, messageCount=count, bytes=size)
+    return count
+
+
+def _auto_title(info: Dict[str, Any], messages: List[Dict[str, Any]]) -> bool:
+    """标题仍为默认值时用第一条用户消息生成标题，返回是否修改"""
+    if info.get('title') != '新对话' or not messages:
+        return False
+    first_user_msg = next((m for m in messages if m.get('role') == 'user'), None)
+    if not first_user_msg:
+        return False
+    content = first_user_msg.get('content', '')
+    info['title'] = content[:20] + ('...' if len(content) > 20 else '')
+    return True
+
+
+def _write_meta(session_id: str, info: Dict[str, Any]):
+    meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+
 def create_session(session_id: Optional[str] = None, title: Optional[str] = None) -> Dict[str, Any]:
     """创建新会话"""
-    ensure_sessions_dir()
-    
     if not session_id:
         session_id = f"session_{int(datetime.now().timestamp() * 1000)}"
+    sql = _sql()
+    if sql is not None:
+        return sql.create(session_id, title)
     
+    ensure_sessions_dir()
     session_file = get_session_file_path(session_id)
     
     # 如果文件已存在，返回现有会话信息
@@ -49,23 +187,18 @@ def create_session(session_id: Optional[str] = None, title: Optional[str] = None
     meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
     with open(meta_file, 'w', encoding='utf-8') as f:
         json.dump(session_info, f, ensure_ascii=False, indent=2)
+    _catalog().put(session_info)
     
     return session_info
 
 
 def get_session_info(session_id: str) -> Optional[Dict[str, Any]]:
-    """获取会话信息"""
-    meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
-    if not os.path.exists(meta_file):
-        return None
-    
+    """获取会话信息（来自会话目录，不读取消息文件）"""
     try:
-        with open(meta_file, 'r', encoding='utf-8') as f:
-            info = json.load(f)
-        # 更新消息数量
-        messages = load_session_messages(session_id)
-        info['messageCount'] = len(messages)
-        return info
+        sql = _sql()
+        if sql is not None:
+            return sql.info(session_id)
+        return _catalog().get(session_id)
     except Exception as e:
         logger.error(f"读取会话信息失败 {session_id}: {e}")
         return None
@@ -73,60 +206,118 @@ def get_session_info(session_id: str) -> Optional[Dict[str, Any]]:
 
 def load_session_messages(session_id: str) -> List[Dict[str, Any]]:
     """加载会话消息（JSONL格式）"""
+    sql = _sql()
+    if sql is not None:
+        return sql.messages(session_id)
     session_file = get_session_file_path(session_id)
     if not os.path.exists(session_file):
         return []
     
     messages = []
     try:
-        with open(session_file, 'r', encoding='utf-8') as f:
+        with open(session_file, 'rb') as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
                 try:
-                    msg = json.loads(line)
-                    messages.append(msg)
-                except json.JSONDecodeError as e:
+                    msg = json.loads(line.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError) as e:
                     logger.warning(f"解析消息失败 {session_id}: {e}")
                     continue
+                # 与追加时的修复（_drop_invalid_lines）保持一致，只有对象才算消息
+                if isinstance(msg, dict):
+                    messages.append(msg)
     except Exception as e:
         logger.error(f"读取会话消息失败 {session_id}: {e}")
     
     return messages
 
 
-def save_session_messages(session_id: str, messages: List[Dict[str, Any]]) -> bool:
-    """保存会话消息（JSONL格式）"""
-    ensure_sessions_dir()
+def load_session_page(session_id: str, limit: int, before: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """从末尾开始按游标分页读取会话消息
+    
+    通过稀疏行偏移索引定位，读取一页的开销与会话长度无关。只读：会话文件需要修复时
+    （崩溃留下的尾行、损坏的行）只跳过无效行，修复在下一次追加时持锁进行。
+    
+    Args:
+        session_id: 会话ID
+        limit: 每页消息数
+        before: 只返回序号小于该值的消息（None 表示最新一页），即上一页返回的 next_before
+    
+    Returns:
+        {'messages', 'start', 'end', 'total', 'next_before'}，消息序号区间为 [start, end)，
+        没有更早的消息时 next_before 为 None；会话不存在时返回 None
+    """
+    sql = _sql()
+    if sql is not None:
+        return sql.message_page(session_id, limit, before)
+    info = _catalog().get(session_id)
+    if info is None:
+        return None
     session_file = get_session_file_path(session_id)
+    size = os.path.getsize(session_file) if os.path.exists(session_file) else 0
+    scanned = None
+    if info.get('bytes') == size and 'messageCount' in info:
+        total = info['messageCount']
+    else:
+        # 目录记录与文件不符（崩溃、其他进程正在写入或有损坏的行）：只读扫描有效消息，修复留给下一次追加
+        scanned = load_session_messages(session_id)
+        total = len(scanned)
+    end = total if before is None else max(0, min(before, total))
+    start = max(0, end - max(1, limit))
+    
+    if scanned is not None:
+        messages = scanned[start:end]
+    else:
+        messages = []
+        for raw in LineIndex(session_file).read_lines(start, end, total) if total else []:
+            try:
+                messages.append(json.loads(raw.decode('utf-8')))
+            except (ValueError, UnicodeDecodeError) as e:
+                logger.warning(f"解析消息失败 {session_id}: {e}")
+    return {'messages': messages, 'start': start, 'end': end, 'total': total,
+            'next_before': start if start > 0 else None}
+
+
+def save_session_messages(session_id: str, messages: List[Dict[str, Any]]) -> bool:
+    """保存会话消息（JSONL格式，整体重写）
     
+    只用于编辑已有消息；新增消息请使用 append_session_messages。
+    """
     try:
-        with open(session_file, 'w', encoding='utf-8') as f:
-            for msg in messages:
-                json_line = json.dumps(msg, ensure_ascii=False)
-                f.write(json_line + '\n')
-        
-        # 更新会话元数据
-        meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
-        if os.path.exists(meta_file):
-            with open(meta_file, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-        else:
-            info = {'id': session_id, 'title': '新对话'}
-        
-        info['updatedAt'] = datetime.now().isoformat()
-        info['messageCount'] = len(messages)
-        
-        # 如果第一条消息是用户消息，自动生成标题
-        if info.get('title') == '新对话' and messages:
-            first_user_msg = next((m for m in messages if m.get('role') == 'user'), None)
-            if first_user_msg:
-                content = first_user_msg.get('content', '')
-                info['title'] = content[:20] + ('...' if len(content) > 20 else '')
-        
-        with open(meta_file, 'w', encoding='utf-8') as f:
-            json.dump(info, f, ensure_ascii=False, indent=2)
+        sql = _sql()
+        if sql is not None:
+            sql.save_messages(session_id, messages, auto_title=_auto_title)
+            return True
+        ensure_sessions_dir()
+        data = ''.join(json.dumps(msg, ensure_ascii=False) + '\n' for msg in messages).encode('utf-8')
+        with _locked_session_file(session_id) as f:
+            f.truncate(0)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            LineIndex(get_session_file_path(session_id)).rebuild()
+            
+            # 更新会话元数据
+            meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
+            if os.path.exists(meta_file):
+                with open(meta_file, 'r', encoding='utf-8') as mf:
+                    info = json.load(mf)
+            else:
+                info = {'id': session_id, 'title': '新对话'}
+            
+            info['updatedAt'] = datetime.now().isoformat()
+            info['messageCount'] = len(messages)
+            info['bytes'] = len(data)
+            # 消息被整体改写，之前的总结可能已不成立
+            info.pop('summary', None)
+
+            # 如果第一条消息是用户消息，自动生成标题
+            _auto_title(info, messages)
+            
+            _write_meta(session_id, info)
+            _catalog().put(info)
         
         return True
     except Exception as e:
@@ -134,8 +325,79 @@ def save_session_messages(session_id: str, messages: List[Dict[str, Any]]) -> bo
         return False
 
 
+def append_session_messages(session_id: str, messages: List[Dict[str, Any]],
+                            expected_seq: Optional[int] = None) -> Dict[str, Any]:
+    """追加新消息，只写入新增的行
+    
+    同一会话的追加串行执行；写入后通过组提交 fsync，并发请求共享一次刷盘，返回时数据已落盘。
+    
+    Args:
+        session_id: 会话ID
+        messages: 新增的消息
+        expected_seq: 客户端认为服务端已保存的消息数；不一致时拒绝写入（None 表示不检查）
+    
+    Returns:
+        {'success': True, 'seq': 追加后的消息数}；
+        冲突时 {'success': False, 'conflict': True, 'seq': 当前消息数, 'error': ...}；
+        会话不存在时 {'success': False, 'not_found': True, 'error': ...}
+    """
+    session_file = get_session_file_path(session_id)
+    
+    try:
+        sql = _sql()
+        if sql is not None:
+            result = sql.append_messages(session_id, messages, expected_seq, auto_title=_auto_title)
+            if result.get('success') and messages:
+                schedule_summary(session_id)
+            return result
+        ensure_sessions_dir()
+        info = _catalog().get(session_id)
+        if info is None:
+            return {'success': False, 'not_found': True, 'error': '会话不存在'}
+        
+        with _locked_session_file(session_id) as f:
+            # 加锁后重新读取，其他进程可能刚刚追加过
+            info = _catalog().get(session_id) or info
+            seq = _stored_count(session_id, session_file, info)
+            if expected_seq is not None and expected_seq != seq:
+                return {'success': False, 'conflict': True, 'seq': seq,
+                        'error': f'消息序号冲突：期望 {expected_seq}，实际 {seq}'}
+            if not messages:
+                return {'success': True, 'seq': seq}
+            
+            data = ''.join(json.dumps(msg, ensure_ascii=False) + '\n' for msg in messages).encode('utf-8')
+            base = os.path.getsize(session_file)
+            f.write(data)
+            f.flush()
+            gen = group_sync(session_file).wrote()
+            LineIndex(session_file).extend(seq, base, data)
+            
+            fields = {'updatedAt': datetime.now().isoformat(), 'messageCount': seq + len(messages),
+                      'bytes': os.path.getsize(session_file)}
+            if _auto_title(info, messages):
+                fields['title'] = info['title']
+                _write_meta(session_id, dict(info, **fields))
+            # 目录中的计数可由文件大小校验并重新计算，不单独 fsync
+            _catalog().update(session_id, sync=False, **fields)
+        
+        group_sync(session_file).wait(gen)
+        schedule_summary(session_id)
+        return {'success': True, 'seq': seq + len(messages)}
+    except Exception as e:
+        logger.error(f"追加会话消息失败 {session_id}: {e}")
+        return {'success': False, 'error': str(e)}
+
+
 def update_session_title(session_id: str, title: str) -> bool:
     """更新会话标题"""
+    sql = _sql()
+    if sql is not None:
+        try:
+            return sql.update(session_id, title=title, updatedAt=datetime.now().isoformat())
+        except Exception as e:
+            logger.error(f"更新会话标题失败 {session_id}: {e}")
+            return False
+    
     meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
     if not os.path.exists(meta_file):
         return False
@@ -147,6 +409,7 @@ def update_session_title(session_id: str, title: str) -> bool:
         info['updatedAt'] = datetime.now().isoformat()
         with open(meta_file, 'w', encoding='utf-8') as f:
             json.dump(info, f, ensure_ascii=False, indent=2)
+        _catalog().update(session_id, title=info['title'], updatedAt=info['updatedAt'])
         return True
     except Exception as e:
         logger.error(f"更新会话标题失败 {session_id}: {e}")
@@ -159,33 +422,150 @@ def delete_session(session_id: str) -> bool:
     meta_file = os.path.join(SESSIONS_DIR, f"{session_id}.meta.json")
     
     try:
+        sql = _sql()
+        if sql is not None:
+            sql.delete(session_id)
+            return True
         if os.path.exists(session_file):
             os.remove(session_file)
         if os.path.exists(meta_file):
             os.remove(meta_file)
+        LineIndex(session_file).remove()
+        _catalog().remove(session_id)
         return True
     except Exception as e:
         logger.error(f"删除会话失败 {session_id}: {e}")
         return False
 
 
+def list_sessions_page(offset: int = 0, limit: Optional[int] = None, sort_by: str = 'updatedAt',
+                       descending: bool = True) -> Dict[str, Any]:
+    """分页列出会话（只读会话目录）
+    
+    Returns:
+        {'total', 'offset', 'limit', 'items'}，items 不含滚动摘要；sort_by 不合法时抛出 ValueError
+    """
+    sql = _sql()
+    if sql is not None:
+        return sql.page(offset, limit, sort_by, descending)
+    return _catalog().page(offset, limit, sort_by, descending)
+
+
 def list_sessions() -> List[Dict[str, Any]]:
     """列出所有会话"""
-    ensure_sessions_dir()
-    sessions = []
-    
     try:
-        for filename in os.listdir(SESSIONS_DIR):
-            if filename.endswith('.meta.json'):
-                session_id = filename[:-10]  # 移除 .meta.json
-                info = get_session_info(session_id)
-                if info:
-                    sessions.append(info)
-        
         # 按更新时间倒序排序
-        sessions.sort(key=lambda x: x.get('updatedAt', ''), reverse=True)
-        return sessions
+        return list_sessions_page()['items']
     except Exception as e:
         logger.error(f"列出会话失败: {e}")
         return []
 
+
+def _summary_upto(info: Optional[Dict[str, Any]]) -> int:
+    return ((info or {}).get('summary') or {}).get('upto', 0)
+
+
+def _store_summary(session_id: str, summary: Dict[str, Any], expected_upto: int) -> bool:
+    """写入滚动总结；期间会话被重写或总结已被更新（upto 变化）时放弃"""
+    sql = _sql()
+    if sql is not None:
+        info = sql.info(session_id)
+        if info is None or _summary_upto(info) != expected_upto or info.get('messageCount', 0) < summary['upto']:
+            return False
+        return sql.update(session_id, summary=summary)
+    with _locked_session_file(session_id):
+        info = _catalog().get(session_id)
+        if info is None or _summary_upto(info) != expected_upto or info.get('messageCount', 0) < summary['upto']:
+            return False
+        info = _catalog().update(session_id, summary=summary)
+        # 元数据文件也保存一份，会话目录重建后总结不丢失
+        _write_meta(session_id, info)
+    return True
+
+
+def _summary_job(ctx, session_id: str):
+    """后台任务：把 [upto, 最近 SUMMARY_RECENT_TURNS 轮之前) 的消息合并进会话总结"""
+    try:
+        from .memory_service import summarize_messages
+    except ImportError:
+        from memory_service import summarize_messages
+    info = get_session_info(session_id)
+    if info is None:
+        return {'skipped': '会话不存在'}
+    previous = info.get('summary') or {}
+    upto = previous.get('upto', 0)
+    target = info.get('messageCount', 0) - 2 * SUMMARY_RECENT_TURNS
+    if target <= upto:
+        return {'skipped': '没有需要总结的消息', 'upto': upto}
+    page = load_session_page(session_id, target - upto, before=target)
+    messages = [m for m in (page or {}).get('messages', []) if m.get('role') in ('user', 'assistant')]
+    ctx.check()
+    result = summarize_messages(messages, previous_summary=previous.get('text'))
+    if not result.get('success'):
+        raise RuntimeError(result.get('error', '总结失败'))
+    summary = {'text': result['summary'], 'upto': target, 'updatedAt': datetime.now().isoformat()}
+    if not _store_summary(session_id, summary, upto):
+        return {'skipped': '会话已被修改', 'upto': upto}
+    return {'upto': target}
+
+
+def schedule_summary(session_id: str) -> Optional[str]:
+    """未被总结的较早消息达到 SUMMARY_EVERY_TURNS 轮时，在 llm 队列提交后台总结任务
+    
+    同一会话同时只有一个总结任务；任务在进行中时新的追加不会重复提交。
+    
+    Returns:
+        提交（或已在进行）的任务ID；无需总结或提交失败时返回 None
+    """
+    if not ROLLING_SUMMARY:
+        return None
+    try:
+        info = get_session_info(session_id)
+        if info is None:
+            return None
+        target = info.get('messageCount', 0) - 2 * SUMMARY_RECENT_TURNS
+        if target - _summary_upto(info) < 2 * max(1, SUMMARY_EVERY_TURNS):
+            return None
+        try:
+            from .job_runner import submit_job
+        except ImportError:
+            from job_runner import submit_job
+        submitted = submit_job('session_summary', _summary_job, {'session_id': session_id},
+                               key=f'session_summary:{session_id}', queue='llm')
+        return submitted['job']['id']
+    except Exception as e:
+        logger.error(f"提交会话总结任务失败 {session_id}: {e}")
+        return None
+
+
+def answer_context(session_id: Optional[str], messages: List[Dict[str, Any]],
+                   messages_start: int = 0) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """回答时使用的对话上下文：会话的滚动总结 + 总结之后的原始消息
+    
+    客户端分页加载时只发送已加载的消息；总结未覆盖的更早消息（未开启滚动总结、
+    总结尚未生成或落后于客户端窗口时）从会话存储中补齐，不会丢失上下文。
+    
+    Args:
+        session_id: 会话ID（为空时不使用总结，也不补齐）
+        messages: 客户端发送的历史消息
+        messages_start: messages[0] 在会话中的序号（客户端分页加载时不为 0）
+    
+    Returns:
+        (summary_text 或 None, 需要原样发送的消息)
+    """
+    summary = None
+    if ROLLING_SUMMARY and session_id:
+        summary = (get_session_info(session_id) or {}).get('summary')
+        if not summary or not summary.get('text'):
+            summary = None
+    covered = summary.get('upto', 0) if summary else 0
+    start = max(0, messages_start)
+    if session_id and covered < start:
+        page = load_session_page(session_id, start - covered, before=start)
+        # 客户端窗口与存储不一致（如会话已被编辑）时不补齐
+        if page is not None and page['end'] == start:
+            messages = page['messages'] + list(messages)
+            start = page['start']
+    if summary is None:
+        return None, messages
+    return summary['text'], messages[max(0, covered - start):]
@@ -0,0 +1,246 @@
+import os
+import sys
+import zlib
+import atexit
+import socket
+import logging
+import threading
+import subprocess
+from concurrent.futures import Future, wait
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 分片数量，0 表示不分片（索引在 Flask 进程内）
+SHARD_COUNT = int(os.getenv('VEC_SHARDS', '0'))
+SHARD_DIR = os.getenv('VEC_SHARD_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'vector_database', 'shards'))
+# 单次分片请求的超时（秒）；构建不受限制
+SHARD_TIMEOUT = float(os.getenv('VEC_SHARD_TIMEOUT', '30'))
+
+_BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+_pool: Optional['ShardPool'] = None
+_pool_lock = threading.Lock()
+
+
+def spawn_worker(module: str, args: List[str], env: Optional[Dict[str, str]] = None):
+    """Start `python -m <module> ... --fd N` with one end of a socketpair; returns (Popen, Connection).
+
+    Workers are fresh interpreters rather than multiprocessing children, so the
+    Flask app module is never re-imported and no threads are forked.
+    """
+    parent, child = socket.socketpair()
+    # 工作进程只做向量计算，导入包时不连接 Neo4j
+    full_env = dict(os.environ, KG_SKIP_CONNECT='1', PYTHONPATH=os.pathsep.join(
+        p for p in (_BACKEND_DIR, os.environ.get('PYTHONPATH')) if p), **(env or {}))
+    proc = subprocess.Popen([sys.executable, '-m', module] + list(args) + ['--fd', str(child.fileno())],
+                            cwd=_BACKEND_DIR, env=full_env, pass_fds=(child.fileno(),))
+    child.close()
+    return proc, Connection(parent.detach())
+
+
+def shard_of(doc_id: Any, count: int) -> int:
+    """Stable shard number of a document id."""
+    return zlib.crc32(str(doc_id).encode('utf-8')) % count
+
+
+def shard_paths(shard: int, base_dir: Optional[str] = None):
+    """(index path, metadata store path) of one shard."""
+    d = os.path.join(base_dir or SHARD_DIR, str(shard))
+    return os.path.join(d, 'index.faiss'), os.path.join(d, 'metadata')
+
+
+class ShardClient:
+    """One shard worker process and the request/response channel to it.
+
+    Requests carry an id so several can be in flight; a reader thread
+    resolves the matching futures. A dead worker is restarted on the next
+    request.
+    """
+
+    def __init__(self, shard: int, base_dir: Optional[str] = None):
+        self.shard = shard
+        self.base_dir = base_dir or SHARD_DIR
+        self._proc: Optional[subprocess.Popen] = None
+        self._conn: Optional[Connection] = None
+        self._pending: Dict[int, Future] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._proc, self._conn = spawn_worker('services.llmkg.shard_worker',
+                                              ['--shard', str(self.shard), '--base-dir', self.base_dir],
+                                              env={'VEC_SHARDS': '0'})
+        threading.Thread(target=self._read_loop, args=(self._conn,), name=f'shard-{self.shard}-reader', daemon=True).start()
+        logger.info('分片 %d 工作进程已启动: pid %d', self.shard, self._proc.pid)
+
+    def _read_loop(self, conn: Connection):
+        while True:
+            try:
+                req_id, ok, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                fut = self._pending.pop(req_id, None)
+            if fut is None:
+                continue
+            if ok:
+                fut.set_result(payload)
+            else:
+                # 参数错误（如过滤条件）保持 ValueError，便于调用方区分
+                kind, message = payload
+                error = ValueError if kind == 'ValueError' else RuntimeError
+                fut.set_exception(error(f'shard {self.shard}: {message}'))
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._conn is conn:
+                self._conn = None
+        for fut in pending.values():
+            fut.set_exception(RuntimeError(f'shard {self.shard} worker exited'))
+
+    def request(self, cmd: str, **kwargs) -> Future:
+        with self._lock:
+            if self._conn is None or self._proc is None or self._proc.poll() is not None:
+                self._start()
+            self._next_id += 1
+            req_id = self._next_id
+            fut: Future = Future()
+            self._pending[req_id] = fut
+            try:
+                self._conn.send((req_id, cmd, kwargs))
+            except OSError as e:
+                self._pending.pop(req_id, None)
+                fut.set_exception(RuntimeError(f'shard {self.shard}: {e}'))
+        return fut
+
+    def close(self):
+        with self._lock:
+            conn, proc = self._conn, self._proc
+            self._conn = self._proc = None
+        if conn is not None:
+            try:
+                conn.send((0, 'stop', {}))
+            except OSError:
+                pass
+            conn.close()
+        if proc is not None:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+class ShardPool:
+    """Scatter-gather over `count` shard worker processes, documents routed by id hash.
+
+    Each shard is an ordinary vector_store snapshot under `<base_dir>/<n>/`
+    served by its own process, so shards load, hot-reload and rebuild
+    independently. Queries are encoded once here and the vectors fanned out;
+    workers only load the embedding model when they build or upsert.
+    """
+
+    def __init__(self, count: Optional[int] = None, base_dir: Optional[str] = None):
+        count = SHARD_COUNT if count is None else count
+        if count <= 0:
+            raise ValueError('shard count must be positive')
+        self.count = count
+        self.base_dir = base_dir or SHARD_DIR
+        self.clients = [ShardClient(i, base_dir) for i in range(count)]
+
+    def _gather(self, futures: List[Future], timeout: Optional[float] = SHARD_TIMEOUT) -> List[Any]:
+        done, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            raise TimeoutError(f'{len(not_done)} shard(s) did not answer within {timeout}s')
+        return [f.result() for f in futures]
+
+    def _scatter(self, cmd: str, timeout: Optional[float] = SHARD_TIMEOUT, **kwargs) -> List[Any]:
+        return self._gather([c.request(cmd, **kwargs) for c in self.clients], timeout)
+
+    def _partition(self, items: List[Any], key: Callable[[Any], Any]) -> List[List[Any]]:
+        parts: List[List[Any]] = [[] for _ in range(self.count)]
+        for item in items:
+            parts[shard_of(key(item), self.count)].append(item)
+        return parts
+
+    @staticmethod
+    def _merge(per_shard: List[List[Dict[str, Any]]], k: int) -> List[Dict[str, Any]]:
+        merged = [r for results in per_shard for r in results]
+        merged.sort(key=lambda r: r['score'], reverse=True)
+        return merged[:k]
+
+    # ---- queries ----
+
+    def search_many(self, q_arr: np.ndarray, k: int, **kwargs) -> List[List[Dict[str, Any]]]:
+        """Per-query top-k merged by score across shards (kwargs as vector_store._search_vectors)."""
+        per_shard = self._scatter('search', q_arr=np.ascontiguousarray(q_arr, dtype='float32'), k=k, **kwargs)
+        return [self._merge([shard[qi] for shard in per_shard], k) for qi in range(len(q_arr))]
+
+    def lexical_search(self, query: str, n: int, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        # BM25 的 idf 按分片各自统计，合并时直接比较分数
+        return self._merge(self._scatter('lexical', query=query, n=n, filters=filters), n)
+
+    # ---- writes ----
+
+    def build(self, texts: List[Dict[str, Any]], model_path: str, progress: Optional[Callable[[int, int], None]] = None,
+              **kwargs) -> List[Dict[str, Any]]:
+        """Rebuild every shard from `texts` in parallel; progress counts documents of finished shards."""
+        parts = self._partition(texts, lambda d: d.get('id'))
+        futures = [c.request('build', texts=part, model_path=model_path, **kwargs) for c, part in zip(self.clients, parts)]
+        if progress is not None:
+            done = 0
+            for fut, part in zip(futures, parts):
+                fut.result()
+                done += len(part)
+                progress(done, len(texts))
+        return self._gather(futures, timeout=None)
+
+    def rebuild_shard(self, shard: int, texts: List[Dict[str, Any]], model_path: str, **kwargs) -> Dict[str, Any]:
+        """Rebuild one shard from the documents of `texts` that belong to it; the others keep serving."""
+        part = [d for d in texts if shard_of(d.get('id'), self.count) == shard]
+        return self.clients[shard].request('build', texts=part, model_path=model_path, **kwargs).result()
+
+    def upsert(self, docs: List[Dict[str, Any]], model_path: Optional[str], batch_size: int = 64) -> Dict[str, Any]:
+        parts = self._partition([d for d in docs if isinstance(d, dict)], lambda d: d.get('id'))
+        futures = [c.request('upsert', docs=part, model_path=model_path, batch_size=batch_size)
+                   for c, part in zip(self.clients, parts) if part]
+        return self._sum_counts(self._gather(futures, timeout=None), skipped=len(docs) - sum(len(p) for p in parts))
+
+    def delete(self, doc_ids: List[Any]) -> Dict[str, Any]:
+        parts = self._partition(list(doc_ids), lambda doc_id: doc_id)
+        futures = [c.request('delete', doc_ids=part) for c, part in zip(self.clients, parts) if part]
+        return self._sum_counts(self._gather(futures, timeout=None))
+
+    @staticmethod
+    def _sum_counts(results: List[Dict[str, Any]], **extra: int) -> Dict[str, Any]:
+        errors = [r.get('error') for r in results if not r.get('success')]
+        if errors:
+            return {'success': False, 'error': '; '.join(str(e) for e in errors)}
+        out: Dict[str, Any] = {'success': True}
+        for r in results:
+            for key, value in r.items():
+                if key != 'success' and isinstance(value, int):
+                    out[key] = out.get(key, 0) + value
+        for key, value in extra.items():
+            out[key] = out.get(key, 0) + value
+        return out
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return self._scatter('stats')
+
+    def close(self):
+        for c in self.clients:
+            c.close()
+
+
+def get_pool() -> ShardPool:
+    """Process-wide pool of SHARD_COUNT workers, started on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ShardPool(SHARD_COUNT, SHARD_DIR)
+                atexit.register(_pool.close)
+    return _pool
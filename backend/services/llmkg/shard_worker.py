@@ -0,0 +1,97 @@
+import os
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Any, Dict
+
+from . import shard_pool
+from . import vector_store as vs
+
+logger = logging.getLogger(__name__)
+
+# 每个分片进程内并发处理的请求数；重建期间检索仍可使用旧快照
+WORKER_THREADS = int(os.getenv('VEC_SHARD_WORKER_THREADS', '4'))
+
+
+class ShardServer:
+    """Serves one shard's vector_store snapshot to the coordinating process."""
+
+    def __init__(self, shard: int, base_dir: str):
+        self.shard = shard
+        self.index_path, self.meta_path = shard_pool.shard_paths(shard, base_dir)
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        self._load_lock = threading.Lock()
+
+    def _loaded(self) -> bool:
+        if vs._index is not None:
+            return True
+        with self._load_lock:
+            return vs._index is not None or vs.load_index(self.index_path, self.meta_path)
+
+    def handle(self, cmd: str, kw: Dict[str, Any]) -> Any:
+        if cmd == 'search':
+            if not self._loaded():
+                return [[] for _ in range(len(kw['q_arr']))]
+            return vs._search_vectors(kw.pop('q_arr'), kw.pop('k'), **kw)
+        if cmd == 'lexical':
+            if not self._loaded():
+                return []
+            return vs._lexical_search(kw['query'], kw['n'], kw.get('filters'))
+        if cmd == 'build':
+            texts = kw.pop('texts')
+            if not texts:
+                return {'success': True, 'count': 0}
+            vs.build_index_from_texts(texts, index_path=self.index_path, meta_path=self.meta_path, **kw)
+            return dict(vs.index_info(), success=True, count=len(texts))
+        if cmd == 'upsert':
+            return vs.upsert_documents(kw['docs'], model_path=kw.get('model_path'), index_path=self.index_path,
+                                       meta_path=self.meta_path, batch_size=kw.get('batch_size', 64))
+        if cmd == 'delete':
+            return vs.delete_documents(kw['doc_ids'], index_path=self.index_path, meta_path=self.meta_path)
+        if cmd == 'stats':
+            self._loaded()
+            return dict(vs.index_info(), shard=self.shard, pid=os.getpid())
+        raise ValueError(f'unknown command: {cmd}')
+
+    def serve(self, conn: Connection):
+        send_lock = threading.Lock()
+
+        def run(req_id, cmd, kw):
+            try:
+                reply = (req_id, True, self.handle(cmd, kw))
+            except Exception as e:
+                if not isinstance(e, ValueError):
+                    logger.exception('分片 %d 处理 %s 失败', self.shard, cmd)
+                reply = (req_id, False, (type(e).__name__, str(e)))
+            with send_lock:
+                conn.send(reply)
+
+        # 其他进程重建或写入该分片时热加载
+        vs.start_index_watcher()
+        with ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix=f'shard-{self.shard}') as pool:
+            while True:
+                try:
+                    req_id, cmd, kw = conn.recv()
+                except (EOFError, OSError):
+                    break
+                if cmd == 'stop':
+                    break
+                pool.submit(run, req_id, cmd, kw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve one vector index shard over an inherited socket')
+    parser.add_argument('--shard', type=int, required=True)
+    parser.add_argument('--base-dir', default=shard_pool.SHARD_DIR)
+    parser.add_argument('--fd', type=int, required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=f'[shard {args.shard}] %(levelname)s %(name)s: %(message)s')
+    # 分片进程内部不再分片
+    shard_pool.SHARD_COUNT = 0
+    ShardServer(args.shard, args.base_dir).serve(Connection(args.fd))
+
+
+if __name__ == '__main__':
+    main()
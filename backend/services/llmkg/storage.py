@@ -0,0 +1,496 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+# 存储后端：file（JSON/JSONL 文件，默认）或 sqlite（多进程共享的嵌入式数据库）
+BACKEND = os.getenv('KG_STORAGE', 'file').lower()
+SQLITE_PATH = os.getenv('KG_SQLITE_PATH', os.path.join(_DATA_DIR, 'kg.sqlite3'))
+# WAL 下 NORMAL 在断电时可能丢失最后几次提交但不会损坏；需要每次提交都落盘时设为 FULL
+SQLITE_SYNC = os.getenv('KG_SQLITE_SYNC', 'NORMAL').upper()
+# 等待其他进程释放写锁的时间（秒）
+SQLITE_BUSY_TIMEOUT = float(os.getenv('KG_SQLITE_BUSY_TIMEOUT', '30'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS text_docs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memories (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    body TEXT NOT NULL,
+    messages TEXT,
+    source_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS memories_source_hash ON memories (source_hash);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS session_messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+'''
+
+_dbs: Dict[str, 'SQLiteDB'] = {}
+_dbs_lock = threading.Lock()
+
+
+def use_sqlite() -> bool:
+    return BACKEND == 'sqlite'
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class SQLiteDB:
+    """One SQLite database file in WAL mode, shared by threads and processes.
+
+    Each thread (and each forked process) gets its own connection, created on
+    first use; statements are cached per connection by the sqlite3 module, so
+    the fixed SQL strings used here are prepared once per thread. Writes go
+    through `transaction()`, which takes the write lock up front
+    (BEGIN IMMEDIATE) so read-check-write sequences can't interleave across
+    processes; readers never block on WAL.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def conn(self) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # gunicorn 等 fork 后的子进程不能复用父进程的连接
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={SQLITE_SYNC}')
+            local.conn, local.pid = conn, os.getpid()
+            self._ensure_schema(conn)
+        return local.conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.executescript(SCHEMA)
+                self._schema_ready = True
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction holding the database write lock; commits on success, rolls back on error."""
+        conn = self.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def snapshot(self):
+        """Read transaction: every statement inside sees the same committed state."""
+        conn = self.conn()
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def query(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        return self.conn().execute(sql, tuple(params)).fetchall()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        return self.read_meta(self.conn(), key)
+
+    @staticmethod
+    def read_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def set_meta(conn: sqlite3.Connection, key: str, value: str):
+        conn.execute('INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                     (key, value))
+
+
+class SQLiteTextDB:
+    """TextDB (see text_db.TextDB) backed by the `text_docs` table; ids are allocated inside the write transaction."""
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    @staticmethod
+    def _next_free(conn: sqlite3.Connection, used: set) -> str:
+        next_id = int(SQLiteDB.read_meta(conn, 'text_next_id') or 1)
+        while str(next_id) in used or conn.execute('SELECT 1 FROM text_docs WHERE id = ?', (str(next_id),)).fetchone():
+            next_id += 1
+        SQLiteDB.set_meta(conn, 'text_next_id', str(next_id + 1))
+        return str(next_id)
+
+    def allocate_id(self) -> str:
+        with self.db.transaction() as conn:
+            return self._next_free(conn, set())
+
+    def append_many(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert documents in one transaction; missing or already used ids are replaced by allocated ones."""
+        with self.db.transaction() as conn:
+            batch = set()
+            rows = []
+            for doc in docs:
+                doc_id = str(doc.get('id') or '')
+                if not doc_id or doc_id in batch or conn.execute('SELECT 1 FROM text_docs WHERE id = ?', (doc_id,)).fetchone():
+                    doc_id = self._next_free(conn, batch)
+                doc['id'] = doc_id
+                batch.add(doc_id)
+                rows.append((doc_id, _dumps(doc)))
+            conn.executemany('INSERT INTO text_docs (id, body) VALUES (?, ?)', rows)
+        return docs
+
+    def append(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return self.append_many([doc])[0]
+
+    def compact(self) -> Dict[str, int]:
+        # 表中每个 id 只有一行，无需压缩
+        count = len(self)
+        return {'before': count, 'after': count}
+
+    def documents(self) -> List[Dict[str, Any]]:
+        """All documents in insertion order."""
+        return [json.loads(body) for (body,) in self.db.query('SELECT body FROM text_docs ORDER BY seq')]
+
+    def __contains__(self, doc_id: Any) -> bool:
+        return bool(self.db.query('SELECT 1 FROM text_docs WHERE id = ?', (str(doc_id),)))
+
+    def __len__(self) -> int:
+        return self.db.query('SELECT COUNT(*) FROM text_docs')[0][0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {'documents': len(self), 'next_id': int(self.db.get_meta('text_next_id') or 1), 'backend': 'sqlite'}
+
+
+class SQLiteMemoryStore:
+    """MemoryStore (see memory_store.MemoryStore) backed by the `memories` table.
+
+    The lean record and its source_messages are separate columns, so lookups
+    and listings without messages never decode the conversations.
+    """
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    @staticmethod
+    def _row(record: Dict[str, Any]) -> tuple:
+        lean = {k: v for k, v in record.items() if k != 'source_messages'}
+        messages = record.get('source_messages') or []
+        return str(record['id']), _dumps(lean), _dumps(messages) if messages else None, record.get('source_hash')
+
+    def append(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        with self.db.transaction() as conn:
+            conn.execute('INSERT INTO memories (id, body, messages, source_hash) VALUES (?, ?, ?, ?) '
+                         'ON CONFLICT (id) DO UPDATE SET body = excluded.body, messages = excluded.messages, '
+                         'source_hash = excluded.source_hash', self._row(record))
+        return record
+
+    @staticmethod
+    def _public(body: str, messages: Optional[str], with_messages: bool) -> Dict[str, Any]:
+        out = json.loads(body)
+        if with_messages:
+            out['source_messages'] = json.loads(messages) if messages else []
+        return out
+
+    def get(self, memory_id: str, with_messages: bool = True) -> Optional[Dict[str, Any]]:
+        column = 'messages' if with_messages else 'NULL'
+        rows = self.db.query(f'SELECT body, {column} FROM memories WHERE id = ?', (str(memory_id),))
+        return self._public(rows[0][0], rows[0][1], with_messages) if rows else None
+
+    def list(self, offset: int = 0, limit: int = 20, newest_first: bool = True,
+             with_messages: bool = False) -> Dict[str, Any]:
+        column = 'messages' if with_messages else 'NULL'
+        order = 'DESC' if newest_first else 'ASC'
+        with self.db.snapshot() as conn:
+            total = conn.execute('SELECT COUNT(*) FROM memories').fetchone()[0]
+            rows = conn.execute(f'SELECT body, {column} FROM memories ORDER BY seq {order} LIMIT ? OFFSET ?',
+                                (max(0, limit), max(0, offset))).fetchall()
+        return {'total': total, 'offset': offset, 'limit': limit,
+                'items': [self._public(body, messages, with_messages) for body, messages in rows]}
+
+    def __len__(self) -> int:
+        return self.db.query('SELECT COUNT(*) FROM memories')[0][0]
+
+
+class SQLiteSessions:
+    """Session metadata and messages in the `sessions` / `session_messages` tables.
+
+    Mirrors the session_service functions. A session's info is kept as JSON
+    with the sortable fields mirrored into columns; messages are one row per
+    sequence number, so appends, tail pages and the expected-sequence check
+    are single indexed statements inside one transaction.
+    """
+
+    SORT_COLUMNS = {'updatedAt': 'updated_at', 'createdAt': 'created_at', 'title': 'title',
+                    'messageCount': 'message_count'}
+
+    def __init__(self, db: SQLiteDB):
+        self.db = db
+
+    @staticmethod
+    def _get(conn: sqlite3.Connection, session_id: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute('SELECT info, message_count FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[0]), messageCount=row[1])
+
+    @staticmethod
+    def _put(conn: sqlite3.Connection, info: Dict[str, Any]):
+        conn.execute('INSERT INTO sessions (id, title, created_at, updated_at, message_count, info) VALUES (?, ?, ?, ?, ?, ?) '
+                     'ON CONFLICT (id) DO UPDATE SET title = excluded.title, created_at = excluded.created_at, '
+                     'updated_at = excluded.updated_at, message_count = excluded.message_count, info = excluded.info',
+                     (info['id'], info.get('title'), info.get('createdAt'), info.get('updatedAt'),
+                      int(info.get('messageCount') or 0), _dumps(info)))
+
+    @staticmethod
+    def _insert_messages(conn: sqlite3.Connection, session_id: str, first_seq: int, messages: List[Dict[str, Any]]):
+        conn.executemany('INSERT INTO session_messages (session_id, seq, body) VALUES (?, ?, ?)',
+                         [(session_id, first_seq + i, _dumps(m)) for i, m in enumerate(messages)])
+
+    def create(self, session_id: str, title: Optional[str] = None) -> Dict[str, Any]:
+        with self.db.transaction() as conn:
+            info = self._get(conn, session_id)
+            if info is None:
+                now = datetime.now().isoformat()
+                info = {'id': session_id, 'title': title or '新对话', 'createdAt': now, 'updatedAt': now,
+                        'messageCount': 0}
+                self._put(conn, info)
+        return info
+
+    def info(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._get(self.db.conn(), session_id)
+
+    def page(self, offset: int = 0, limit: Optional[int] = None, sort_by: str = 'updatedAt',
+             descending: bool = True) -> Dict[str, Any]:
+        column = self.SORT_COLUMNS.get(sort_by)
+        if column is None:
+            raise ValueError(f'sort_by must be one of {", ".join(self.SORT_COLUMNS)}')
+        order = 'DESC' if descending else 'ASC'
+        offset = max(0, offset)
+        with self.db.snapshot() as conn:
+            total = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+            rows = conn.execute(f'SELECT info, message_count FROM sessions ORDER BY {column} {order}, id {order} '
+                                'LIMIT ? OFFSET ?', (-1 if limit is None else max(0, limit), offset)).fetchall()
+        items = []
+        for info, count in rows:
+            item = dict(json.loads(info), messageCount=count)
+            # 滚动摘要只通过 get() 读取，列表中不返回
+            item.pop('summary', None)
+            items.append(item)
+        return {'total': total, 'offset': offset, 'limit': limit, 'items': items}
+
+    def messages(self, session_id: str) -> List[Dict[str, Any]]:
+        rows = self.db.query('SELECT body FROM session_messages WHERE session_id = ? ORDER BY seq', (session_id,))
+        return [json.loads(body) for (body,) in rows]
+
+    def message_page(self, session_id: str, limit: int, before: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        with self.db.snapshot() as conn:
+            info = self._get(conn, session_id)
+            if info is None:
+                return None
+            total = info['messageCount']
+            end = total if before is None else max(0, min(before, total))
+            start = max(0, end - max(1, limit))
+            rows = conn.execute('SELECT body FROM session_messages WHERE session_id = ? AND seq >= ? AND seq < ? '
+                                'ORDER BY seq', (session_id, start, end)).fetchall()
+        return {'messages': [json.loads(body) for (body,) in rows], 'start': start, 'end': end, 'total': total,
+                'next_before': start if start > 0 else None}
+
+    def save_messages(self, session_id: str, messages: List[Dict[str, Any]], auto_title=None):
+        """Replace all messages of the session (created if missing)."""
+        with self.db.transaction() as conn:
+            info = self._get(conn, session_id) or {'id': session_id, 'title': '新对话'}
+            conn.execute('DELETE FROM session_messages WHERE session_id = ?', (session_id,))
+            self._insert_messages(conn, session_id, 0, messages)
+            info['updatedAt'] = datetime.now().isoformat()
+            info['messageCount'] = len(messages)
+            # 消息被整体改写，之前的滚动总结可能已不成立
+            info.pop('summary', None)
+            if auto_title is not None:
+                auto_title(info, messages)
+            self._put(conn, info)
+
+    def append_messages(self, session_id: str, messages: List[Dict[str, Any]], expected_seq: Optional[int] = None,
+                        auto_title=None) -> Dict[str, Any]:
+        with self.db.transaction() as conn:
+            info = self._get(conn, session_id)
+            if info is None:
+                return {'success': False, 'not_found': True, 'error': '会话不存在'}
+            seq = info['messageCount']
+            if expected_seq is not None and expected_seq != seq:
+                return {'success': False, 'conflict': True, 'seq': seq,
+                        'error': f'消息序号冲突：期望 {expected_seq}，实际 {seq}'}
+            if messages:
+                self._insert_messages(conn, session_id, seq, messages)
+                info['updatedAt'] = datetime.now().isoformat()
+                info['messageCount'] = seq + len(messages)
+                if auto_title is not None:
+                    auto_title(info, messages)
+                self._put(conn, info)
+        return {'success': True, 'seq': seq + len(messages)}
+
+    def update(self, session_id: str, **fields) -> bool:
+        """Merge fields into the session's info; False if it doesn't exist."""
+        with self.db.transaction() as conn:
+            info = self._get(conn, session_id)
+            if info is None:
+                return False
+            info.update(fields)
+            self._put(conn, info)
+        return True
+
+    def delete(self, session_id: str):
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM session_messages WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+
+def migrate(db: SQLiteDB, sessions_dir: Optional[str] = None, memory_file: Optional[str] = None,
+            text_db_file: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+    """Copy sessions, memories and the text DB from their files into SQLite, once.
+
+    Runs in a single write transaction, so concurrent processes starting at
+    the same time migrate exactly once. The files are left in place. With
+    force=True the copy is repeated, overwriting rows with the same ids.
+    """
+    try:
+        from .text_db import TextDB, TEXT_DB_FILE
+        from .memory_store import MemoryStore, MEMORY_FILE
+        from .session_catalog import SessionCatalog
+    except ImportError:
+        from text_db import TextDB, TEXT_DB_FILE
+        from memory_store import MemoryStore, MEMORY_FILE
+        from session_catalog import SessionCatalog
+    sessions_dir = sessions_dir or os.path.join(_DATA_DIR, 'sessions')
+    memory_file = memory_file or MEMORY_FILE
+    text_db_file = text_db_file or TEXT_DB_FILE
+
+    with db.transaction() as conn:
+        done = SQLiteDB.read_meta(conn, 'migrated_at')
+        if done and not force:
+            return {'migrated': False, 'migrated_at': done}
+        counts = {'text_docs': 0, 'memories': 0, 'sessions': 0, 'session_messages': 0}
+
+        if os.path.exists(text_db_file):
+            text_db = TextDB(text_db_file)
+            docs = text_db.documents()
+            conn.executemany('INSERT OR REPLACE INTO text_docs (id, body) VALUES (?, ?)',
+                             [(str(d.get('id', '')), _dumps(d)) for d in docs])
+            next_id = max(text_db.stats()['next_id'], int(SQLiteDB.read_meta(conn, 'text_next_id') or 1))
+            SQLiteDB.set_meta(conn, 'text_next_id', str(next_id))
+            counts['text_docs'] = len(docs)
+
+        if os.path.exists(memory_file):
+            store = MemoryStore(memory_file)
+            records = store.list(0, len(store), newest_first=False, with_messages=True)['items']
+            conn.executemany('INSERT OR REPLACE INTO memories (id, body, messages, source_hash) VALUES (?, ?, ?, ?)',
+                             [SQLiteMemoryStore._row(r) for r in records])
+            counts['memories'] = len(records)
+
+        if os.path.isdir(sessions_dir):
+            for info in SessionCatalog(sessions_dir).page()['items']:
+                session_id = info['id']
+                messages = []
+                path = os.path.join(sessions_dir, f'{session_id}.jsonl')
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            try:
+                                messages.append(json.loads(line))
+                            except ValueError:
+                                continue
+                info = {k: v for k, v in info.items() if k != 'bytes'}
+                info['messageCount'] = len(messages)
+                conn.execute('DELETE FROM session_messages WHERE session_id = ?', (session_id,))
+                SQLiteSessions._insert_messages(conn, session_id, 0, messages)
+                SQLiteSessions._put(conn, info)
+                counts['sessions'] += 1
+                counts['session_messages'] += len(messages)
+
+        migrated_at = datetime.now().isoformat()
+        SQLiteDB.set_meta(conn, 'migrated_at', migrated_at)
+        SQLiteDB.set_meta(conn, 'migration', _dumps(counts))
+    logger.info('已从文件迁移到 SQLite: %s', counts)
+    return dict(counts, migrated=True, migrated_at=migrated_at)
+
+
+def get_db(path: Optional[str] = None) -> SQLiteDB:
+    """Process-wide SQLiteDB for `path` (default SQLITE_PATH); the file data is migrated on first open."""
+    path = os.path.abspath(path or SQLITE_PATH)
+    with _dbs_lock:
+        db = _dbs.get(path)
+        if db is not None:
+            return db
+        db = SQLiteDB(path)
+        if db.get_meta('migrated_at') is None:
+            migrate(db)
+        _dbs[path] = db
+        return db
+
+
+def get_text_store() -> SQLiteTextDB:
+    return SQLiteTextDB(get_db())
+
+
+def get_memory_store() -> SQLiteMemoryStore:
+    return SQLiteMemoryStore(get_db())
+
+
+def get_sessions() -> SQLiteSessions:
+    return SQLiteSessions(get_db())
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(description='SQLite storage for sessions, memories and the text DB')
+    parser.add_argument('command', choices=['migrate', 'stats'])
+    parser.add_argument('--db', default=SQLITE_PATH, help='SQLite database file.')
+    parser.add_argument('--force', action='store_true', help='Copy the files again even if already migrated.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    db = SQLiteDB(args.db)
+    if args.command == 'migrate':
+        print(json.dumps(migrate(db, force=args.force), ensure_ascii=False))
+    else:
+        stats = {table: db.query(f'SELECT COUNT(*) FROM {table}')[0][0]
+                 for table in ('text_docs', 'memories', 'sessions', 'session_messages')}
+        stats['migrated_at'] = db.get_meta('migrated_at')
+        print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    _main()
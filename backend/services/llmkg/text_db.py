@@ -0,0 +1,336 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    from . import storage
+except ImportError:
+    import storage
+
+logger = logging.getLogger(__name__)
+
+TEXT_DB_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'text_data', 'total.jsonl')
+# 无效行（损坏、重复 id、旧的 JSON 数组格式）占比超过该值时，加载后自动压缩
+COMPACT_RATIO = float(os.getenv('KG_TEXTDB_COMPACT_RATIO', '0.2'))
+
+_dbs: Dict[str, 'TextDB'] = {}
+_dbs_lock = threading.Lock()
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+class TextDB:
+    """Append-only JSONL document store (total.jsonl) with a monotonic id allocator.
+
+    Each append writes one line and fsyncs it; nothing is rewritten. The set
+    of ids and the next numeric id are kept in memory after one scan of the
+    file, and the allocator is persisted in `<file>.ids` so numeric ids are
+    never handed out twice, even after compaction drops records.
+
+    A legacy JSON-array file is converted to JSONL on first load; in a
+    JSONL file a torn last line left by a crash is truncated (and kept in
+    `<file>.torn`). The file is
+    compacted (one line per id, last one wins) when invalid lines exceed
+    COMPACT_RATIO, and changes made by other writers are picked up by
+    comparing the file's size and mtime before each operation.
+    """
+
+    def __init__(self, path: str = TEXT_DB_FILE):
+        self.path = path
+        self.ids_path = path + '.ids'
+        self._ids: set = set()
+        self._next_id = 1
+        self._lines = 0
+        self._garbage = 0
+        self._signature = None
+        self._lock = threading.RLock()
+
+    # ---- loading ----
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _read_allocator(self) -> int:
+        try:
+            with open(self.ids_path, 'r', encoding='utf-8') as f:
+                return int(json.load(f).get('next_id', 1))
+        except (OSError, ValueError, AttributeError):
+            return 1
+
+    def _save_allocator(self):
+        _write_atomic(self.ids_path, json.dumps({'next_id': self._next_id}).encode('utf-8'))
+
+    def _is_legacy_array(self) -> bool:
+        """True when the file is in the old JSON-array format (first non-space byte is '[')."""
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(4096), b''):
+                stripped = chunk.lstrip()
+                if stripped:
+                    return stripped[:1] == b'['
+        return False
+
+    def _convert_legacy(self):
+        """Rewrite a legacy JSON array as JSONL before anything else touches the file."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                # 无法解析的数组：不截断也不追加，避免丢失或混入原有记录
+                raise ValueError(f'text_db 是无法解析的 JSON 数组，请手动修复: {self.path} ({e})')
+        if not isinstance(data, list):
+            raise ValueError(f'text_db 不是 JSON 数组或 JSONL: {self.path}')
+        logger.info('text_db 为旧的 JSON 数组格式，转换为 JSONL: %s', self.path)
+        self.compact()
+
+    def _truncate_torn_tail(self):
+        """Drop a last line without its newline (an interrupted append); JSONL files only.
+
+        Only the bytes after the last newline are removed, and they are kept
+        in `<file>.torn` for inspection.
+        """
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # 向前找到最后一个换行符
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                idx = chunk.rfind(b'\n')
+                if idx >= 0:
+                    pos = pos - step + idx + 1
+                    break
+                pos -= step
+            f.seek(pos)
+            tail = f.read()
+            try:
+                json.loads(tail.decode('utf-8'))
+                # 最后一行完整，只是缺少换行符
+                f.seek(size)
+                f.write(b'\n')
+            except (ValueError, UnicodeDecodeError):
+                logger.warning('text_db 尾部存在不完整的记录，已截断并保存到 %s.torn', self.path)
+                with open(self.path + '.torn', 'ab') as torn:
+                    torn.write(tail + b'\n')
+                f.truncate(pos)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _scan(self) -> Iterator[Dict[str, Any]]:
+        """Records of the file; a legacy JSON array counts as garbage so it gets rewritten as JSONL."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            first = f.read(1)
+            while first and first.isspace():
+                first = f.read(1)
+            f.seek(0)
+            if first == '[':
+                try:
+                    data = json.load(f)
+                except ValueError:
+                    data = None
+                if isinstance(data, list):
+                    self._garbage += 1
+                    for item in data:
+                        if isinstance(item, dict):
+                            self._lines += 1
+                            yield item
+                    return
+                f.seek(0)
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                self._lines += 1
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    self._garbage += 1
+                    continue
+                if not isinstance(item, dict):
+                    self._garbage += 1
+                    continue
+                yield item
+
+    def _load(self):
+        """(Re)build the in-memory id set and allocator from the file (lock held)."""
+        if os.path.exists(self.path):
+            # 旧的 JSON 数组格式先整体转换，否则其末尾（"]" 没有换行符）会被当作不完整的行截断
+            if self._is_legacy_array():
+                self._convert_legacy()
+            else:
+                self._truncate_torn_tail()
+        self._ids = set()
+        self._lines = self._garbage = 0
+        max_numeric = 0
+        if os.path.exists(self.path):
+            for item in self._scan():
+                doc_id = str(item.get('id', ''))
+                if doc_id in self._ids:
+                    self._garbage += 1
+                self._ids.add(doc_id)
+                if doc_id.isdigit():
+                    max_numeric = max(max_numeric, int(doc_id))
+        self._next_id = max(self._read_allocator(), max_numeric + 1)
+        self._signature = self._stat()
+        if self._garbage and self._garbage > COMPACT_RATIO * max(self._lines, 1):
+            self.compact()
+
+    def _ensure_loaded(self):
+        if self._signature is None or self._stat() != self._signature:
+            self._load()
+
+    # ---- writes ----
+
+    def allocate_id(self) -> str:
+        """Next unused numeric id; persisted before it is returned."""
+        with self._lock:
+            self._ensure_loaded()
+            while str(self._next_id) in self._ids:
+                self._next_id += 1
+            doc_id = str(self._next_id)
+            self._next_id += 1
+            self._save_allocator()
+            return doc_id
+
+    def append_many(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Append documents in one write + fsync; missing or already used ids are replaced by allocated ones.
+
+        The dicts are updated in place with their final id and returned.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            allocated = False
+            lines = []
+            for doc in docs:
+                doc_id = str(doc.get('id') or '')
+                if not doc_id or doc_id in self._ids:
+                    while str(self._next_id) in self._ids:
+                        self._next_id += 1
+                    doc_id = str(self._next_id)
+                    self._next_id += 1
+                    allocated = True
+                doc['id'] = doc_id
+                self._ids.add(doc_id)
+                lines.append(json.dumps(doc, ensure_ascii=False) + '\n')
+            if not lines:
+                return docs
+            if allocated:
+                # 先持久化分配器，崩溃后也不会重复分配
+                self._save_allocator()
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            created = not os.path.exists(self.path)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            if created:
+                _fsync_dir(self.path)
+            self._lines += len(lines)
+            self._signature = self._stat()
+            return docs
+
+    def append(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return self.append_many([doc])[0]
+
+    def compact(self) -> Dict[str, int]:
+        """Rewrite the file as JSONL with one line per id (last one wins), dropping invalid lines."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return {'before': 0, 'after': 0}
+            self._lines = self._garbage = 0
+            latest: Dict[str, Dict[str, Any]] = {}
+            for item in self._scan():
+                doc_id = str(item.get('id', ''))
+                latest.pop(doc_id, None)
+                latest[doc_id] = item
+            before = self._lines
+            data = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in latest.values())
+            _write_atomic(self.path, data.encode('utf-8'))
+            self._ids = set(latest)
+            self._lines, self._garbage = len(latest), 0
+            self._signature = self._stat()
+            logger.info('text_db 压缩完成: %d -> %d 行', before, len(latest))
+            return {'before': before, 'after': len(latest)}
+
+    # ---- reads ----
+
+    def documents(self) -> List[Dict[str, Any]]:
+        """Current documents (last line per id wins), in file order."""
+        with self._lock:
+            self._ensure_loaded()
+            if not os.path.exists(self.path):
+                return []
+            counters = self._lines, self._garbage
+            latest: Dict[str, Dict[str, Any]] = {}
+            try:
+                for item in self._scan():
+                    doc_id = str(item.get('id', ''))
+                    latest.pop(doc_id, None)
+                    latest[doc_id] = item
+            finally:
+                self._lines, self._garbage = counters
+            return list(latest.values())
+
+    def __contains__(self, doc_id: Any) -> bool:
+        with self._lock:
+            self._ensure_loaded()
+            return str(doc_id) in self._ids
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._ensure_loaded()
+            return {'documents': len(self._ids), 'lines': self._lines, 'garbage': self._garbage,
+                    'next_id': self._next_id, 'bytes': (self._signature or (0, 0))[0]}
+
+
+def get_text_db(path: Optional[str] = None) -> TextDB:
+    """Process-wide TextDB for `path` (default TEXT_DB_FILE).
+
+    With KG_STORAGE=sqlite the documents live in the shared SQLite database
+    and `path` is ignored.
+    """
+    if storage.use_sqlite():
+        return storage.get_text_store()
+    path = os.path.abspath(path or TEXT_DB_FILE)
+    with _dbs_lock:
+        db = _dbs.get(path)
+        if db is None:
+            db = _dbs[path] = TextDB(path)
+        return db
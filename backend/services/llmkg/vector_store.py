@@ -1,8 +1,13 @@
 import os
 import json
+import math
+import time
+import logging
 import threading
 import re
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Any, Optional, Tuple
 
 import numpy as np
 
@@ -12,18 +17,151 @@ except Exception:
     faiss = None
 
 try:
-    from text2vec import SentenceModel
-except Exception:
-    SentenceModel = None
-    
+    import fcntl
+except ImportError:
+    # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+try:
+    from .embedding_cache import EmbeddingCache, content_key
+    from .embedding_worker import EmbeddingBatcher
+    from .meta_store import MetaStore, FieldIndex, document_fields, store_exists
+    from .lexical_index import LexicalIndex
+    from .chunking import chunk_text
+    from . import embedding_backend, index_snapshot, parallel_embed, shard_pool
+except ImportError:
+    # 作为脚本直接运行（python vector_store.py）时没有包上下文
+    from embedding_cache import EmbeddingCache, content_key
+    from embedding_worker import EmbeddingBatcher
+    from meta_store import MetaStore, FieldIndex, document_fields, store_exists
+    from lexical_index import LexicalIndex
+    from chunking import chunk_text
+    import embedding_backend
+    import index_snapshot
+    import parallel_embed
+    import shard_pool
+
+logger = logging.getLogger(__name__)
+
 VEC_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", "vector_database")
 INDEX_FILE = os.path.join(VEC_DIR, "index.faiss")
-META_FILE = os.path.join(VEC_DIR, "metadata.json")
+# 文档元数据存放在 metadata.idx/metadata.dat（见 meta_store）；metadata.json 为旧格式，首次加载时迁移
+META_STORE = os.path.join(VEC_DIR, "metadata")
+META_FILE = META_STORE + ".json"
+
+EMBED_CACHE_DIR = os.getenv("VEC_EMBED_CACHE_DIR", os.path.join(VEC_DIR, "embedding_cache"))
+EMBED_CACHE_ENABLED = os.getenv('VEC_EMBED_CACHE', '1').lower() in ('1', 'true', 'yes')
+QUERY_CACHE_SIZE = int(os.getenv('VEC_QUERY_CACHE_SIZE', '1024'))
 
+# 增量写入超过该条数后，把增量合并进主索引文件
+DELTA_COMPACT_THRESHOLD = int(os.getenv('VEC_DELTA_COMPACT_THRESHOLD', '500'))
+# 以 mmap 方式加载索引，多个 worker 进程共享页缓存
+MMAP_ENABLED = os.getenv('VEC_MMAP', '1').lower() in ('1', 'true', 'yes')
+# 索引文件变化的轮询间隔（秒），0 表示不监听
+WATCH_INTERVAL = float(os.getenv('VEC_WATCH_INTERVAL', '2'))
+# 应用启动时在后台预先加载模型和索引，避免首个请求承担冷启动
+WARMUP_ENABLED = os.getenv('VEC_WARMUP', '1').lower() in ('1', 'true', 'yes')
+
+# 可选的索引类型；auto 时按语料规模和内存预算自动选择
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+FLAT_MAX_DOCS = int(os.getenv('VEC_FLAT_MAX_DOCS', '20000'))
+HNSW_MAX_DOCS = int(os.getenv('VEC_HNSW_MAX_DOCS', '500000'))
+MEMORY_BUDGET_MB = int(os.getenv('VEC_MEMORY_BUDGET_MB', '2048'))
+HNSW_M = 32
+DEFAULT_NPROBE = int(os.getenv('VEC_NPROBE', '16'))
+DEFAULT_EF_SEARCH = int(os.getenv('VEC_EF_SEARCH', '64'))
+
+# 向量压缩方式：none 原始 float32；fp16 / sq8 标量量化；pq 乘积量化（ivf_pq 固定为 pq）
+COMPRESSIONS = ('none', 'fp16', 'sq8', 'pq')
+DEFAULT_COMPRESSION = os.getenv('VEC_COMPRESSION', 'none')
+# 压缩索引检索 k * RERANK_FACTOR 个候选，再用磁盘上的原始向量精确重排；0 表示不重排
+RERANK_FACTOR = int(os.getenv('VEC_RERANK_FACTOR', '4'))
+# 带进度回调的编码每隔多少个批次汇报一次
+PROGRESS_BATCHES = int(os.getenv('VEC_PROGRESS_BATCHES', '8'))
+# 并行构建（VEC_BUILD_WORKERS）时每次从缓存读取的行数
+STREAM_CHUNK = int(os.getenv('VEC_BUILD_STREAM_CHUNK', '8192'))
+# 需要训练的索引（IVF / PQ / SQ）在并行构建时使用的随机训练样本数
+TRAIN_SAMPLE = int(os.getenv('VEC_BUILD_TRAIN_SAMPLE', '65536'))
+
+# 过滤后剩余向量不超过该数量时直接精确打分，不走 ANN
+FILTER_EXACT_MAX = int(os.getenv('VEC_FILTER_EXACT_MAX', '4096'))
+# 带过滤的 HNSW 检索按选择率放大 efSearch 的上限
+FILTER_MAX_EF_SEARCH = int(os.getenv('VEC_FILTER_MAX_EF_SEARCH', '1024'))
+
+# 混合检索：字符 n-gram BM25 与向量结果做倒数排名融合（RRF）
+HYBRID_ENABLED = os.getenv('VEC_HYBRID', '1').lower() in ('1', 'true', 'yes')
+RRF_K = int(os.getenv('VEC_RRF_K', '60'))
+HYBRID_CANDIDATES = int(os.getenv('VEC_HYBRID_CANDIDATES', '50'))
+# 至少 k 篇文档命中查询的全部词项时，直接返回词法结果，省去一次模型前向
+LEXICAL_SHORTCUT = os.getenv('VEC_LEXICAL_SHORTCUT', '1').lower() in ('1', 'true', 'yes')
+
+# _meta 的行号即 faiss 中的向量 id，被删除的文档读出为 None。
+# 长文档拆成多个分块，每块一行：首块保存完整文档（text 为分块内容，原文在 _doc_text），
+# _chunk = {'index': 0, 'labels': [各块 id]}；其余块只有 id/text 和 _chunk = {'index': i, 'doc_label': 首块 id}
 _index = None
-_meta: List[Dict[str, Any]] = []
+_meta: Optional[MetaStore] = None
+# 与 _index 同步维护的词法索引，按同一 id 寻址
+_lexical: Optional[LexicalIndex] = None
+# 文档 id -> 向量 id，仅写路径需要，首次使用时再构建
+_doc_labels: Optional[Dict[str, int]] = None
+# 过滤字段（source/defect/created_at...）-> 向量 id 的倒排，首次带过滤条件检索时构建
+_fields: Optional[FieldIndex] = None
 _model = None
+_model_id = ''
+_embed_caches: Dict[str, EmbeddingCache] = {}
+_batcher: Optional[EmbeddingBatcher] = None
+# 当前加载的快照：调用方传入的路径、实际文件、磁盘签名和已回放的增量位置
+_active: Dict[str, Any] = {}
+_watcher: Optional[threading.Thread] = None
 _lock = threading.Lock()
+# 写索引（增量写入、合并、发布重建结果）在进程内的互斥；跨进程由 _writer_lock 的 flock 保证
+_write_mutex = threading.Lock()
+# 本进程中正在进行的重建数（没有 fcntl 时用来推迟合并）
+_builds_running = 0
+hybrid_stats = {'queries': 0, 'lexical_only': 0}
+
+
+class _RWLock:
+    """Many concurrent readers (searches) or a single writer (mutation / swap)."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+# 保护 _index/_meta/_active：检索持读锁，原地修改和热切换持写锁
+_index_lock = _RWLock()
 
 
 def ensure_dir():
@@ -31,52 +169,827 @@ def ensure_dir():
 
 
 def load_model(model_path: str = None):
-    global _model
+    """Return the shared embedding backend (see embedding_backend), loading it once per process."""
+    global _model, _model_id
     if _model is not None:
         return _model
-    if SentenceModel is None:
-        raise RuntimeError("text2vec (SentenceModel) is not installed")
-    # fallback to environment variable if not provided
-    if model_path is None:
-        model_path = os.getenv('SENT_MODEL_PATH')
-    if model_path is None:
-        raise RuntimeError("model_path is required for text2vec SentenceModel (or set SENT_MODEL_PATH env var)")
-    _model = SentenceModel(model_path)
+    backend = embedding_backend.get_backend(model_path)
+    _model_id = backend.model_id
+    _model = backend
     return _model
 
 
-def build_index_from_texts(texts: List[Dict[str, Any]], model_path: str, index_path: str = INDEX_FILE, meta_path: str = META_FILE, batch_size: int = 64):
-    """Build FAISS index from list of {'id','text'} dicts."""
-    if faiss is None:
-        raise RuntimeError("faiss is not installed")
-    ensure_dir()
-    model = load_model(model_path)
-    corpus = [t.get('text', '') for t in texts]
-    embeddings = model.encode(corpus, batch_size=batch_size)
+def warmup(model_path: Optional[str] = None) -> Dict[str, Any]:
+    """Load the model, run one forward pass and load the index so the first request is warm."""
+    t0 = time.perf_counter()
+    try:
+        model = load_model(model_path)
+        _encode_normalized(model, embedding_backend.PROBE_TEXTS[:1], batch_size=1)
+        if _index is None and index_exists():
+            load_index()
+    except Exception as e:
+        logger.warning('向量检索预热失败: %s', e)
+        return {'success': False, 'error': str(e)}
+    seconds = time.perf_counter() - t0
+    logger.info('向量检索预热完成，用时 %.1fs', seconds)
+    return {'success': True, 'seconds': seconds}
+
+
+def start_warmup(model_path: Optional[str] = None) -> bool:
+    """Run `warmup` in a daemon thread; requests arriving meanwhile wait on the same model load."""
+    if not WARMUP_ENABLED:
+        return False
+    threading.Thread(target=warmup, args=(model_path,), name='vector-warmup', daemon=True).start()
+    return True
+
+
+def _encode_normalized(model, corpus: List[str], batch_size: int) -> np.ndarray:
+    """Encode texts and L2-normalize them so inner product equals cosine similarity."""
+    # 按长度排序后编码，同一批内的 padding 更少
+    order = sorted(range(len(corpus)), key=lambda i: len(corpus[i]), reverse=True)
+    embeddings = model.encode([corpus[i] for i in order], batch_size=batch_size)
     emb_arr = np.asarray(embeddings, dtype='float32')
     if emb_arr.ndim == 1:
         emb_arr = emb_arr.reshape(1, -1)
+    emb_arr = emb_arr[np.argsort(order)]
     # normalize for cosine similarity using numpy
     norms = np.linalg.norm(emb_arr, axis=1, keepdims=True)
     norms[norms == 0] = 1  # Avoid division by zero
-    emb_arr = emb_arr / norms
-    dim = emb_arr.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(emb_arr)
-    faiss.write_index(index, index_path)
-    # write metadata
-    with open(meta_path, 'w', encoding='utf-8') as f:
-        json.dump(texts, f, ensure_ascii=False, indent=2)
-    # reload into memory
+    return np.ascontiguousarray(emb_arr / norms)
+
+
+def _embedding_cache() -> Optional[EmbeddingCache]:
+    if not EMBED_CACHE_ENABLED:
+        return None
+    cache = _embed_caches.get(_model_id)
+    if cache is None:
+        # 每个模型一个缓存目录，不同模型的向量维度可能不同
+        namespace = content_key(_model_id, '').hex()[:16]
+        cache = EmbeddingCache(os.path.join(EMBED_CACHE_DIR, namespace))
+        _embed_caches[_model_id] = cache
+    return cache
+
+
+def _encode_progressive(model, corpus: List[str], batch_size: int, progress: Callable[[int, int], None],
+                        offset: int = 0, total: Optional[int] = None) -> np.ndarray:
+    """_encode_normalized in slices, calling progress(done, total) after each one."""
+    total = len(corpus) if total is None else total
+    step = batch_size * PROGRESS_BATCHES
+    # 整体按长度排序后再切片，保持每批内 padding 较少
+    order = np.argsort([len(t) for t in corpus], kind='stable')
+    out = None
+    for start in range(0, len(corpus), step):
+        part = order[start:start + step]
+        vecs = _encode_normalized(model, [corpus[i] for i in part], batch_size)
+        if out is None:
+            out = np.empty((len(corpus), vecs.shape[1]), dtype='float32')
+        out[part] = vecs
+        progress(offset + start + len(part), total)
+    return out
+
+
+def _encode_cached(model, corpus: List[str], batch_size: int,
+                   progress: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
+    """Like _encode_normalized, but only cache misses go through the model.
+
+    progress(done, total) is called as texts are encoded (cache hits count as done).
+    """
+    cache = _embedding_cache()
+    if cache is None or not corpus:
+        if progress is None or not corpus:
+            return _encode_normalized(model, corpus, batch_size)
+        return _encode_progressive(model, corpus, batch_size, progress)
+    keys = [content_key(_model_id, text) for text in corpus]
+    hits = cache.get_many(keys)
+    misses = [i for i in range(len(corpus)) if i not in hits]
+    fresh = None
+    if progress is not None:
+        progress(len(hits), len(corpus))
+    if misses:
+        texts = [corpus[i] for i in misses]
+        if progress is None:
+            fresh = _encode_normalized(model, texts, batch_size)
+        else:
+            fresh = _encode_progressive(model, texts, batch_size, progress, offset=len(hits), total=len(corpus))
+        cache.put_many([keys[i] for i in misses], fresh)
+    dim = fresh.shape[1] if fresh is not None else len(next(iter(hits.values())))
+    out = np.empty((len(corpus), dim), dtype='float32')
+    for pos, vec in hits.items():
+        out[pos] = vec
+    if misses:
+        out[misses] = fresh
+    # 缓存中的 float16 向量需要重新归一化
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(out / norms)
+
+
+class _QueryLRU:
+    """Thread-safe LRU of normalized query embeddings keyed by (model id, query)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key, vec: np.ndarray):
+        if self.maxsize <= 0:
+            return
+        vec.setflags(write=False)
+        with self._lock:
+            self._data[key] = vec
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_query_cache = _QueryLRU(QUERY_CACHE_SIZE)
+
+
+def _get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        with _lock:
+            if _batcher is None:
+                _batcher = EmbeddingBatcher(lambda texts: _encode_normalized(_model, texts, batch_size=len(texts)))
+    return _batcher
+
+
+def _query_vectors(queries: List[str]) -> np.ndarray:
+    """Normalized embeddings for queries; repeats hit the LRU, misses share a batched forward pass."""
+    keys = [(_model_id, q) for q in queries]
+    vectors: List[Optional[np.ndarray]] = [_query_cache.get(key) for key in keys]
+    missing = list(OrderedDict.fromkeys(q for q, vec in zip(queries, vectors) if vec is None))
+    if missing:
+        encoded = dict(zip(missing, _get_batcher().encode(missing)))
+        for i, q in enumerate(queries):
+            if vectors[i] is None:
+                vectors[i] = encoded[q]
+        for q, vec in encoded.items():
+            _query_cache.put((_model_id, q), np.array(vec, dtype='float32'))
+    return np.ascontiguousarray(np.vstack(vectors), dtype='float32')
+
+
+def _new_id_index(dim: int):
+    """Create an empty inner-product index addressed by explicit int64 ids."""
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest divisor of dim giving sub-vectors of at least 8 dimensions."""
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def _code_bytes(dim: int, compression: str) -> int:
+    """Bytes one stored vector code takes under a compression mode."""
+    if compression == 'none':
+        return dim * 4
+    if compression == 'fp16':
+        return dim * 2
+    if compression == 'sq8':
+        return dim
+    if compression == 'pq':
+        return _pq_subquantizers(dim)
+    raise ValueError(f'unknown compression: {compression}')
+
+
+def _estimate_bytes_per_vector(index_type: str, dim: int, compression: str = 'none') -> int:
+    # IndexIDMap2 keeps a forward and a reverse id map (~16 bytes per vector)
+    overhead = 16
+    if index_type == 'ivf_pq':
+        compression = 'pq'
+    code = _code_bytes(dim, compression)
+    if index_type == 'flat':
+        return code + overhead
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return code + 8 + overhead
+    if index_type == 'hnsw':
+        return code + HNSW_M * 2 * 4 + overhead
+    raise ValueError(f'unknown index type: {index_type}')
+
+
+def select_index_type(n: int, dim: int, memory_budget_mb: Optional[int] = None) -> str:
+    """Pick an index family for a corpus of n vectors within the memory budget."""
+    budget = (memory_budget_mb or MEMORY_BUDGET_MB) * 1024 * 1024
+
+    def fits(index_type):
+        return n * _estimate_bytes_per_vector(index_type, dim) <= budget
+
+    if n <= FLAT_MAX_DOCS and fits('flat'):
+        return 'flat'
+    if n <= HNSW_MAX_DOCS and fits('hnsw'):
+        return 'hnsw'
+    if fits('ivf_flat'):
+        return 'ivf_flat'
+    return 'ivf_pq'
+
+
+def select_compression(index_type: str, n: int, dim: int, memory_budget_mb: Optional[int] = None) -> str:
+    """Least lossy compression that keeps n vectors of `index_type` within the memory budget."""
+    if index_type == 'ivf_pq':
+        return 'pq'
+    budget = (memory_budget_mb or MEMORY_BUDGET_MB) * 1024 * 1024
+    for compression in COMPRESSIONS:
+        if n * _estimate_bytes_per_vector(index_type, dim, compression) <= budget:
+            return compression
+    return 'pq'
+
+
+def _factory_string(index_type: str, n: int, dim: int, compression: str = 'none') -> str:
+    # IVF 原生支持按 id 增删；Flat/HNSW 需要 IDMap2 包装
+    # nlist ~ 4*sqrt(n), 但每个聚类中心至少需要 39 个训练样本
+    nlist = max(1, min(int(4 * math.sqrt(max(n, 1))), n // 39))
+    nbits = max(1, min(8, int(math.log2(max(n, 2)))))
+    if index_type == 'ivf_pq':
+        compression = 'pq'
+    codes = {
+        'none': 'Flat',
+        'fp16': 'SQfp16',
+        'sq8': 'SQ8',
+        'pq': f'PQ{_pq_subquantizers(dim)}x{nbits}',
+    }
+    if compression not in codes:
+        raise ValueError(f'unknown compression: {compression}')
+    if index_type == 'flat':
+        return f'IDMap2,{codes[compression]}'
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        return f'IVF{nlist},{codes[compression]}'
+    if index_type == 'hnsw':
+        return f'IDMap2,HNSW{HNSW_M}' if compression == 'none' else f'IDMap2,HNSW{HNSW_M},{codes[compression]}'
+    raise ValueError(f'unknown index type: {index_type}')
+
+
+def _index_choice(n: int, dim: int, index_type: str = 'auto', memory_budget_mb: Optional[int] = None,
+                  compression: Optional[str] = 'none'):
+    """Resolve 'auto' index type / compression for n vectors of `dim`."""
+    if index_type in (None, '', 'auto'):
+        index_type = select_index_type(n, dim, memory_budget_mb)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f'unknown index type: {index_type}')
+    if compression in (None, '', 'auto'):
+        compression = select_compression(index_type, n, dim, memory_budget_mb)
+    return index_type, compression
+
+
+def _new_ann_index(index_type: str, n: int, dim: int, compression: str):
+    """Empty (possibly untrained) id-mapped index sized for n vectors."""
+    index = faiss.index_factory(dim, _factory_string(index_type, n, dim, compression), faiss.METRIC_INNER_PRODUCT)
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = 200
+        inner.hnsw.efSearch = DEFAULT_EF_SEARCH
+    if isinstance(inner, faiss.IndexIVFPQ):
+        # polysemous 训练仅用于汉明距离过滤，这里用不到且非常耗时
+        inner.do_polysemous_training = False
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(DEFAULT_NPROBE, inner.nlist)
+    return index
+
+
+def _build_ann_index(emb_arr: np.ndarray, index_type: str = 'auto', memory_budget_mb: Optional[int] = None,
+                     compression: str = 'none'):
+    """Create, train and populate an id-mapped index; row i gets id i."""
+    n, dim = emb_arr.shape
+    index_type, compression = _index_choice(n, dim, index_type, memory_budget_mb, compression)
+    index = _new_ann_index(index_type, n, dim, compression)
+    if not index.is_trained:
+        index.train(emb_arr)
+    index.add_with_ids(emb_arr, np.arange(n, dtype='int64'))
+    return index
+
+
+def _inner_index(idx):
+    return faiss.downcast_index(idx.index) if isinstance(idx, faiss.IndexIDMap2) else idx
+
+
+def index_type_of(idx) -> str:
+    """Return the index family ('flat', 'ivf_flat', 'ivf_pq', 'hnsw') of a loaded index."""
+    inner = _inner_index(idx)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(inner, faiss.IndexIVF):
+        return 'ivf_flat'
+    if isinstance(inner, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+
+def compression_of(idx) -> str:
+    """Return how a loaded index stores its vectors (one of COMPRESSIONS)."""
+    inner = _inner_index(idx)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return 'pq'
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return 'fp16' if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
+    return 'none'
+
+
+def _search_params(idx, nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None):
+    """Per-request search parameters; None keeps the defaults stored in the index.
+
+    `sel` is a faiss IDSelector restricting the search to some labels.
+    """
+    inner = _inner_index(idx)
+    if isinstance(inner, faiss.IndexIVF) and (nprobe or sel is not None):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe or inner.nprobe))
+    elif isinstance(inner, faiss.IndexHNSW) and (ef_search or sel is not None):
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search or inner.hnsw.efSearch))
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+def _rerank(q_arr: np.ndarray, D: np.ndarray, I: np.ndarray, full_vectors: np.ndarray):
+    """Replace approximate scores with exact inner products against full-precision vectors and re-sort."""
+    D = np.array(D, dtype='float32')
+    I = np.array(I, dtype='int64')
+    rows = full_vectors.shape[0]
+    for qi in range(len(q_arr)):
+        ids = I[qi]
+        valid = (ids >= 0) & (ids < rows)
+        if valid.any():
+            D[qi, valid] = np.asarray(full_vectors[ids[valid]]) @ q_arr[qi]
+        D[qi, ids < 0] = -np.inf
+        order = np.argsort(-D[qi], kind='stable')
+        D[qi] = D[qi, order]
+        I[qi] = ids[order]
+    return D, I
+
+
+def _rerank_vectors() -> Optional[np.ndarray]:
+    """Full-precision vectors of the active snapshot if its index is compressed (read lock held)."""
+    if _active.get('compression', 'none') == 'none':
+        return None
+    vectors = _active.get('vectors')
+    if vectors is None or vectors.shape[0] < len(_meta):
+        # 增量写入会追加新行，文件变长后重新映射
+        vectors = index_snapshot.open_vectors(_active['index_file'], _index.d)
+        _active['vectors'] = vectors
+    return vectors
+
+
+def _is_head(row: Dict[str, Any]) -> bool:
+    """True for rows that stand for a whole document (unchunked or first chunk)."""
+    return 'doc_label' not in row.get('_chunk', {})
+
+
+def _labels_of(meta) -> Dict[str, int]:
+    return {str(item.get('id')): label for label, item in enumerate(meta) if item is not None and _is_head(item)}
+
+
+def _document_rows(doc: Dict[str, Any], labels: List[int], chunks: List[str]) -> List[Dict[str, Any]]:
+    """Metadata rows for a document split into `chunks` stored under `labels`."""
+    if len(chunks) == 1:
+        return [doc]
+    head = dict(doc, text=chunks[0], _doc_text=doc.get('text', ''), _chunk={'index': 0, 'labels': labels})
+    return [head] + [{'id': doc.get('id'), 'text': chunk, '_chunk': {'index': i, 'doc_label': labels[0]}}
+                     for i, chunk in enumerate(chunks[1:], start=1)]
+
+
+def _chunk_documents(docs: List[Dict[str, Any]]):
+    """(metadata rows, texts to embed) for documents laid out from label 0."""
+    rows: List[Dict[str, Any]] = []
+    corpus: List[str] = []
+    for doc in docs:
+        chunks = chunk_text(doc.get('text', ''))
+        rows.extend(_document_rows(doc, list(range(len(rows), len(rows) + len(chunks))), chunks))
+        corpus.extend(chunks)
+    return rows, corpus
+
+
+def _document(row: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The original document stored in a head row."""
+    if row is None or '_chunk' not in row:
+        return row
+    doc = {key: value for key, value in row.items() if key not in ('_chunk', '_doc_text')}
+    doc['text'] = row.get('_doc_text', '')
+    return doc
+
+
+def _chunk_labels(label: int) -> List[int]:
+    row = _meta[label]
+    return list(row['_chunk']['labels']) if row is not None and '_chunk' in row else [label]
+
+
+def _collapse_hits(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Turn chunk hits ({'label', 'score', ...}, best first) into one result per document.
+
+    The document's best chunk decides its rank; chunked documents also report
+    the matching passage as 'chunk'. Read lock held.
+    """
+    results = []
+    seen = set()
+    for hit in hits:
+        row = _meta[hit['label']]
+        if row is None:
+            continue
+        chunk = row.get('_chunk')
+        doc_label, head = hit['label'], row
+        if not _is_head(row):
+            doc_label = chunk['doc_label']
+            head = _meta[doc_label]
+            if head is None:
+                continue
+        if doc_label in seen:
+            continue
+        seen.add(doc_label)
+        result = {key: value for key, value in hit.items() if key != 'label'}
+        result['item'] = _document(head)
+        if chunk is not None:
+            result['chunk'] = row.get('text', '')
+        results.append(result)
+    return results
+
+
+def _row_fields(meta, label: int, heads: Optional[Dict[int, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Filter fields of a row; chunk rows inherit their document's (`heads` caches them per document)."""
+    row = meta[label]
+    if row is None:
+        return None
+    head_label = label if _is_head(row) else row['_chunk']['doc_label']
+    if heads is not None and head_label in heads:
+        return heads[head_label]
+    head = row if head_label == label else meta[head_label]
+    fields = document_fields(_document(head)) if head is not None else None
+    if heads is not None:
+        heads[head_label] = fields
+    return fields
+
+
+def _refresh_fields(fields: Optional[FieldIndex], meta, labels: List[int]):
+    """Re-derive the filter fields of rows just written; a rewritten head also refreshes its chunks."""
+    if fields is None or not labels:
+        return
+    todo = set(labels)
+    for label in labels:
+        row = meta[label]
+        if row is not None and '_chunk' in row and _is_head(row):
+            todo.update(row['_chunk']['labels'])
+    heads: Dict[int, Any] = {}
+    for label in todo:
+        row_fields = _row_fields(meta, label, heads)
+        if row_fields is None:
+            fields.remove(label)
+        else:
+            fields.add(label, row_fields)
+
+
+def _field_index() -> FieldIndex:
+    """Filter-field inverted lists over the active metadata, built on first use (read lock held)."""
+    global _fields
+    if _fields is None:
+        with _lock:
+            if _fields is None:
+                t0 = time.perf_counter()
+                heads: Dict[int, Any] = {}
+                rows = ((label, _row_fields(_meta, label, heads)) for label in range(len(_meta)))
+                _fields = FieldIndex.build((label, f) for label, f in rows if f is not None)
+                logger.info('过滤字段索引已构建: %d 行, %.2fs', len(_fields), time.perf_counter() - t0)
+    return _fields
+
+
+def _filter_labels(filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """Sorted labels allowed by `filters`, or None when unfiltered (read lock held).
+
+    Raises ValueError for unknown fields or malformed ranges.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError('filters must be an object')
+    return _field_index().select(filters)
+
+
+def _label_vectors(labels: np.ndarray) -> Optional[np.ndarray]:
+    """Vectors of `labels` read without a search: full-precision file or index reconstruction (read lock held)."""
+    full = _rerank_vectors()
+    if full is not None:
+        return np.asarray(full[labels])
+    try:
+        return _index.reconstruct_batch(labels)
+    except RuntimeError:
+        # IVF 没有 direct map，无法按 id 取回向量
+        return None
+
+
+def _exact_search(q_arr: np.ndarray, vectors: np.ndarray, labels: np.ndarray, k: int):
+    """Brute-force top-k over a small filtered subset; same (D, I) layout as faiss."""
+    scores = q_arr @ vectors.T
+    top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(scores, top, axis=1), labels[top]
+
+
+def _id_selector(labels: np.ndarray, size: int):
+    """Bitmap selector over label space; returns (selector, bitmap) — keep the bitmap alive while searching."""
+    mask = np.zeros(max(size, int(labels[-1]) + 1), dtype=bool)
+    mask[labels] = True
+    bitmap = np.packbits(mask, bitorder='little')
+    return faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)), bitmap
+
+
+def _label_map() -> Dict[str, int]:
+    global _doc_labels
+    if _doc_labels is None:
+        _doc_labels = _labels_of(_meta)
+    return _doc_labels
+
+
+def _sharded(index_path: str = INDEX_FILE) -> bool:
+    """True when the default index is partitioned across shard worker processes (VEC_SHARDS)."""
+    return shard_pool.SHARD_COUNT > 0 and index_path == INDEX_FILE
+
+
+def index_info() -> Dict[str, Any]:
+    """Type, compression and size of the index loaded in this process (per shard when sharded)."""
+    if _sharded():
+        return {'shards': shard_pool.get_pool().stats()}
+    if _index is None:
+        return {'loaded': False}
+    return {'loaded': True, 'index_type': index_type_of(_index), 'compression': compression_of(_index),
+            'ntotal': int(_index.ntotal), 'rows': len(_meta), 'version': _active.get('version')}
+
+
+def _store_path(meta_path: str) -> str:
+    """Accept both the store prefix and the legacy metadata.json path."""
+    base, ext = os.path.splitext(meta_path)
+    return base if ext == '.json' else meta_path
+
+
+def _build_streaming(model, corpus: List[str], model_path: str, batch_size: int, workers: int, index_file: str,
+                     index_type: str = 'auto', memory_budget_mb: Optional[int] = None, compression: Optional[str] = 'none',
+                     progress: Optional[Callable[[int, int], None]] = None):
+    """Encode `corpus` in an EmbedPool of `workers` processes and add vectors to the index as they arrive.
+
+    Only the training sample (for IVF/PQ/SQ indexes) and the buckets in
+    flight are held in memory; full-precision vectors of compressed indexes
+    are written straight to the snapshot's vector file. Returns
+    (index, number of texts encoded by the model).
+    """
+    n = len(corpus)
+    cache = _embedding_cache()
+    keys = [content_key(_model_id, text) for text in corpus] if cache is not None else None
+    dim = cache.dim if cache is not None and cache.dim else _encode_normalized(model, corpus[:1], 1).shape[1]
+    index_type, compression = _index_choice(n, dim, index_type, memory_budget_mb, compression)
+    index = _new_ann_index(index_type, n, dim, compression)
+    vectors = index_snapshot.create_vectors(index_file, n, dim) if compression != 'none' else None
+    pool: List[parallel_embed.EmbedPool] = []
+    counts = {'done': 0, 'encoded': 0}
+
+    def stream(positions: np.ndarray):
+        """(positions, vectors) for `positions`: cache hits in chunks first, then misses from the pool."""
+        misses = []
+        for start in range(0, len(positions), STREAM_CHUNK):
+            part = positions[start:start + STREAM_CHUNK]
+            hits = cache.get_many([keys[i] for i in part]) if cache is not None else {}
+            if hits:
+                vecs = np.stack(list(hits.values()))
+                # 缓存中的 float16 向量需要重新归一化
+                norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+                norms[norms == 0] = 1
+                yield part[list(hits.keys())], np.ascontiguousarray(vecs / norms, dtype='float32')
+            misses.extend(int(part[j]) for j in range(len(part)) if j not in hits)
+        if not misses:
+            return
+        if not pool:
+            pool.append(parallel_embed.EmbedPool(model_path, workers, backend=model.name))
+        misses = np.asarray(misses, dtype='int64')
+        buckets = [misses[b] for b in parallel_embed.length_buckets([len(corpus[i]) for i in misses])]
+        for part, vecs in pool[0].encode(corpus, buckets, batch_size):
+            if cache is not None:
+                cache.put_many([keys[i] for i in part], vecs)
+            counts['encoded'] += len(part)
+            yield part, vecs
+
+    def add(positions: np.ndarray, vecs: np.ndarray):
+        index.add_with_ids(vecs, positions.astype('int64'))
+        if vectors is not None:
+            vectors[positions] = vecs
+        counts['done'] += len(positions)
+        if progress is not None:
+            progress(counts['done'], n)
+
+    try:
+        rest = np.arange(n, dtype='int64')
+        if not index.is_trained:
+            # 先编码随机样本训练量化器，样本向量训练后直接加入索引
+            sample = np.sort(np.random.default_rng(0).choice(n, min(n, TRAIN_SAMPLE), replace=False))
+            train = np.empty((len(sample), dim), dtype='float32')
+            for part, vecs in stream(sample):
+                train[np.searchsorted(sample, part)] = vecs
+            index.train(train)
+            add(sample, train)
+            del train
+            rest = np.setdiff1d(rest, sample, assume_unique=True)
+        for part, vecs in stream(rest):
+            add(part, vecs)
+        if vectors is not None:
+            index_snapshot.commit_vectors(index_file, vectors)
+    except BaseException:
+        if vectors is not None:
+            index_snapshot.discard_vectors(index_file)
+        raise
+    finally:
+        if pool:
+            pool[0].close()
+    return index, counts['encoded']
+
+
+def _lock_file(index_path: str, name: str) -> str:
+    base, _ = os.path.splitext(index_path)
+    return f'{base}.{name}.lock'
+
+
+@contextmanager
+def _writer_lock(index_path: str):
+    """Serialize writers of an index (upserts, deletes, publishing a rebuild) across threads and processes."""
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    with _write_mutex, open(_lock_file(index_path, 'write'), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+@contextmanager
+def _build_running(index_path: str):
+    """Held (shared) for the whole rebuild, so no process compacts away the delta the rebuild replays."""
+    global _builds_running
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
     with _lock:
-        global _index, _meta
-        _index = index
-        _meta = texts
-    return True
+        _builds_running += 1
+    try:
+        with open(_lock_file(index_path, 'build'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            yield
+    finally:
+        with _lock:
+            _builds_running -= 1
 
 
-def build_index_from_file(path: str, model_path: str, index_path: str = INDEX_FILE, meta_path: str = META_FILE, batch_size: int = 64):
-    """Load texts from a file (JSON or JSONL) and build index."""
+def _build_in_progress(index_path: str) -> bool:
+    if fcntl is None:
+        return _builds_running > 0
+    with open(_lock_file(index_path, 'build'), 'a+b') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+    return False
+
+
+def _delta_mark(index_path: str, meta_path: str) -> Tuple[str, int]:
+    """(index file, delta log size) of the published snapshot: where a rebuild starts."""
+    index_file = index_snapshot.resolve(index_path, _store_path(meta_path))['index_file']
+    return index_file, index_snapshot.delta_log_size(index_file)
+
+
+def _changes_since(mark: Tuple[str, int], index_path: str, meta_path: str, dim: int):
+    """Documents upserted / ids deleted in the live snapshot after `mark` (writer lock held).
+
+    Returns (docs, deleted ids), last change per document id winning.
+    """
+    index_file, offset = mark
+    ops, _ = index_snapshot.read_delta(index_file, dim, offset)
+    current = index_snapshot.resolve(index_path, _store_path(meta_path))['index_file']
+    if current != index_file:
+        # 期间另一次重建已发布，它的增量同样要带上
+        ops += index_snapshot.read_delta(current, dim)[0]
+    latest: Dict[str, Optional[Dict[str, Any]]] = {}
+    for op, _ in ops:
+        if op.get('op') == 'delete':
+            if op.get('id') is not None:
+                latest[str(op['id'])] = None
+            continue
+        row = op.get('doc')
+        if row and _is_head(row):
+            latest[str(row.get('id'))] = _document(row)
+    docs = [doc for doc in latest.values() if doc is not None]
+    return docs, [doc_id for doc_id, doc in latest.items() if doc is None]
+
+
+def build_index_from_texts(texts: List[Dict[str, Any]], model_path: str, index_path: str = INDEX_FILE, meta_path: str = META_STORE, batch_size: int = 64,
+                           index_type: str = 'auto', memory_budget_mb: Optional[int] = None, compression: Optional[str] = None,
+                           progress: Optional[Callable[[int, int], None]] = None, workers: Optional[int] = None) -> Dict[str, Any]:
+    """Build FAISS index from list of {'id','text'} dicts.
+
+    Long texts are split into overlapping sentence-aware chunks (see chunking),
+    one vector each; searches collapse chunk hits back to their document.
+    index_type: one of INDEX_TYPES, or 'auto' to choose by corpus size and memory budget.
+    compression: one of COMPRESSIONS, or 'auto' for the least lossy one within the
+        memory budget (default VEC_COMPRESSION). Compressed indexes keep the
+        full-precision vectors on disk next to the index for re-ranking.
+    progress: optional callback(done, total) over the chunks being embedded;
+        an exception raised from it aborts the build before anything is published.
+    workers: encoder processes (default VEC_BUILD_WORKERS). Above 1, texts are
+        encoded in length buckets by a parallel_embed.EmbedPool and streamed
+        into the index instead of being embedded all at once.
+
+    With VEC_SHARDS set, building the default index rebuilds every shard in
+    its worker process (progress then counts documents of finished shards).
+
+    Upserts and deletes applied to the live index while the build runs are
+    logged to its delta; they are re-applied by document id onto the new
+    snapshot right before it is published (compaction is held off meanwhile).
+
+    Returns build stats: docs, chunks, seconds, docs_per_sec, workers, and
+    encoded (texts that went through the model; parallel builds only).
+    """
+    if faiss is None:
+        raise RuntimeError("faiss is not installed")
+    t0 = time.perf_counter()
+    if _sharded(index_path):
+        shard_pool.get_pool().build(texts, model_path, progress=progress, batch_size=batch_size, index_type=index_type,
+                                    memory_budget_mb=memory_budget_mb, compression=compression)
+        seconds = time.perf_counter() - t0
+        return {'docs': len(texts), 'seconds': seconds, 'docs_per_sec': len(texts) / seconds if seconds > 0 else 0.0,
+                'workers': shard_pool.SHARD_COUNT}
+    workers = parallel_embed.BUILD_WORKERS if workers is None else workers
+    ensure_dir()
+    with _build_running(index_path):
+        # 此后写入当前快照的增量，发布前会补到新快照上
+        mark = _delta_mark(index_path, meta_path)
+        model = load_model(model_path)
+        rows, corpus = _chunk_documents(texts)
+        # 写入新版本快照（临时文件 + rename），最后原子地切换 manifest
+        store_base = _store_path(meta_path)
+        version = index_snapshot.new_version()
+        index_file, store_path = index_snapshot.snapshot_paths(index_path, store_base, version)
+        if workers > 1 and corpus:
+            index, encoded = _build_streaming(model, corpus, model_path, batch_size, workers, index_file,
+                                              index_type=index_type, memory_budget_mb=memory_budget_mb,
+                                              compression=compression or DEFAULT_COMPRESSION, progress=progress)
+        else:
+            workers, encoded = 1, None
+            emb_arr = _encode_cached(model, corpus, batch_size, progress=progress)
+            index = _build_ann_index(emb_arr, index_type=index_type, memory_budget_mb=memory_budget_mb,
+                                     compression=compression or DEFAULT_COMPRESSION)
+            if compression_of(index) != 'none':
+                index_snapshot.write_vectors(index_file, emb_arr)
+            del emb_arr
+        index_snapshot.write_index_atomic(index, index_file)
+        lexical = LexicalIndex.build((i, row.get('text', '')) for i, row in enumerate(rows))
+        lexical.save(index_snapshot.lexical_path(index_file))
+        meta = MetaStore.create(store_path, rows)
+        with _writer_lock(index_path):
+            # 构建期间写入旧快照的增量按文档 id 补到新快照上
+            missed_docs, missed_ids = _changes_since(mark, index_path, meta_path, index.d)
+            index_snapshot.publish(index_path, store_base, version)
+            # reload into memory
+            _swap_in(index, meta, lexical, mmapped=False, doc_labels=_labels_of(rows), active={
+                'index_path': index_path, 'meta_path': meta_path, 'version': version,
+                'index_file': index_file, 'store_path': store_path,
+                'signature': index_snapshot.file_signature(index_file), 'delta_offset': 0,
+            })
+            if missed_docs or missed_ids:
+                logger.info('补上重建期间的增量: %d 篇更新, %d 篇删除', len(missed_docs), len(missed_ids))
+                if missed_docs:
+                    _upsert_locked(missed_docs, model_path, batch_size)
+                if missed_ids:
+                    _delete_locked(missed_ids)
+    seconds = time.perf_counter() - t0
+    stats = {'docs': len(texts), 'chunks': len(corpus), 'encoded': encoded, 'seconds': seconds,
+             'docs_per_sec': len(texts) / seconds if seconds > 0 else 0.0, 'workers': workers}
+    logger.info('索引构建完成: %d 篇文档 / %d 个分块，用时 %.1fs，%.1f 篇/秒，%d 个编码进程',
+                stats['docs'], stats['chunks'], seconds, stats['docs_per_sec'], workers)
+    return stats
+
+
+def rebuild_shard(shard: int, texts: List[Dict[str, Any]], model_path: str, **kwargs) -> Dict[str, Any]:
+    """Rebuild one shard from the documents of `texts` routed to it; other shards keep serving.
+
+    kwargs as build_index_from_texts (batch_size, index_type, memory_budget_mb, compression).
+    """
+    if not _sharded():
+        raise RuntimeError('sharding is disabled (set VEC_SHARDS)')
+    pool = shard_pool.get_pool()
+    if not 0 <= shard < pool.count:
+        raise ValueError(f'shard must be in [0, {pool.count})')
+    return pool.rebuild_shard(shard, texts, model_path, **kwargs)
+
+
+def _read_text_file(path: str) -> List[Dict[str, Any]]:
+    """Read a text DB file stored as a JSON array or as JSONL."""
     if not os.path.exists(path):
         raise FileNotFoundError(path)
     with open(path, 'r', encoding='utf-8') as f:
@@ -93,7 +1006,117 @@ def build_index_from_file(path: str, model_path: str, index_path: str = INDEX_FI
                 data.append(json.loads(line))
             except Exception:
                 continue
-    return build_index_from_texts(data, model_path=model_path, index_path=index_path, meta_path=meta_path, batch_size=batch_size)
+    return data
+
+
+def build_index_from_file(path: str, model_path: str, index_path: str = INDEX_FILE, meta_path: str = META_STORE, batch_size: int = 64,
+                          index_type: str = 'auto', memory_budget_mb: Optional[int] = None, compression: Optional[str] = None,
+                          workers: Optional[int] = None) -> Dict[str, Any]:
+    """Load texts from a file (JSON or JSONL) and build index."""
+    data = _read_text_file(path)
+    return build_index_from_texts(data, model_path=model_path, index_path=index_path, meta_path=meta_path, batch_size=batch_size,
+                                  index_type=index_type, memory_budget_mb=memory_budget_mb, compression=compression,
+                                  workers=workers)
+
+
+def _benchmark_inputs(texts, model_path, queries, num_queries, batch_size):
+    """Corpus embeddings and query embeddings (a corpus sample when no queries are given)."""
+    model = load_model(model_path)
+    emb_arr = _encode_cached(model, [t.get('text', '') for t in texts], batch_size)
+    if queries:
+        q_arr = _encode_normalized(model, list(queries), batch_size)
+    else:
+        step = max(1, len(emb_arr) // num_queries)
+        q_arr = np.ascontiguousarray(emb_arr[::step][:num_queries])
+    return emb_arr, q_arr
+
+
+def _measure(index, q_arr: np.ndarray, truth: np.ndarray, k: int, params=None,
+             full_vectors: Optional[np.ndarray] = None, rerank_k: int = 0) -> Dict[str, float]:
+    """recall@k and per-query latency of `index`; with full_vectors, re-rank rerank_k candidates exactly."""
+    latencies = []
+    found = np.empty_like(truth)
+    fetch_k = max(k, rerank_k) if full_vectors is not None else k
+    for i in range(len(q_arr)):
+        t0 = time.perf_counter()
+        D, I = index.search(q_arr[i:i + 1], fetch_k, params=params)
+        if full_vectors is not None:
+            D, I = _rerank(q_arr[i:i + 1], D, I, full_vectors)
+        latencies.append(time.perf_counter() - t0)
+        found[i] = I[0][:k]
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(q_arr)))
+    return {
+        'recall_at_k': hits / float(len(q_arr) * k) if k else 0.0,
+        'latency_ms_mean': 1000 * float(np.mean(latencies)),
+        'latency_ms_p95': 1000 * float(np.percentile(latencies, 95)),
+    }
+
+
+def benchmark_index_types(texts: List[Dict[str, Any]], model_path: Optional[str] = None, queries: Optional[List[str]] = None,
+                          k: int = 10, index_types=INDEX_TYPES, num_queries: int = 200, batch_size: int = 64,
+                          nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Compare recall@k and per-query latency of each index family against the flat baseline.
+
+    Without explicit queries, a sample of corpus texts is used as queries.
+    """
+    if faiss is None:
+        raise RuntimeError("faiss is not installed")
+    emb_arr, q_arr = _benchmark_inputs(texts, model_path, queries, num_queries, batch_size)
+    k = min(k, len(emb_arr))
+
+    baseline = _build_ann_index(emb_arr, 'flat')
+    _, truth = baseline.search(q_arr, k)
+
+    report = []
+    for index_type in index_types:
+        row = {'index_type': index_type}
+        try:
+            t0 = time.perf_counter()
+            index = _build_ann_index(emb_arr, index_type)
+            row['build_seconds'] = time.perf_counter() - t0
+            row['index_bytes'] = int(faiss.serialize_index(index).nbytes)
+            row.update(_measure(index, q_arr, truth, k, params=_search_params(index, nprobe=nprobe, ef_search=ef_search)))
+        except Exception as e:
+            row['error'] = str(e)
+        report.append(row)
+    return report
+
+
+def benchmark_compression(texts: List[Dict[str, Any]], model_path: Optional[str] = None, queries: Optional[List[str]] = None,
+                          k: int = 10, index_type: str = 'flat', compressions=COMPRESSIONS, rerank_factor: int = RERANK_FACTOR,
+                          num_queries: int = 200, batch_size: int = 64) -> List[Dict[str, Any]]:
+    """Memory/recall trade-off of each compression mode for one index family.
+
+    Reports index size, bytes per vector, how many documents fit in 1 GiB, and
+    recall@k / latency both for the compressed scores alone and after re-ranking
+    k * rerank_factor candidates with the full-precision vectors.
+    """
+    if faiss is None:
+        raise RuntimeError("faiss is not installed")
+    emb_arr, q_arr = _benchmark_inputs(texts, model_path, queries, num_queries, batch_size)
+    n = len(emb_arr)
+    k = min(k, n)
+
+    baseline = _build_ann_index(emb_arr, 'flat')
+    _, truth = baseline.search(q_arr, k)
+
+    report = []
+    for compression in compressions:
+        row = {'index_type': index_type, 'compression': compression}
+        try:
+            index = _build_ann_index(emb_arr, index_type, compression=compression)
+            row['index_bytes'] = int(faiss.serialize_index(index).nbytes)
+            row['bytes_per_vector'] = row['index_bytes'] / float(n)
+            row['docs_per_gib'] = int(1024 ** 3 / row['bytes_per_vector'])
+            params = _search_params(index)
+            row.update(_measure(index, q_arr, truth, k, params=params))
+            if compression != 'none' and rerank_factor > 0:
+                reranked = _measure(index, q_arr, truth, k, params=params, full_vectors=emb_arr, rerank_k=k * rerank_factor)
+                row.update({key + '_rerank': value for key, value in reranked.items()})
+        except Exception as e:
+            row['error'] = str(e)
+        report.append(row)
+    return report
 
 
 def _parse_args_and_build():
@@ -104,6 +1127,14 @@ def _parse_args_and_build():
     default_model = os.getenv('SENT_MODEL_PATH') or 'models/Jerry0/text2vec-base-chinese'
     parser.add_argument('--model-path', required=False, default=default_model, help='Local text2vec model path (e.g. models/Jerry0/text2vec-base-chinese). You can also pass the model path as the first positional argument.')
     parser.add_argument('--data', default=os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'text_data', 'total.jsonl'))
+    parser.add_argument('--index-type', default='auto', choices=('auto',) + INDEX_TYPES, help='ANN index family; auto picks one by corpus size and memory budget.')
+    parser.add_argument('--memory-budget-mb', type=int, default=None, help='Memory budget used by --index-type auto (default VEC_MEMORY_BUDGET_MB).')
+    parser.add_argument('--compression', default=None, choices=('auto',) + COMPRESSIONS, help='Vector storage compression (default VEC_COMPRESSION).')
+    parser.add_argument('--benchmark', action='store_true', help='Compare recall/latency of every index type against flat instead of building.')
+    parser.add_argument('--benchmark-compression', action='store_true', help='Report memory vs. recall of every compression mode for --index-type (flat if auto).')
+    parser.add_argument('--k', type=int, default=10, help='Top-k used by --benchmark.')
+    parser.add_argument('--shard', type=int, default=None, help='With VEC_SHARDS set, rebuild only this shard.')
+    parser.add_argument('--workers', type=int, default=None, help='Encoder processes for the build (default VEC_BUILD_WORKERS; 0/1 encodes in-process).')
     # allow passing model path as first positional argument for backward compatibility
     if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
         # if user passed a positional arg, use it as model path
@@ -117,38 +1148,553 @@ def _parse_args_and_build():
     # final check
     if not args.model_path:
         raise RuntimeError('model_path is required; set --model-path or SENT_MODEL_PATH env var')
+    if args.benchmark:
+        texts = _read_text_file(args.data)
+        print(f'Benchmarking {len(texts)} docs from {args.data} (k={args.k})...')
+        for row in benchmark_index_types(texts, model_path=args.model_path, k=args.k):
+            if 'error' in row:
+                print(f"{row['index_type']:>9}: error {row['error']}")
+                continue
+            print(f"{row['index_type']:>9}: recall@{args.k}={row['recall_at_k']:.3f} "
+                  f"mean={row['latency_ms_mean']:.3f}ms p95={row['latency_ms_p95']:.3f}ms "
+                  f"size={row['index_bytes'] / 1024:.1f}KiB build={row['build_seconds']:.2f}s")
+        return
+    if args.benchmark_compression:
+        texts = _read_text_file(args.data)
+        index_type = 'flat' if args.index_type == 'auto' else args.index_type
+        print(f'Benchmarking compression of {index_type} on {len(texts)} docs from {args.data} (k={args.k})...')
+        for row in benchmark_compression(texts, model_path=args.model_path, k=args.k, index_type=index_type):
+            if 'error' in row:
+                print(f"{row['compression']:>5}: error {row['error']}")
+                continue
+            line = (f"{row['compression']:>5}: {row['bytes_per_vector']:.0f}B/vec ~{row['docs_per_gib']} docs/GiB "
+                    f"recall@{args.k}={row['recall_at_k']:.3f} mean={row['latency_ms_mean']:.3f}ms")
+            if 'recall_at_k_rerank' in row:
+                line += f" | rerank recall@{args.k}={row['recall_at_k_rerank']:.3f} mean={row['latency_ms_mean_rerank']:.3f}ms"
+            print(line)
+        return
+    if args.shard is not None:
+        print(f'Rebuilding shard {args.shard} from {args.data} using model {args.model_path}...')
+        res = rebuild_shard(args.shard, _read_text_file(args.data), args.model_path, index_type=args.index_type,
+                            memory_budget_mb=args.memory_budget_mb, compression=args.compression)
+        print(f"Shard {args.shard} rebuilt: {res.get('count')} docs.")
+        return
     print(f'Indexing from {args.data} using model {args.model_path}...')
-    build_index_from_file(args.data, args.model_path)
-    print('Index built and saved.')
+    stats = build_index_from_file(args.data, args.model_path, index_type=args.index_type, memory_budget_mb=args.memory_budget_mb,
+                                  compression=args.compression, workers=args.workers)
+    print(f"Index built and saved: {stats['docs']} docs in {stats['seconds']:.1f}s "
+          f"({stats['docs_per_sec']:.1f} docs/s, {stats['workers']} worker(s)).")
 
 
-if __name__ == '__main__':
-    _parse_args_and_build()
+def _to_id_index(idx):
+    """Wrap a legacy positional index (ids == row numbers) into an id-mapped one."""
+    if isinstance(idx, (faiss.IndexIDMap2, faiss.IndexIVF)):
+        return idx
+    id_index = _new_id_index(idx.d)
+    if idx.ntotal > 0:
+        vecs = idx.reconstruct_n(0, idx.ntotal)
+        id_index.add_with_ids(vecs, np.arange(idx.ntotal, dtype='int64'))
+    return id_index
+
+
+def _remove_label(idx, label: int) -> bool:
+    """Remove a vector by id; returns False for index types without removal (HNSW)."""
+    try:
+        idx.remove_ids(np.array([label], dtype='int64'))
+        return True
+    except RuntimeError:
+        return False
+
+
+def _replay_delta(idx, meta: MetaStore, index_file: str, start: int = 0, lexical: Optional[LexicalIndex] = None,
+                  fields: Optional[FieldIndex] = None) -> int:
+    """Apply incremental updates persisted next to the index file; returns the log offset reached.
+
+    Only in-memory state changes: metadata rows are layered over the store
+    (MetaStore.apply) and nothing is written to the shared files, since the
+    process that logged the ops has written them already. Whatever a crash
+    left only in the log is folded into the files by compact_index.
+    """
+    ops, offset = index_snapshot.read_delta(index_file, idx.d, start)
+    for op, vec in ops:
+        label = int(op['label'])
+        if op.get('op') == 'delete':
+            _remove_label(idx, label)
+            if lexical is not None:
+                lexical.remove(label)
+            meta.apply(label, None)
+            continue
+        if vec is not None:
+            _remove_label(idx, label)
+            idx.add_with_ids(vec, np.array([label], dtype='int64'))
+            if lexical is not None:
+                lexical.add(label, (op.get('doc') or {}).get('text', ''))
+        meta.apply(label, op.get('doc'))
+    _refresh_fields(fields, meta, [int(op['label']) for op, _ in ops])
+    return offset
+
+
+def _persist_delta(meta: MetaStore, index_file: str, dim: int):
+    """Write rows and full-precision vectors of the delta log into the snapshot files (writer, before clearing it)."""
+    meta.persist()
+    ops, _ = index_snapshot.read_delta(index_file, dim)
+    latest: Dict[int, np.ndarray] = {}
+    for op, vec in ops:
+        if vec is not None:
+            latest[int(op['label'])] = vec[0]
+    if latest:
+        index_snapshot.write_vector_rows(index_file, list(latest), np.asarray(list(latest.values())))
+
+
+def _read_index_file(index_file: str, allow_mmap: bool):
+    """Read an index, memory-mapped when possible; returns (index, mmapped)."""
+    if allow_mmap and MMAP_ENABLED:
+        try:
+            idx = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+            converted = _to_id_index(idx)
+            return converted, converted is idx
+        except Exception:
+            logger.warning('mmap 加载索引失败，改为完整读入: %s', index_file)
+    return _to_id_index(faiss.read_index(index_file)), False
+
+
+def _load_lexical(index_file: str, meta: MetaStore) -> LexicalIndex:
+    """Load the snapshot's lexical index, building it from metadata for snapshots that predate it."""
+    path = index_snapshot.lexical_path(index_file)
+    if os.path.exists(path):
+        try:
+            return LexicalIndex.load(path)
+        except Exception:
+            logger.warning('词法索引损坏，重新构建: %s', path)
+    lexical = LexicalIndex.build((label, item.get('text', '')) for label, item in enumerate(meta) if item is not None)
+    try:
+        lexical.save(path)
+    except OSError:
+        pass
+    return lexical
+
+
+def _swap_in(index, meta: MetaStore, lexical: Optional[LexicalIndex], mmapped: bool,
+             doc_labels: Optional[Dict[str, int]], active: Dict[str, Any]):
+    """Publish a new (index, metadata) pair; waits only for in-flight searches on the old one."""
+    global _index, _meta, _lexical, _doc_labels, _fields, _active
+    with _index_lock.write():
+        _index = index
+        _meta = meta
+        _lexical = lexical
+        _doc_labels = doc_labels
+        _fields = None
+        _active = dict(active, mmapped=mmapped, compression=compression_of(index))
 
 
-def load_index(index_path: str = INDEX_FILE, meta_path: str = META_FILE):
+def load_index(index_path: str = INDEX_FILE, meta_path: str = META_STORE):
     """Load index and metadata into memory."""
-    global _index, _meta
     ensure_dir()
     if faiss is None:
         raise RuntimeError("faiss is not installed")
-    if not os.path.exists(index_path) or not os.path.exists(meta_path):
+    files = index_snapshot.resolve(index_path, _store_path(meta_path))
+    index_file, store_path = files['index_file'], files['store_path']
+    if not os.path.exists(index_file):
+        return False
+    if not store_exists(store_path):
+        if not os.path.exists(store_path + '.json'):
+            return False
+        MetaStore.from_json(store_path + '.json', store_path)
+    signature = index_snapshot.file_signature(index_file)
+    # 有待回放的增量时需要可写的索引，不能 mmap
+    idx, mmapped = _read_index_file(index_file, allow_mmap=index_snapshot.delta_log_size(index_file) == 0)
+    meta = MetaStore(store_path)
+    # 词法索引对应的是快照本身，增量日志需要同样回放
+    lexical = _load_lexical(index_file, meta)
+    offset = _replay_delta(idx, meta, index_file, lexical=lexical)
+    _swap_in(idx, meta, lexical, mmapped=mmapped, doc_labels=None, active={
+        'index_path': index_path, 'meta_path': meta_path, 'version': files['version'],
+        'index_file': index_file, 'store_path': store_path,
+        'signature': signature, 'delta_offset': offset,
+    })
+    return True
+
+
+def _ensure_mutable():
+    """Swap a read-only mmapped index for an in-memory copy before mutating it (write lock held)."""
+    global _index
+    if not _active.get('mmapped'):
+        return
+    idx = _to_id_index(faiss.read_index(_active['index_file']))
+    _active['delta_offset'] = _replay_delta(idx, _meta, _active['index_file'])
+    _index = idx
+    _active['mmapped'] = False
+
+
+def compact_index(index_path: str = INDEX_FILE, meta_path: str = META_STORE) -> bool:
+    """Fold the incremental delta into the current snapshot's index file.
+
+    Metadata is written in place by the store, so only rows that exist just
+    in the log (a crash between the log write and the store write) are
+    written before its files are fsync'd.
+    """
+    global _lexical
+    if _index is None:
+        return False
+    if _build_in_progress(_active['index_path']):
+        # 正在进行的重建发布前要从增量日志中补齐期间的修改
+        logger.info('索引重建进行中，暂不合并增量')
+        return False
+    with _index_lock.write():
+        index_file = _active['index_file']
+        index_snapshot.write_index_atomic(_index, index_file)
+        _persist_delta(_meta, index_file, _index.d)
+        _meta.sync()
+        if _lexical is not None:
+            _lexical = _lexical.merged()
+            _lexical.save(index_snapshot.lexical_path(index_file))
+        index_snapshot.clear_delta(index_file)
+        _active['signature'] = index_snapshot.file_signature(index_file)
+        _active['delta_offset'] = 0
+    return True
+
+
+def _maybe_compact():
+    if _active and index_snapshot.delta_op_count(_active['index_file']) >= DELTA_COMPACT_THRESHOLD:
+        compact_index()
+
+
+def upsert_documents(docs: List[Dict[str, Any]], model_path: Optional[str] = None, index_path: str = INDEX_FILE, meta_path: str = META_STORE, batch_size: int = 64) -> Dict[str, Any]:
+    """Insert or update documents ({'id','text',...}) in the live index by document id.
+
+    Only documents whose text is new or changed are embedded; metadata-only changes
+    are recorded without a forward pass. Changes are appended to a delta log next
+    to the index instead of rewriting it. Writers are serialized across
+    processes and first catch up with changes logged by other processes.
+    """
+    if faiss is None:
+        return {'success': False, 'error': 'faiss not installed'}
+    if _sharded(index_path):
+        try:
+            return shard_pool.get_pool().upsert(docs, model_path, batch_size=batch_size)
+        except Exception as e:
+            return {'success': False, 'error': f'shard error: {e}'}
+    with _writer_lock(index_path):
+        if not _sync_for_write(index_path, meta_path):
+            return {'success': False, 'error': 'index not found'}
+        return _upsert_locked(docs, model_path, batch_size)
+
+
+def _sync_for_write(index_path: str, meta_path: str) -> bool:
+    """Load the index, or catch up with other processes' changes, before writing (writer lock held)."""
+    if _index is None:
+        return load_index(index_path, meta_path)
+    check_for_updates()
+    return True
+
+
+def _upsert_locked(docs: List[Dict[str, Any]], model_path: Optional[str], batch_size: int) -> Dict[str, Any]:
+    """upsert_documents on the loaded index (writer lock held)."""
+    to_embed: List[Dict[str, Any]] = []
+    meta_only: List[Dict[str, Any]] = []
+    skipped = 0
+    with _index_lock.read():
+        labels = _label_map()
+        for doc in docs:
+            if not isinstance(doc, dict) or doc.get('id') in (None, ''):
+                skipped += 1
+                continue
+            label = labels.get(str(doc.get('id')))
+            current = _document(_meta[label]) if label is not None else None
+            if current == doc:
+                skipped += 1
+            elif current is not None and current.get('text', '') == doc.get('text', ''):
+                meta_only.append(doc)
+            else:
+                to_embed.append(doc)
+
+    chunked = [chunk_text(d.get('text', '')) for d in to_embed]
+    vectors = None
+    if to_embed:
+        try:
+            model = load_model(model_path)
+            vectors = _encode_cached(model, [c for chunks in chunked for c in chunks], batch_size)
+        except Exception as e:
+            return {'success': False, 'error': f'embed error: {e}'}
+
+    ops = []
+    with _index_lock.write():
+        _ensure_mutable()
+        labels = _label_map()
+        next_label = len(_meta)
+        row = 0
+        for doc, chunks in zip(to_embed, chunked):
+            doc_id = str(doc.get('id'))
+            label = labels.get(doc_id)
+            reusable = []
+            for old in (_chunk_labels(label) if label is not None else []):
+                if _remove_label(_index, old):
+                    reusable.append(old)
+                else:
+                    # 索引不支持删除（HNSW）：旧向量留作墓碑，换新 id 写入
+                    ops.append({'op': 'delete', 'label': old, 'id': doc_id, 'doc': None})
+            new_labels = []
+            for _ in chunks:
+                if reusable:
+                    new_labels.append(reusable.pop(0))
+                else:
+                    new_labels.append(next_label)
+                    next_label += 1
+            # 分块变少时多出的旧 id 直接删除
+            for old in reusable:
+                ops.append({'op': 'delete', 'label': old, 'id': doc_id, 'doc': None})
+            labels[doc_id] = new_labels[0]
+            for new_label, chunk_row in zip(new_labels, _document_rows(doc, new_labels, chunks)):
+                _index.add_with_ids(vectors[row:row + 1], np.array([new_label], dtype='int64'))
+                ops.append({'op': 'upsert', 'label': new_label, 'row': row, 'doc': chunk_row})
+                row += 1
+        for doc in meta_only:
+            label = labels[str(doc.get('id'))]
+            head = _meta[label]
+            if '_chunk' in head:
+                doc = dict(doc, text=head['text'], _doc_text=doc.get('text', ''), _chunk=head['_chunk'])
+            ops.append({'op': 'upsert', 'label': label, 'row': None, 'doc': doc})
+        if ops:
+            # 先落盘增量日志再写元数据，崩溃后由 _replay_delta 补齐
+            _active['delta_offset'] = index_snapshot.append_delta(ops, vectors, _active['index_file'])
+            embedded = [op for op in ops if op.get('row') is not None]
+            if embedded:
+                index_snapshot.write_vector_rows(_active['index_file'], [op['label'] for op in embedded],
+                                                 vectors[[op['row'] for op in embedded]])
+            for op in ops:
+                _meta[op['label']] = op['doc']
+                if _lexical is None:
+                    continue
+                if op['op'] == 'delete':
+                    _lexical.remove(op['label'])
+                elif op.get('row') is not None:
+                    _lexical.add(op['label'], op['doc'].get('text', ''))
+            _refresh_fields(_fields, _meta, [op['label'] for op in ops])
+
+    if ops:
+        _maybe_compact()
+    return {'success': True, 'embedded': len(to_embed), 'updated': len(meta_only), 'skipped': skipped}
+
+
+def delete_documents(doc_ids: List[Any], index_path: str = INDEX_FILE, meta_path: str = META_STORE) -> Dict[str, Any]:
+    """Remove documents from the live index by document id."""
+    if faiss is None:
+        return {'success': False, 'error': 'faiss not installed'}
+    if _sharded(index_path):
+        try:
+            return shard_pool.get_pool().delete(doc_ids)
+        except Exception as e:
+            return {'success': False, 'error': f'shard error: {e}'}
+    with _writer_lock(index_path):
+        if not _sync_for_write(index_path, meta_path):
+            return {'success': False, 'error': 'index not found'}
+        return _delete_locked(doc_ids)
+
+
+def _delete_locked(doc_ids: List[Any]) -> Dict[str, Any]:
+    """delete_documents on the loaded index (writer lock held)."""
+    ops = []
+    deleted = 0
+    with _index_lock.write():
+        _ensure_mutable()
+        labels = _label_map()
+        for doc_id in doc_ids:
+            label = labels.pop(str(doc_id), None)
+            if label is None:
+                continue
+            deleted += 1
+            for chunk_label in _chunk_labels(label):
+                _remove_label(_index, chunk_label)
+                ops.append({'op': 'delete', 'label': chunk_label, 'id': str(doc_id)})
+        if ops:
+            _active['delta_offset'] = index_snapshot.append_delta(ops, None, _active['index_file'])
+            for op in ops:
+                _meta[op['label']] = None
+                if _lexical is not None:
+                    _lexical.remove(op['label'])
+            _refresh_fields(_fields, _meta, [op['label'] for op in ops])
+
+    if ops:
+        _maybe_compact()
+    return {'success': True, 'deleted': deleted}
+
+
+def index_exists(index_path: str = INDEX_FILE, meta_path: str = META_STORE) -> bool:
+    """Return True if both index and metadata files exist on disk (any shard when sharded)."""
+    if _sharded(index_path):
+        return any(index_exists(*shard_pool.shard_paths(i)) for i in range(shard_pool.SHARD_COUNT))
+    files = index_snapshot.resolve(index_path, _store_path(meta_path))
+    store_path = files['store_path']
+    return os.path.exists(files['index_file']) and (store_exists(store_path) or os.path.exists(store_path + '.json'))
+
+
+def check_for_updates() -> bool:
+    """Pick up index changes written by other processes; returns True if anything was applied.
+
+    A new snapshot version or a rewritten index file triggers a full reload and
+    swap; new delta entries are replayed onto the live index.
+    """
+    if _index is None or not _active:
+        return False
+    active = _active
+    files = index_snapshot.resolve(active['index_path'], _store_path(active['meta_path']))
+    index_file = files['index_file']
+    if index_file != active['index_file'] or index_snapshot.file_signature(index_file) != active['signature']:
+        return load_index(active['index_path'], active['meta_path'])
+    size = index_snapshot.delta_log_size(index_file)
+    if size < active['delta_offset']:
+        # 增量被其他进程合并清空
+        return load_index(active['index_path'], active['meta_path'])
+    if size == active['delta_offset']:
+        return False
+    global _doc_labels
+    with _index_lock.write():
+        _ensure_mutable()
+        _active['delta_offset'] = _replay_delta(_index, _meta, index_file, _active['delta_offset'],
+                                                lexical=_lexical, fields=_fields)
+        _doc_labels = None
+    return True
+
+
+def _watch_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            if check_for_updates():
+                logger.info('向量索引已热加载: %s', _active.get('version'))
+        except Exception:
+            logger.exception('检查向量索引更新失败')
+
+
+def start_index_watcher(interval: Optional[float] = None) -> bool:
+    """Start a daemon thread that hot-reloads the index when its files change."""
+    global _watcher
+    interval = WATCH_INTERVAL if interval is None else interval
+    if interval <= 0:
         return False
-    idx = faiss.read_index(index_path)
-    with open(meta_path, 'r', encoding='utf-8') as f:
-        meta = json.load(f)
     with _lock:
-        _index = idx
-        _meta = meta
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch_loop, args=(interval,), name='vector-index-watcher', daemon=True)
+            _watcher.start()
     return True
 
 
-def index_exists(index_path: str = INDEX_FILE, meta_path: str = META_FILE) -> bool:
-    """Return True if both index and metadata files exist on disk."""
-    return os.path.exists(index_path) and os.path.exists(meta_path)
+def _search_vectors(q_arr: np.ndarray, k: int, threshold: float = 0.0,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                    rerank: Optional[int] = None, candidates: Optional[int] = None,
+                    filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """Run one FAISS search for a matrix of query vectors; returns per-query result lists.
 
+    `candidates` is how many vectors FAISS returns before filtering and chunk
+    collapsing (default k * 3). On compressed indexes the top `rerank`
+    candidates (default k * RERANK_FACTOR) are re-scored with the
+    full-precision vectors; rerank=0 keeps approximate scores.
 
-def search(query: str, k: int = 5, model_path: Optional[str] = None, threshold: float = 0.0) -> Dict[str, Any]:
+    `filters` restricts the search to documents whose metadata match (see
+    FieldIndex.select). The matching labels come from inverted lists; up to
+    FILTER_EXACT_MAX of them are scored exactly, larger sets are passed to
+    FAISS as a bitmap selector so excluded vectors are skipped in the scan.
+    """
+    # 读锁保证 _index 与 _meta 成对，并与增量写入/热切换互斥
+    with _index_lock.read():
+        # MetaStore 的 len() 会 fstat 一次，在命中循环外只读一次
+        rows = len(_meta)
+        allowed = _filter_labels(filters)
+        if allowed is not None and not len(allowed):
+            return [[] for _ in range(len(q_arr))]
+        rerank = k * RERANK_FACTOR if rerank is None else rerank
+        full_vectors = _rerank_vectors() if rerank > 0 else None
+        # 智能调整检索数量：检索更多结果进行筛选
+        fetch_k = candidates or k * 3
+        if full_vectors is not None:
+            fetch_k = max(fetch_k, rerank)
+        search_k = min(fetch_k, _index.ntotal) if _index.ntotal > 0 else k
+        if allowed is not None:
+            search_k = min(search_k, len(allowed))
+
+        subset = _label_vectors(allowed) if allowed is not None and len(allowed) <= FILTER_EXACT_MAX else None
+        if subset is not None:
+            D, I = _exact_search(q_arr, subset, allowed, search_k)
+        else:
+            selector = bitmap = None
+            if allowed is not None:
+                selector, bitmap = _id_selector(allowed, rows)
+                if isinstance(_inner_index(_index), faiss.IndexHNSW):
+                    # 选择率低时图遍历会过早停止，按比例放宽搜索宽度
+                    ef = ef_search or _inner_index(_index).hnsw.efSearch
+                    ef_search = min(max(ef, search_k * _index.ntotal // len(allowed)), max(ef, FILTER_MAX_EF_SEARCH))
+            params = _search_params(_index, nprobe=nprobe, ef_search=ef_search, sel=selector)
+
+            # Use faiss search method - try simple approach first
+            try:
+                D, I = _index.search(q_arr, search_k, params=params)
+            except Exception:
+                # Fallback to manual allocation if the above fails
+                D = np.empty((q_arr.shape[0], search_k), dtype=np.float32)
+                I = np.empty((q_arr.shape[0], search_k), dtype=np.int64)
+                _index.search(q_arr, search_k, D, I)
+
+            if full_vectors is not None:
+                D, I = _rerank(q_arr, D, I, full_vectors)
+
+        all_results = []
+        for scores, ids in zip(D.tolist(), I.tolist()):
+            hits = [{'score': float(score), 'label': idx} for score, idx in zip(scores, ids)
+                    if 0 <= idx < rows and score >= threshold]
+            # 按相似度降序排序，分块命中合并回文档后限制结果数量
+            hits.sort(key=lambda x: x['score'], reverse=True)
+            all_results.append(_collapse_hits(hits)[:k])
+    return all_results
+
+
+def search_many(queries: List[str], k: int = 5, model_path: Optional[str] = None, threshold: float = 0.0,
+                nprobe: Optional[int] = None, ef_search: Optional[int] = None, rerank: Optional[int] = None,
+                candidates: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Batch version of `search`: one encode pass and one FAISS search for all queries.
+
+    Returns {'success': True, 'results': [[...], ...]} aligned with `queries`.
+    """
+    if faiss is None:
+        return {'success': False, 'error': 'faiss not installed'}
+    if not queries:
+        return {'success': True, 'results': []}
+
+    if not _sharded() and _index is None:
+        ok = load_index()
+        if not ok:
+            return {'success': False, 'error': 'index not found'}
+
+    try:
+        load_model(model_path)
+    except Exception as e:
+        return {'success': False, 'error': f'load_model error: {e}'}
+
+    try:
+        q_arr = _query_vectors(list(queries))
+    except Exception as e:
+        return {'success': False, 'error': f'embed error: {e}'}
+
+    if _sharded():
+        # 查询只编码一次，向量分发到各分片并行检索后按得分合并
+        try:
+            results = shard_pool.get_pool().search_many(q_arr, k, threshold=threshold, nprobe=nprobe, ef_search=ef_search,
+                                                        rerank=rerank, candidates=candidates, filters=filters)
+        except ValueError as e:
+            return {'success': False, 'error': f'invalid filters: {e}'}
+        except Exception as e:
+            return {'success': False, 'error': f'shard error: {e}'}
+        return {'success': True, 'results': results}
+    try:
+        results = _search_vectors(q_arr, k, threshold, nprobe=nprobe, ef_search=ef_search,
+                                  rerank=rerank, candidates=candidates, filters=filters)
+    except ValueError as e:
+        return {'success': False, 'error': f'invalid filters: {e}'}
+    return {'success': True, 'results': results}
+
+
+def search(query: str, k: int = 5, model_path: Optional[str] = None, threshold: float = 0.0,
+           nprobe: Optional[int] = None, ef_search: Optional[int] = None, rerank: Optional[int] = None,
+           candidates: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Search the vector DB using `text2vec.SentenceModel` for embeddings.
 
     Args:
@@ -156,119 +1702,280 @@ def search(query: str, k: int = 5, model_path: Optional[str] = None, threshold:
         k: Number of results to return
         model_path: Path to the embedding model
         threshold: Minimum similarity score threshold (0.0-1.0)
+        nprobe: IVF lists to visit for this request (IVF indexes only)
+        ef_search: HNSW search breadth for this request (HNSW indexes only)
+        rerank: Candidates re-scored with full-precision vectors (compressed indexes only; 0 disables)
+        candidates: Vectors fetched from the index before filtering (default k * 3)
+        filters: Metadata predicates, e.g. {'source': 'memory', 'defect': ['短路', '开路'],
+            'created_at': {'gte': '2024-01-01'}}; fields are ANDed, list values ORed
+    """
+    res = search_many([query], k=k, model_path=model_path, threshold=threshold, nprobe=nprobe, ef_search=ef_search,
+                      rerank=rerank, candidates=candidates, filters=filters)
+    if not res.get('success'):
+        return res
+    return {'success': True, 'results': res['results'][0]}
+
+
+HYBRID_MODES = ('hybrid', 'lexical', 'vector')
+
+
+def _lexical_search(query: str, n: int, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    if _sharded():
+        return shard_pool.get_pool().lexical_search(query, n, filters)
+    with _index_lock.read():
+        if _lexical is None:
+            return []
+        allowed = _filter_labels(filters)
+        hits = [{'label': label, 'score': score, 'coverage': coverage}
+                for label, score, coverage in _lexical.search(query, n, allowed=allowed)]
+        return _collapse_hits(hits)
+
+
+def _doc_key(item: Dict[str, Any]) -> str:
+    return str(item.get('id', item.get('text', '')))
+
+
+def search_hybrid(query: str, k: int = 5, model_path: Optional[str] = None, threshold: float = 0.0,
+                  nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  candidates: Optional[int] = None, mode: str = 'hybrid',
+                  filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Character n-gram BM25 and vector search fused by reciprocal rank (RRF).
+
+    mode: 'hybrid', 'lexical' (no model forward pass) or 'vector'. In hybrid mode
+    the vector pass is skipped when at least k documents contain every query
+    term. Each result carries the fused 'score' (1.0 = ranked first by both
+    lists) plus 'vector_score' / 'lexical_score', None when absent from a list.
+    The response's 'mode' says which lists were used. `filters` applies to
+    both lists (see `search`).
     """
     if faiss is None:
         return {'success': False, 'error': 'faiss not installed'}
-
-    if _index is None:
+    if mode not in HYBRID_MODES:
+        return {'success': False, 'error': f'unknown mode: {mode}'}
+    if not _sharded() and _index is None:
         ok = load_index()
         if not ok:
             return {'success': False, 'error': 'index not found'}
 
+    n = max(candidates or HYBRID_CANDIDATES, k)
     try:
-        model = load_model(model_path)
-    except Exception as e:
-        return {'success': False, 'error': f'load_model error: {e}'}
+        lexical = _lexical_search(query, n, filters) if mode != 'vector' else []
+    except ValueError as e:
+        return {'success': False, 'error': f'invalid filters: {e}'}
+    full_matches = sum(1 for r in lexical if r['coverage'] >= 1.0)
+    vector: List[Dict[str, Any]] = []
+    used = mode
+    if mode == 'vector' or (mode == 'hybrid' and not (LEXICAL_SHORTCUT and full_matches >= k)):
+        res = search(query, k=n, model_path=model_path, threshold=threshold, nprobe=nprobe, ef_search=ef_search,
+                     candidates=n, filters=filters)
+        if res.get('success'):
+            vector = res['results']
+        elif not lexical:
+            return res
+        else:
+            # 模型不可用时退化为纯词法检索
+            logger.warning('向量检索失败，仅使用词法结果: %s', res.get('error'))
+            used = 'lexical'
+    elif mode == 'hybrid':
+        used = 'lexical'
+
+    fused: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    for field, ranked in (('vector_score', vector), ('lexical_score', lexical)):
+        for rank, r in enumerate(ranked):
+            entry = fused.setdefault(_doc_key(r['item']), {'rrf': 0.0, 'item': r['item'], 'vector_score': None,
+                                                           'lexical_score': None, 'chunk': r.get('chunk')})
+            entry['rrf'] += 1.0 / (RRF_K + rank + 1)
+            entry[field] = r['score']
+    ranked = sorted(fused.values(), key=lambda e: e['rrf'], reverse=True)[:k]
+    scale = (RRF_K + 1) / 2.0
+
+    hybrid_stats['queries'] += 1
+    if mode == 'hybrid' and used == 'lexical':
+        hybrid_stats['lexical_only'] += 1
+    return {
+        'success': True,
+        'mode': used,
+        'results': [dict({'score': e['rrf'] * scale, 'item': e['item'],
+                          'vector_score': e['vector_score'], 'lexical_score': e['lexical_score']},
+                         **({'chunk': e['chunk']} if e['chunk'] is not None else {})) for e in ranked],
+    }
+
+
+# search_enhanced：一次检索 k * 该倍数个候选，再做向量化重打分和 MMR 多样化
+ENHANCED_CANDIDATE_FACTOR = int(os.getenv('VEC_ENHANCED_CANDIDATE_FACTOR', '4'))
+# MMR 中相关性的权重，1.0 表示不做多样化
+MMR_LAMBDA = float(os.getenv('VEC_MMR_LAMBDA', '0.7'))
+# 与已选结果余弦相似度不低于该值的候选视为近重复，直接丢弃
+MMR_DUP_THRESHOLD = float(os.getenv('VEC_MMR_DUP_THRESHOLD', '0.95'))
+
+_SOLUTION_RE = re.compile('解决方案|解决方法|可采取|优化|调整')
+
+
+def _passage_labels(results: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """Index labels of the matched passages, or None if any of them is no longer in the index (read lock held)."""
+    labels = []
+    for r in results:
+        label = _label_map().get(str(r['item'].get('id')))
+        if label is None or _meta[label] is None:
+            return None
+        text = r.get('chunk') or r['item'].get('text', '')
+        # 分块文档按命中片段的文本找回对应的块；文本不一致说明索引已被替换
+        label = next((c for c in _chunk_labels(label) if _meta[c] is not None and _meta[c].get('text', '') == text), None)
+        if label is None:
+            return None
+        labels.append(label)
+    return np.asarray(labels, dtype='int64')
+
+
+def _passage_vectors(results: List[Dict[str, Any]], model_path: Optional[str]) -> Optional[np.ndarray]:
+    """Normalized embeddings of the matched passages.
 
+    Vectors are read from the loaded index by label (full-precision file for
+    compressed indexes, reconstruction otherwise); passages the index can't
+    return, e.g. sharded or IVF without direct map, are re-encoded.
+    """
+    if not _sharded():
+        with _index_lock.read():
+            labels = _passage_labels(results) if _index is not None else None
+            vectors = _label_vectors(labels) if labels is not None else None
+        if vectors is not None:
+            return np.asarray(vectors, dtype='float32')
     try:
-        q_emb = model.encode([query], batch_size=1)
+        model = load_model(model_path)
+        texts = [r.get('chunk') or r['item'].get('text', '') for r in results]
+        return _encode_cached(model, texts, batch_size=len(texts))
     except Exception as e:
-        return {'success': False, 'error': f'embed error: {e}'}
+        logger.warning('获取候选向量失败，跳过 MMR: %s', e)
+        return None
 
-    # Ensure q_emb is a numpy array with correct dtype
-    q_arr = np.asarray(q_emb, dtype='float32')
-    if q_arr.ndim == 1:
-        q_arr = q_arr.reshape(1, -1)
 
-    # Normalize using numpy (faiss.normalize_L2 has issues)
-    norms = np.linalg.norm(q_arr, axis=1, keepdims=True)
-    norms[norms == 0] = 1  # Avoid division by zero
-    q_arr = q_arr / norms
+def _candidate_similarity(query: str, results: List[Dict[str, Any]], vectors: Optional[np.ndarray],
+                          model_path: Optional[str]) -> Optional[np.ndarray]:
+    """Cosine similarity of each candidate to the query, or None when no embedding is available.
 
-    # Ensure array is contiguous for faiss
-    q_arr = np.ascontiguousarray(q_arr)
+    Vector hits carry it as their score ('vector_score' in hybrid results);
+    candidates found only by the lexical list get it from their passage vector.
+    """
+    sims = np.array([r['score'] if 'vector_score' not in r else
+                     (np.nan if r['vector_score'] is None else r['vector_score']) for r in results], dtype='float32')
+    missing = np.isnan(sims)
+    if not missing.any():
+        return sims
+    if vectors is None:
+        return None
+    try:
+        load_model(model_path)
+        q = _query_vectors([query])[0]
+    except Exception as e:
+        logger.warning('查询向量不可用，按融合得分排序: %s', e)
+        return None
+    sims[missing] = vectors[missing] @ q
+    return sims
 
-    # 智能调整检索数量：检索更多结果进行筛选
-    search_k = min(k * 3, len(_meta)) if len(_meta) > 0 else k
 
-    # Use faiss search method - try simple approach first
-    try:
-        D, I = _index.search(q_arr, search_k)
-    except Exception:
-        # Fallback to manual allocation if the above fails
-        D = np.empty((q_arr.shape[0], search_k), dtype=np.float32)
-        I = np.empty((q_arr.shape[0], search_k), dtype=np.int64)
-        _index.search(q_arr, search_k, D, I)
+def _mmr(relevance: np.ndarray, vectors: np.ndarray, k: int, lam: float, dup_threshold: float) -> List[int]:
+    """Greedy maximal marginal relevance over candidate embeddings; returns picked indices in order."""
+    sims = vectors @ vectors.T
+    available = np.ones(len(relevance), dtype=bool)
+    redundancy = np.zeros(len(relevance), dtype='float32')
+    picked: List[int] = []
+    while len(picked) < k and available.any():
+        gain = np.where(available, lam * relevance - (1.0 - lam) * redundancy, -np.inf)
+        i = int(np.argmax(gain))
+        picked.append(i)
+        available[i] = False
+        redundancy = np.maximum(redundancy, sims[i])
+        available &= sims[i] < dup_threshold
+    return picked
 
-    results = []
-    for score, idx in zip(D[0].tolist(), I[0].tolist()):
-        if 0 <= idx < len(_meta) and score >= threshold:
-            item = _meta[idx]
-            results.append({'score': float(score), 'item': item})
 
-    # 按相似度降序排序并限制结果数量
-    results.sort(key=lambda x: x['score'], reverse=True)
-    results = results[:k]
+def search_enhanced(query: str, k: int = 5, model_path: Optional[str] = None,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                    hybrid: Optional[bool] = None, candidates: Optional[int] = None,
+                    mmr_lambda: Optional[float] = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Enhanced search with intelligent query expansion and filtering.
 
-    return {'success': True, 'results': results}
+    One retrieval call fetches `candidates` documents (default
+    k * VEC_ENHANCED_CANDIDATE_FACTOR); exact duplicates are dropped, quality
+    boosts are applied as array operations, and the top k are picked by
+    maximal marginal relevance so near-duplicate passages don't crowd it.
 
+    Each result's 'similarity' is the cosine similarity to the query and
+    'score' the boosted value used for ranking, in either retrieval mode.
+    Only when no embedding is available (lexical fallback) do they fall
+    back to the fused rank score, with 'similarity' None.
 
-def search_enhanced(query: str, k: int = 5, model_path: Optional[str] = None) -> Dict[str, Any]:
-    """Enhanced search with intelligent query expansion and filtering."""
+    hybrid: gather candidates from lexical and vector rankings (default
+        VEC_HYBRID); False skips the lexical list.
+    mmr_lambda: relevance weight in MMR (default VEC_MMR_LAMBDA; 1.0 disables).
+    filters: metadata predicates applied inside retrieval (see `search`).
+    """
     if faiss is None:
         return {'success': False, 'error': 'faiss not installed'}
 
-    # 基本搜索
-    base_results = search(query, k=k*2, model_path=model_path, threshold=0.1)
+    hybrid = HYBRID_ENABLED if hybrid is None else hybrid
+    lam = MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    n = max(candidates or k * ENHANCED_CANDIDATE_FACTOR, k)
+    # 基本搜索：单次检索，显式指定候选数量
+    if hybrid:
+        base_results = search_hybrid(query, k=n, model_path=model_path, threshold=0.1, nprobe=nprobe, ef_search=ef_search,
+                                     candidates=n, filters=filters)
+    else:
+        base_results = search(query, k=n, model_path=model_path, threshold=0.1, nprobe=nprobe, ef_search=ef_search,
+                              candidates=n, filters=filters)
 
     if not base_results.get('success'):
         return base_results
 
     results = base_results['results']
 
-    # 智能筛选和重新排序
-    filtered_results = []
-    seen_texts = set()
-
+    # 去重：完全相同的文本只保留得分最高的一条（结果已按得分降序）
+    unique: Dict[str, Dict[str, Any]] = {}
     for result in results:
-        item = result['item']
-        text = item.get('text', '').strip()
-
-        # 去重：避免相似文本重复
-        if text in seen_texts:
-            continue
-        seen_texts.add(text)
-
-        # 基于内容质量的评分调整
-        score = result['score']
-        text_len = len(text)
+        unique.setdefault(result['item'].get('text', '').strip(), result)
+    candidates_list = list(unique.values())
+    texts = list(unique.keys())
 
-        # 偏好中等长度的文本（太短可能信息不足，太长可能包含无关信息）
-        if 50 <= text_len <= 500:
-            score *= 1.1
-        elif text_len < 30:
-            score *= 0.8
+    final_results = []
+    if candidates_list:
+        # 基于内容质量的评分调整：偏好中等长度、包含具体解决方案的文本
+        lengths = np.array([len(t) for t in texts])
+        boost = np.where((lengths >= 50) & (lengths <= 500), 1.1, np.where(lengths < 30, 0.8, 1.0))
+        boost = boost * np.where([_SOLUTION_RE.search(t) is not None for t in texts], 1.05, 1.0)
 
-        # 偏好包含具体解决方案的文本
-        if any(keyword in text for keyword in ['解决方案', '解决方法', '可采取', '优化', '调整']):
-            score *= 1.05
+        # 只有词法命中的候选没有余弦相似度，需要其向量补算
+        lexical_only = any(r.get('vector_score', 0.0) is None for r in candidates_list)
+        use_mmr = lam < 1.0 and len(candidates_list) > 1
+        vectors = _passage_vectors(candidates_list, model_path) if use_mmr or lexical_only else None
+        # 排序和 MMR 的相关性都用余弦相似度；融合得分是名次的函数，与向量间的相似度不可比
+        similarity = _candidate_similarity(query, candidates_list, vectors, model_path)
+        scores = similarity if similarity is not None else np.array([r['score'] for r in candidates_list],
+                                                                    dtype='float32')
+        adjusted = scores * boost.astype('float32')
 
-        filtered_results.append({
-            'score': score,
-            'item': item,
-            'relevance_boost': score > result['score']
-        })
-
-    # 重新排序
-    filtered_results.sort(key=lambda x: x['score'], reverse=True)
-    final_results = filtered_results[:k]
+        if vectors is not None and use_mmr:
+            picked = _mmr(adjusted, vectors, k, lam, MMR_DUP_THRESHOLD)
+        else:
+            picked = np.argsort(-adjusted, kind='stable')[:k].tolist()
+        for i in picked:
+            result = {'score': float(adjusted[i]), 'similarity': float(scores[i]) if similarity is not None else None,
+                      'item': candidates_list[i]['item']}
+            if candidates_list[i].get('chunk'):
+                result['chunk'] = candidates_list[i]['chunk']
+            final_results.append(result)
 
     return {
         'success': True,
-        'results': [{'score': r['score'], 'item': r['item']} for r in final_results],
+        'results': final_results,
         'stats': {
             'total_found': len(results),
             'filtered': len(final_results),
-            'avg_score': sum(r['score'] for r in final_results) / len(final_results) if final_results else 0
+            'avg_score': sum(r['score'] for r in final_results) / len(final_results) if final_results else 0,
+            'mode': base_results.get('mode', 'vector'),
+            'candidates': n,
         }
     }
+
+
+if __name__ == '__main__':
+    _parse_args_and_build()
@@ -0,0 +1,43 @@
+import os
+import sys
+import hashlib
+import tempfile
+
+import numpy as np
+import pytest
+
+# 导入 services.llmkg 会创建 Neo4j 服务对象，测试中不连接数据库
+os.environ.setdefault('NEO4J_URI', 'bolt://localhost:7687')
+os.environ.setdefault('NEO4J_USER', 'neo4j')
+os.environ.setdefault('NEO4J_PASSWORD', 'test')
+os.environ['KG_SKIP_CONNECT'] = '1'
+# 这些路径在模块导入时读取，指向临时目录，避免写入 backend/data
+os.environ['KG_JOB_DIR'] = tempfile.mkdtemp(prefix='kg-jobs-')
+os.environ['VEC_EMBED_CACHE_DIR'] = tempfile.mkdtemp(prefix='kg-embed-')
+os.environ.pop('VEC_SHARDS', None)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class HashEmbedder:
+    """Deterministic stand-in for the sentence model: hashed character bigrams, 64 dims."""
+
+    dim = 64
+    model_id = 'hash-bigram-64'
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        self.calls += len(texts)
+        out = np.full((len(texts), self.dim), 0.01, dtype='float32')
+        for row, text in enumerate(texts):
+            for i in range(len(text) - 1):
+                h = int(hashlib.md5(text[i:i + 2].encode('utf-8')).hexdigest(), 16)
+                out[row, h % self.dim] += 1
+        return out
+
+
+@pytest.fixture
+def hash_model():
+    return HashEmbedder()
@@ -0,0 +1,172 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from services.llmkg import job_runner as jr
+
+
+@pytest.fixture(autouse=True)
+def job_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(jr, 'JOB_DIR', str(tmp_path))
+    monkeypatch.setattr(jr, 'JOB_TABLE', str(tmp_path / 'jobs.json'))
+    monkeypatch.setattr(jr, 'JOB_LOCK', str(tmp_path / 'jobs.lock'))
+    monkeypatch.setattr(jr, 'JOB_OUTPUT_DIR', str(tmp_path / 'output'))
+    monkeypatch.setattr(jr, 'JOB_SAVE_INTERVAL', 0.0)
+    return tmp_path
+
+
+def _wait(job_id, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jr.get_job(job_id)
+        if job['status'] in jr.FINAL_STATES:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def _blocking_job(started, release):
+    def fn(ctx):
+        started.set()
+        done = 0
+        while not release.is_set():
+            done += 1
+            ctx.progress(done, 1000, stage='working')
+            time.sleep(0.01)
+        return {'done': done}
+    return fn
+
+
+def test_job_succeeds_with_result_and_progress():
+    def fn(ctx, n):
+        for i in range(n):
+            ctx.progress(i + 1, n)
+        return {'n': n}
+
+    res = jr.submit_job('count', fn, {'n': 3})
+    assert res['success'] and not res['duplicate']
+    job = _wait(res['job']['id'])
+    assert job['status'] == 'succeeded'
+    assert job['result'] == {'n': 3}
+    assert job['progress']['done'] == 3 and job['progress']['percent'] == 100.0
+    assert job['params'] == {'n': 3}
+
+
+def test_failed_job_records_error():
+    def fn(ctx):
+        raise RuntimeError('boom')
+
+    job = _wait(jr.submit_job('fail', fn)['job']['id'])
+    assert job['status'] == 'failed' and job['error'] == 'boom'
+
+
+def test_duplicate_key_returns_active_job():
+    started, release = threading.Event(), threading.Event()
+    first = jr.submit_job('build', _blocking_job(started, release), key='build:main')
+    try:
+        started.wait(5)
+        second = jr.submit_job('build', _blocking_job(threading.Event(), release), key='build:main')
+        assert second['duplicate'] and second['job']['id'] == first['job']['id']
+    finally:
+        release.set()
+    assert _wait(first['job']['id'])['status'] == 'succeeded'
+    third = jr.submit_job('build', lambda ctx: None, key='build:main')
+    assert not third['duplicate']
+    _wait(third['job']['id'])
+
+
+def test_cancel_running_job():
+    started, release = threading.Event(), threading.Event()
+    job_id = jr.submit_job('build', _blocking_job(started, release))['job']['id']
+    try:
+        assert started.wait(5)
+        assert jr.cancel_job(job_id)['success']
+        assert _wait(job_id)['status'] == 'cancelled'
+    finally:
+        release.set()
+    again = jr.cancel_job(job_id)
+    assert not again['success'] and again['error'] == 'job already cancelled'
+    assert jr.cancel_job('missing') == {'success': False, 'error': 'job not found'}
+
+
+@pytest.mark.skipif(jr.fcntl is None, reason='cross-process table needs fcntl')
+def test_cancel_requested_by_another_process():
+    started, release = threading.Event(), threading.Event()
+    job_id = jr.submit_job('build', _blocking_job(started, release))['job']['id']
+    try:
+        assert started.wait(5)
+        # 另一个进程只在任务表中记录取消请求
+        script = (
+            'import fcntl, json, sys\n'
+            'table, lock, job_id = sys.argv[1:]\n'
+            'with open(lock, "a+b") as l:\n'
+            '    fcntl.flock(l.fileno(), fcntl.LOCK_EX)\n'
+            '    jobs = json.load(open(table))\n'
+            '    for job in jobs:\n'
+            '        if job["id"] == job_id:\n'
+            '            job["cancel_requested"] = True\n'
+            '    json.dump(jobs, open(table, "w"))\n'
+        )
+        subprocess.run([sys.executable, '-c', script, jr.JOB_TABLE, jr.JOB_LOCK, job_id], check=True)
+        assert _wait(job_id)['status'] == 'cancelled'
+    finally:
+        release.set()
+
+
+@pytest.mark.skipif(jr.fcntl is None, reason='owner liveness needs fcntl')
+def test_jobs_of_dead_owner_are_marked_failed():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    row = {'id': 'orphan', 'kind': 'build', 'key': 'build', 'queue': 'default', 'status': 'running',
+           'owner': f'{proc.pid}:deadbeef', 'params': {}, 'progress': {'done': 1, 'total': 10, 'stage': None},
+           'created_at': time.time(), 'started_at': time.time(), 'finished_at': None, 'updated_at': time.time(),
+           'result': None, 'error': None}
+    with open(jr.JOB_TABLE, 'w', encoding='utf-8') as f:
+        json.dump([row], f)
+
+    job = jr.get_job('orphan')
+    assert job['status'] == 'failed' and job['error'] == 'interrupted by restart'
+    # 死掉的任务不再占用 key
+    res = jr.submit_job('build', lambda ctx: None)
+    assert not res['duplicate']
+    _wait(res['job']['id'])
+
+
+def test_output_is_streamed_to_a_file(job_dir):
+    started, release = threading.Event(), threading.Event()
+
+    def fn(ctx):
+        ctx.output('你好')
+        ctx.output('你好，世界')
+        started.set()
+        release.wait(5)
+        ctx.output('重写')
+        return 'ok'
+
+    job_id = jr.submit_job('summarize', fn, queue='llm')['job']['id']
+    assert started.wait(5)
+    text, offset = jr.read_output(job_id)
+    assert text == '你好，世界'
+    assert jr.read_output(job_id, offset) == ('', offset)
+    assert 'output' not in jr.list_jobs(kind='summarize')[0]
+    release.set()
+    job = _wait(job_id)
+    assert job['output'] == '重写'
+    assert jr.get_job(job_id, with_output=False).get('output') is None
+    # 任务表只保存状态，输出在单独的文件中
+    with open(jr.JOB_TABLE, 'r', encoding='utf-8') as f:
+        assert '你好' not in f.read()
+    assert os.path.exists(os.path.join(jr.JOB_OUTPUT_DIR, f'{job_id}.txt'))
+
+
+def test_read_output_holds_back_partial_characters(job_dir):
+    os.makedirs(jr.JOB_OUTPUT_DIR)
+    with open(os.path.join(jr.JOB_OUTPUT_DIR, 'x.txt'), 'wb') as f:
+        f.write('ab中'.encode('utf-8')[:-1])
+    assert jr.read_output('x') == ('ab', 2)
+    assert jr.read_output('missing', 5) == ('', 5)
@@ -0,0 +1,154 @@
+import json
+import threading
+
+import pytest
+
+from services.llmkg import session_service as ss
+from services.llmkg import storage
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def backend(request, tmp_path, monkeypatch):
+    sessions_dir = tmp_path / 'sessions'
+    monkeypatch.setattr(ss, 'SESSIONS_DIR', str(sessions_dir))
+    monkeypatch.setattr(ss, 'schedule_summary', lambda session_id: None)
+    monkeypatch.setattr(storage, 'BACKEND', request.param)
+    if request.param == 'sqlite':
+        path = str(tmp_path / 'kg.sqlite3')
+        monkeypatch.setattr(storage, 'SQLITE_PATH', path)
+        monkeypatch.setattr(storage, '_dbs', {})
+        # 只迁移测试目录中的文件，不读取 backend/data
+        storage.migrate(storage.SQLiteDB(path), sessions_dir=str(sessions_dir),
+                        memory_file=str(tmp_path / 'memories.jsonl'), text_db_file=str(tmp_path / 'total.jsonl'))
+    return request.param
+
+
+def _msgs(start, n):
+    return [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'm{i}'} for i in range(start, start + n)]
+
+
+def _contents(messages):
+    return [m['content'] for m in messages]
+
+
+def test_append_checks_expected_seq(backend):
+    ss.create_session('s1')
+    assert ss.append_session_messages('s1', _msgs(0, 2), expected_seq=0) == {'success': True, 'seq': 2}
+    conflict = ss.append_session_messages('s1', _msgs(2, 2), expected_seq=1)
+    assert not conflict['success'] and conflict['conflict'] and conflict['seq'] == 2
+    assert ss.append_session_messages('s1', _msgs(2, 2), expected_seq=2)['seq'] == 4
+    assert ss.append_session_messages('s1', [], expected_seq=4) == {'success': True, 'seq': 4}
+    assert _contents(ss.load_session_messages('s1')) == ['m0', 'm1', 'm2', 'm3']
+    assert ss.get_session_info('s1')['messageCount'] == 4
+
+    missing = ss.append_session_messages('nope', _msgs(0, 1))
+    assert not missing['success'] and missing['not_found']
+
+
+def test_concurrent_appends_with_same_seq_conflict(backend):
+    ss.create_session('s1')
+    results = []
+    barrier = threading.Barrier(4)
+
+    def append(i):
+        barrier.wait()
+        results.append(ss.append_session_messages('s1', [{'role': 'user', 'content': f't{i}'}], expected_seq=0))
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(1 for r in results if r['success']) == 1
+    assert all(r['conflict'] and r['seq'] == 1 for r in results if not r['success'])
+    assert len(ss.load_session_messages('s1')) == 1
+
+
+def test_page_walks_back_from_the_end(backend):
+    ss.create_session('s1')
+    for start in range(0, 25, 5):
+        ss.append_session_messages('s1', _msgs(start, 5))
+    page = ss.load_session_page('s1', 10)
+    assert (page['start'], page['end'], page['total'], page['next_before']) == (15, 25, 25, 15)
+    assert _contents(page['messages']) == [f'm{i}' for i in range(15, 25)]
+
+    seen = page['messages']
+    while page['next_before'] is not None:
+        page = ss.load_session_page('s1', 10, before=page['next_before'])
+        seen = page['messages'] + seen
+    assert page['start'] == 0 and page['end'] == 5
+    assert _contents(seen) == [f'm{i}' for i in range(25)]
+    assert ss.load_session_page('missing', 10) is None
+
+
+def test_save_rewrites_messages(backend):
+    ss.create_session('s1')
+    ss.append_session_messages('s1', _msgs(0, 4))
+    assert ss.save_session_messages('s1', _msgs(10, 2))
+    assert _contents(ss.load_session_messages('s1')) == ['m10', 'm11']
+    assert ss.append_session_messages('s1', _msgs(12, 1), expected_seq=2)['seq'] == 3
+
+
+def test_answer_context_fills_history_before_the_client_window(backend, monkeypatch):
+    monkeypatch.setattr(ss, 'ROLLING_SUMMARY', True)
+    ss.create_session('s1')
+    ss.append_session_messages('s1', _msgs(0, 10))
+    window = _msgs(6, 4)
+
+    summary, messages = ss.answer_context('s1', window, messages_start=6)
+    assert summary is None
+    assert _contents(messages) == [f'm{i}' for i in range(10)]
+
+    assert ss._store_summary('s1', {'text': 'earlier', 'upto': 4}, 0)
+    summary, messages = ss.answer_context('s1', window, messages_start=6)
+    assert summary == 'earlier'
+    assert _contents(messages) == [f'm{i}' for i in range(4, 10)]
+
+    # 客户端已加载的消息都在总结之后时原样发送
+    summary, messages = ss.answer_context('s1', _msgs(0, 10), messages_start=0)
+    assert _contents(messages) == [f'm{i}' for i in range(4, 10)]
+
+
+def test_file_reads_skip_bad_lines_without_rewriting(backend):
+    if backend != 'file':
+        pytest.skip('JSONL files only')
+    ss.create_session('s1')
+    ss.append_session_messages('s1', _msgs(0, 3))
+    path = ss.get_session_file_path('s1')
+    with open(path, 'ab') as f:
+        f.write(b'not json\n[1, 2]\n{"role": "user", "cont')
+    with open(path, 'rb') as f:
+        before = f.read()
+
+    page = ss.load_session_page('s1', 10)
+    assert _contents(page['messages']) == ['m0', 'm1', 'm2'] and page['total'] == 3
+    with open(path, 'rb') as f:
+        assert f.read() == before
+
+    # 追加时持锁修复：丢弃无效行和不完整的尾行
+    assert ss.append_session_messages('s1', _msgs(3, 1), expected_seq=3) == {'success': True, 'seq': 4}
+    with open(path, 'r', encoding='utf-8') as f:
+        assert [json.loads(line)['content'] for line in f] == ['m0', 'm1', 'm2', 'm3']
+    assert _contents(ss.load_session_page('s1', 2)['messages']) == ['m2', 'm3']
+
+
+def test_sqlite_migrates_file_sessions(tmp_path, monkeypatch):
+    sessions_dir = tmp_path / 'sessions'
+    monkeypatch.setattr(ss, 'SESSIONS_DIR', str(sessions_dir))
+    monkeypatch.setattr(ss, 'schedule_summary', lambda session_id: None)
+    monkeypatch.setattr(storage, 'BACKEND', 'file')
+    ss.create_session('s1', title='旧会话')
+    ss.append_session_messages('s1', _msgs(0, 3))
+
+    db = storage.SQLiteDB(str(tmp_path / 'kg.sqlite3'))
+    kwargs = {'sessions_dir': str(sessions_dir), 'memory_file': str(tmp_path / 'memories.jsonl'),
+              'text_db_file': str(tmp_path / 'total.jsonl')}
+    result = storage.migrate(db, **kwargs)
+    assert result['migrated'] and result['sessions'] == 1 and result['session_messages'] == 3
+    # 只迁移一次
+    assert not storage.migrate(db, **kwargs)['migrated']
+
+    sessions = storage.SQLiteSessions(db)
+    assert sessions.info('s1')['title'] == '旧会话'
+    assert _contents(sessions.messages('s1')) == ['m0', 'm1', 'm2']
+    assert sessions.append_messages('s1', _msgs(3, 1), expected_seq=3)['seq'] == 4
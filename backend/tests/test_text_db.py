@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from services.llmkg import storage
+from services.llmkg.text_db import TextDB
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'total.jsonl')
+
+
+def _lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_append_allocates_unique_ids(path):
+    db = TextDB(path)
+    docs = db.append_many([{'text': 'a'}, {'id': '5', 'text': 'b'}, {'id': '5', 'text': 'c'}])
+    assert [d['id'] for d in docs] == ['1', '5', '2']
+    assert len(db) == 3
+    assert '5' in db
+
+    # 新实例从已有的最大数字 id 之后继续分配，已分配的 id 持久化在 .ids 中
+    again = TextDB(path)
+    assert again.allocate_id() == '6'
+    assert TextDB(path).append({'text': 'd'})['id'] == '7'
+
+
+def test_torn_tail_is_truncated_and_kept(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'id': '1', 'text': 'a'}) + '\n')
+        f.write('{"id": "2", "te')
+    db = TextDB(path)
+    assert [d['id'] for d in db.documents()] == ['1']
+    with open(path + '.torn', 'r', encoding='utf-8') as f:
+        assert f.read() == '{"id": "2", "te\n'
+
+    db.append({'id': '3', 'text': 'c'})
+    assert [d['id'] for d in _lines(path)] == ['1', '3']
+
+
+def test_complete_last_line_without_newline_is_kept(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'id': '1', 'text': 'a'}) + '\n' + json.dumps({'id': '2', 'text': 'b'}))
+    db = TextDB(path)
+    db.append({'id': '3', 'text': 'c'})
+    assert [d['id'] for d in _lines(path)] == ['1', '2', '3']
+
+
+def test_legacy_json_array_is_converted(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([{'id': '1', 'text': 'a'}, {'id': '2', 'text': 'b'}, {'id': '1', 'text': 'a2'}], f)
+    db = TextDB(path)
+    assert [(d['id'], d['text']) for d in db.documents()] == [('2', 'b'), ('1', 'a2')]
+    assert [d['id'] for d in _lines(path)] == ['2', '1']
+    assert db.append({'text': 'c'})['id'] == '3'
+
+
+def test_broken_legacy_array_is_left_alone(path):
+    data = '[{"id": "1", "text": "a"}, {"id": "2"'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    with pytest.raises(ValueError):
+        len(TextDB(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        assert f.read() == data
+
+
+def test_compact_keeps_last_version(path, monkeypatch):
+    monkeypatch.setattr('services.llmkg.text_db.COMPACT_RATIO', 10.0)
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc in ({'id': '1', 'text': 'a'}, {'id': '2', 'text': 'b'}, {'id': '1', 'text': 'a2'}):
+            f.write(json.dumps(doc) + '\n')
+        f.write('not json\n')
+    db = TextDB(path)
+    assert db.stats()['garbage'] >= 1
+    assert db.compact() == {'before': 4, 'after': 2}
+    assert _lines(path) == [{'id': '2', 'text': 'b'}, {'id': '1', 'text': 'a2'}]
+
+
+def test_sqlite_store_continues_file_ids(path, tmp_path):
+    TextDB(path).append_many([{'id': '1', 'text': 'a'}, {'id': '5', 'text': 'b'}])
+    db = storage.SQLiteDB(str(tmp_path / 'kg.sqlite3'))
+    result = storage.migrate(db, sessions_dir=str(tmp_path / 'sessions'), memory_file=str(tmp_path / 'memories.jsonl'),
+                             text_db_file=path)
+    assert result['text_docs'] == 2
+
+    store = storage.SQLiteTextDB(db)
+    docs = store.append_many([{'text': 'c'}, {'id': '5', 'text': 'd'}, {'id': '9', 'text': 'e'}])
+    assert [d['id'] for d in docs] == ['6', '7', '9']
+    assert len(store) == 5 and '9' in store
+    assert [d['text'] for d in store.documents()] == ['a', 'b', 'c', 'd', 'e']
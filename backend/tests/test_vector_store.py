@@ -0,0 +1,148 @@
+import os
+
+import pytest
+
+pytest.importorskip('faiss')
+
+from services.llmkg import index_snapshot
+from services.llmkg import vector_store as vs
+
+DOCS = [
+    {'id': '1', 'text': '电路板焊点虚焊导致接触不良', 'source': 'manual'},
+    {'id': '2', 'text': '电容鼓包需要更换同规格电容', 'source': 'manual'},
+    {'id': '3', 'text': '电源模块输出电压偏低排查步骤', 'source': 'memory'},
+    {'id': '4', 'text': '连接器针脚氧化引起信号中断', 'source': 'manual'},
+    {'id': '5', 'text': '散热风扇停转造成芯片过热保护', 'source': 'memory'},
+]
+
+
+def _reset(monkeypatch, model):
+    """Forget the loaded index, as in a freshly started process."""
+    for name, value in (('_index', None), ('_meta', None), ('_lexical', None), ('_doc_labels', None),
+                        ('_fields', None), ('_active', {}), ('_embed_caches', {}),
+                        ('_query_cache', vs._QueryLRU(vs.QUERY_CACHE_SIZE))):
+        monkeypatch.setattr(vs, name, value)
+    monkeypatch.setattr(vs, '_model', model)
+    monkeypatch.setattr(vs, '_model_id', model.model_id)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, hash_model):
+    monkeypatch.setattr(vs, 'EMBED_CACHE_DIR', str(tmp_path / 'cache'))
+    _reset(monkeypatch, hash_model)
+    paths = {'index_path': str(tmp_path / 'index.faiss'), 'meta_path': str(tmp_path / 'metadata')}
+
+    def reopen():
+        _reset(monkeypatch, hash_model)
+        assert vs.load_index(**paths)
+
+    return {'paths': paths, 'model': hash_model, 'reopen': reopen}
+
+
+def _build(store, docs=DOCS):
+    return vs.build_index_from_texts([dict(d) for d in docs], model_path=None, index_type='flat',
+                                     compression='none', workers=1, **store['paths'])
+
+
+def _top_id(query, **kwargs):
+    res = vs.search(query, k=3, **kwargs)
+    assert res['success']
+    return res['results'][0]['item']['id'] if res['results'] else None
+
+
+def _ids(query, k=10):
+    return {r['item']['id'] for r in vs.search(query, k=k)['results']}
+
+
+def test_build_and_search(store):
+    stats = _build(store)
+    assert stats['docs'] == len(DOCS)
+    assert vs.index_exists(**store['paths'])
+    assert _top_id('电容鼓包需要更换') == '2'
+    assert _ids('电路', k=10) <= {d['id'] for d in DOCS}
+
+
+def test_search_filters_by_metadata(store):
+    _build(store)
+    res = vs.search('电源模块输出电压', k=5, filters={'source': 'manual'})
+    assert res['success']
+    assert res['results'] and all(r['item']['source'] == 'manual' for r in res['results'])
+
+
+def test_upsert_and_delete_are_replayed_from_delta(store):
+    _build(store)
+    res = vs.upsert_documents([{'id': '6', 'text': '继电器触点粘连无法断开'},
+                               {'id': '2', 'text': '保险丝熔断后检查短路点'}], **store['paths'])
+    assert res['success']
+    assert vs.delete_documents(['4'], **store['paths']) == {'success': True, 'deleted': 1}
+    index_file = index_snapshot.resolve(store['paths']['index_path'], vs._store_path(store['paths']['meta_path']))['index_file']
+    assert index_snapshot.delta_log_size(index_file) > 0
+
+    for _ in range(2):
+        assert _top_id('继电器触点粘连') == '6'
+        assert _top_id('保险丝熔断短路') == '2'
+        assert '4' not in _ids('连接器针脚氧化引起信号中断')
+        # 新进程只加载快照和增量日志，结果应与写入进程一致
+        store['reopen']()
+
+
+def test_metadata_only_upsert_skips_embedding(store):
+    _build(store)
+    calls = store['model'].calls
+    doc = dict(DOCS[0], source='memory')
+    assert vs.upsert_documents([doc], **store['paths'])['success']
+    assert store['model'].calls == calls
+    res = vs.search(DOCS[0]['text'], k=1, filters={'source': 'memory'})
+    assert res['results'][0]['item']['id'] == '1'
+
+
+def test_compact_folds_delta_into_snapshot(store):
+    _build(store)
+    vs.upsert_documents([{'id': '7', 'text': '晶振不起振导致系统无法启动'}], **store['paths'])
+    vs.delete_documents(['1'], **store['paths'])
+    assert vs.compact_index(**store['paths'])
+    index_file = vs._active['index_file']
+    assert index_snapshot.delta_log_size(index_file) == 0
+
+    store['reopen']()
+    assert _top_id('晶振不起振') == '7'
+    assert '1' not in _ids('电路板焊点虚焊导致接触不良')
+
+
+def test_rebuild_publishes_new_snapshot(store):
+    _build(store)
+    old = index_snapshot.resolve(store['paths']['index_path'], vs._store_path(store['paths']['meta_path']))
+    _build(store, [{'id': '10', 'text': '变压器异响伴随温升过高'}])
+    new = index_snapshot.resolve(store['paths']['index_path'], vs._store_path(store['paths']['meta_path']))
+    assert new['version'] != old['version']
+    assert _ids('电容鼓包需要更换') == {'10'}
+
+    # 其他进程按 manifest 加载新快照
+    store['reopen']()
+    assert vs._active['version'] == new['version']
+    assert _ids('变压器异响') == {'10'}
+
+
+def test_check_for_updates_replays_other_writers(store, monkeypatch):
+    _build(store)
+    # 记下“读进程”的状态，然后以另一个进程的身份写入
+    reader = {name: getattr(vs, name) for name in ('_index', '_meta', '_lexical', '_active')}
+    reader['_active'] = dict(reader['_active'])
+    store['reopen']()
+    vs.upsert_documents([{'id': '8', 'text': '示波器探头接地不良产生噪声'}], **store['paths'])
+
+    for name, value in reader.items():
+        monkeypatch.setattr(vs, name, value)
+    monkeypatch.setattr(vs, '_doc_labels', None)
+    monkeypatch.setattr(vs, '_fields', None)
+    assert vs.check_for_updates()
+    assert _top_id('示波器探头接地') == '8'
+    assert not vs.check_for_updates()
+
+
+def test_missing_index_reports_not_found(store):
+    assert not vs.index_exists(**store['paths'])
+    assert not vs.load_index(**store['paths'])
+    res = vs.upsert_documents([{'id': '1', 'text': 'x'}], **store['paths'])
+    assert res == {'success': False, 'error': 'index not found'}
+    assert not os.path.exists(store['paths']['index_path'])
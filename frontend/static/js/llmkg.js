@@ -36,6 +36,12 @@ document.addEventListener('DOMContentLoaded', function() {
     // 会话管理（使用后端API）
     let conversations = [];
     let currentConversationId = null;
+    // 服务端已保存的消息数，新消息只追加这之后的部分
+    let savedMessageCount = 0;
+    // conversationMessages[0] 在会话中的序号；更早的消息在滚动到顶部时按页加载
+    let loadedFrom = 0;
+    let loadingOlder = false;
+    const SESSION_PAGE_SIZE = 50;
 
     // 从后端加载会话列表
     async function loadConversations() {
@@ -150,11 +156,13 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // 从后端加载新会话的消息
         try {
-            const res = await fetch(`/api/llm/sessions/${id}`);
+            const res = await fetch(`/api/llm/sessions/${id}?limit=${SESSION_PAGE_SIZE}`);
             const data = await res.json();
             if (data.success) {
                 currentConversationId = id;
                 conversationMessages = data.messages || [];
+                loadedFrom = data.page ? data.page.start : 0;
+                savedMessageCount = loadedFrom + conversationMessages.length;
                 
                 // 更新会话信息
                 const idx = conversations.findIndex(c => c.id === id);
@@ -188,17 +196,80 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         try {
-            const res = await fetch(`/api/llm/sessions/${currentConversationId}/messages`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ messages: conversationMessages })
-            });
+            let res;
+            const localCount = loadedFrom + conversationMessages.length;
+            if (localCount >= savedMessageCount) {
+                // 只追加新消息，expected_seq 用于检测其他页面的并发写入
+                if (localCount === savedMessageCount) return;
+                res = await fetch(`/api/llm/sessions/${currentConversationId}/messages/append`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        messages: conversationMessages.slice(savedMessageCount - loadedFrom),
+                        expected_seq: savedMessageCount
+                    })
+                });
+            } else {
+                // 消息被删减时整体重写，需先加载完整历史
+                while (loadedFrom > 0) {
+                    if (!await loadOlderMessages()) return;
+                }
+                res = await fetch(`/api/llm/sessions/${currentConversationId}/messages`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ messages: conversationMessages })
+                });
+            }
             const data = await res.json();
-            if (!data.success) {
+            if (data.success) {
+                savedMessageCount = loadedFrom + conversationMessages.length;
+            } else if (data.conflict) {
+                await resolveSaveConflict();
+            } else {
                 console.error('保存会话消息失败:', data.error);
+                showStatus('保存会话消息失败: ' + (data.error || '未知错误'), 'error');
             }
         } catch (e) {
             console.error('保存会话消息失败:', e);
+            showStatus('保存会话消息失败，请重试', 'error');
+        }
+    }
+
+    // 会话已在其他页面更新（序号冲突）：重新加载服务端最新的消息，再把本页尚未保存的消息追加在其后
+    async function resolveSaveConflict() {
+        const id = currentConversationId;
+        const unsaved = conversationMessages.slice(Math.max(0, savedMessageCount - loadedFrom));
+        try {
+            const res = await fetch(`/api/llm/sessions/${id}?limit=${SESSION_PAGE_SIZE}`);
+            const data = await res.json();
+            if (!data.success || !data.page || id !== currentConversationId) {
+                showStatus('会话已在其他页面更新，重新加载失败，请切换会话后重试', 'error');
+                return;
+            }
+            loadedFrom = data.page.start;
+            savedMessageCount = data.page.end;
+            conversationMessages = (data.messages || []).concat(unsaved);
+            renderChatHistory();
+            if (unsaved.length === 0) {
+                showStatus('会话已在其他页面更新，已重新加载', 'success');
+                return;
+            }
+            const appendRes = await fetch(`/api/llm/sessions/${id}/messages/append`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ messages: unsaved, expected_seq: savedMessageCount })
+            });
+            const appended = await appendRes.json();
+            if (appended.success) {
+                savedMessageCount = appended.seq;
+                showStatus('会话已在其他页面更新，已重新加载并保存本页的新消息', 'success');
+            } else {
+                // 未保存的消息仍保留在本页，下次保存时再次合并
+                showStatus('会话已在其他页面更新，本页的新消息暂未保存: ' + (appended.error || '未知错误'), 'error');
+            }
+        } catch (e) {
+            console.error('合并会话消息失败:', e);
+            showStatus('会话已在其他页面更新，本页的新消息暂未保存，请重试', 'error');
         }
     }
 
@@ -238,8 +309,40 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // 加载当前会话中更早的一页消息，返回是否成功
+    async function loadOlderMessages() {
+        if (!currentConversationId || loadedFrom === 0 || loadingOlder) return false;
+        const id = currentConversationId;
+        loadingOlder = true;
+        try {
+            const res = await fetch(`/api/llm/sessions/${id}?limit=${SESSION_PAGE_SIZE}&before=${loadedFrom}`);
+            const data = await res.json();
+            if (!data.success || !data.page || id !== currentConversationId) return false;
+            conversationMessages = (data.messages || []).concat(conversationMessages);
+            loadedFrom = data.page.start;
+            // 保持当前可见位置不跳动
+            const prevHeight = chatHistory.scrollHeight;
+            const prevTop = chatHistory.scrollTop;
+            renderChatHistory(false);
+            chatHistory.scrollTop = chatHistory.scrollHeight - prevHeight + prevTop;
+            return true;
+        } catch (e) {
+            console.error('加载更早的消息失败:', e);
+            return false;
+        } finally {
+            loadingOlder = false;
+        }
+    }
+
+    // 滚动到顶部时加载更早的消息（记忆选择模式下消息序号需保持不变）
+    chatHistory.addEventListener('scroll', () => {
+        if (chatHistory.scrollTop < 80 && loadedFrom > 0 && !isMemoryUpdateMode) {
+            loadOlderMessages();
+        }
+    });
+
     // 渲染聊天历史
-    function renderChatHistory() {
+    function renderChatHistory(scrollToBottom = true) {
         if (!chatHistory) return;
         
         chatHistory.innerHTML = '';
@@ -265,7 +368,9 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         }
         
-        chatHistory.scrollTop = chatHistory.scrollHeight;
+        if (scrollToBottom) {
+            chatHistory.scrollTop = chatHistory.scrollHeight;
+        }
     }
 
     // 记忆更新相关状态
@@ -444,7 +549,21 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ messages: selectedMessages })
             });
             
-            const data = await res.json();
+            let data = await res.json();
+            
+            // 后台任务：轮询直到结束；同一选段已总结过时直接返回已有记忆
+            if (data.success && data.job_id) {
+                let job = null;
+                while (true) {
+                    await new Promise(r => setTimeout(r, 500));
+                    const jr = await fetch(`/api/jobs/${data.job_id}`);
+                    job = (await jr.json()).job;
+                    if (!job || !['queued', 'running'].includes(job.status)) break;
+                }
+                data = (job && job.status === 'succeeded')
+                    ? job.result
+                    : { success: false, error: (job && job.error) || '总结任务失败' };
+            }
             
             if (data.success) {
                 currentMemoryId = data.memory_id;
@@ -670,7 +789,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ 
                     question: question,
-                    messages: conversationMessages  // 发送对话历史
+                    messages: conversationMessages,  // 发送对话历史
+                    // 服务端用会话的滚动总结代替较早的轮次；messages_start 为 messages[0] 在会话中的序号
+                    session_id: currentConversationId,
+                    messages_start: loadedFrom
                 })
             });
 
@@ -1289,10 +1411,23 @@ document.addEventListener('DOMContentLoaded', function() {
             try {
                 const res = await fetch('/api/kg/schema/rebuild', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: '{}' });
                 const data = await res.json();
-                if (data.success) {
+                if (!data.job_id) {
+                    showStatus('Schema 更新失败: ' + (data.error || '未知错误'), 'error');
+                    return;
+                }
+                // 后台任务：轮询直到结束（已有重建在进行时同样跟踪该任务）
+                showStatus('Schema 正在从 CSV 重建…', 'info');
+                let job = null;
+                while (true) {
+                    await new Promise(r => setTimeout(r, 500));
+                    const jr = await fetch(`/api/jobs/${data.job_id}`);
+                    job = (await jr.json()).job;
+                    if (!job || !['queued', 'running'].includes(job.status)) break;
+                }
+                if (job && job.status === 'succeeded') {
                     showStatus('Schema 已从 CSV 更新', 'success');
                 } else {
-                    showStatus('Schema 更新失败: ' + (data.error || '未知错误'), 'error');
+                    showStatus('Schema 更新失败: ' + ((job && job.error) || '未知错误'), 'error');
                 }
             } catch (e) {
                 console.error(e);